@@ -0,0 +1,119 @@
+"""
+Page cache format: pickled Grab pages against PageCache._writePage (zlib
+compressed .body file named by its hash and json meta for the index) and
+the uncompressed .raw file of the bodies of mapMinBytes, read as
+MappedBody. Measures the write and read throughput and the size on disk,
+the meta is counted into the size.
+
+200 listing pages, 17.4 MB of bodies:
+  pickle     write  57 MB/s, read  110 MB/s, disk 17.85 MB
+  body file  write  32 MB/s, read  340 MB/s, disk  1.63 MB
+  raw file   write  55 MB/s, read 1000 MB/s, disk 17.44 MB
+"""
+from __future__ import print_function
+import os
+import os.path
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+import grab
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+PAGES = 200
+ITEMS = 1000
+
+
+def createBody(n):
+    rows = []
+    i = 0
+    while i < ITEMS:
+        rows.append('<li class="item"><a href="/item/{0}/{1}">Item {1}</a>'
+                    '<span class="price">{2} USD</span></li>'.format(
+                        n, i, i * 7 % 1000))
+        i += 1
+    return '<html><head><meta charset="utf-8"><title>Page {0}</title>' \
+        '</head><body><ul>{1}</ul></body></html>'.format(n, ''.join(rows))
+
+
+def createPages():
+    pages = []
+    n = 0
+    while n < PAGES:
+        g = grab.Grab()
+        url = 'http://example.com/list/{0}'.format(n)
+        g.setup_document(createBody(n), url=url)
+        g.response.url = url
+        g.response.code = 200
+        g.response.headers['Content-Type'] = 'text/html; charset=utf-8'
+        pages.append(ps.WebPage(g, url=url))
+        n += 1
+    return pages
+
+
+def dirSize(path):
+    size = 0
+    for dirPath, _, fileNames in os.walk(path):
+        for fileName in fileNames:
+            size += os.path.getsize(os.path.join(dirPath, fileName))
+    return size
+
+
+def benchPickle(pages, path):
+    startTime = time.time()
+    for i, page in enumerate(pages):
+        pageFile = open(os.path.join(path, str(i) + '.pickle'), 'wb')
+        pickle.Pickler(pageFile, pickle.HIGHEST_PROTOCOL).dump(page)
+        pageFile.close()
+    writeTime = time.time() - startTime
+    startTime = time.time()
+    for i in range(len(pages)):
+        pageFile = open(os.path.join(path, str(i) + '.pickle'), 'rb')
+        pickle.Unpickler(pageFile).load()
+        pageFile.close()
+    readTime = time.time() - startTime
+    return writeTime, readTime, dirSize(path)
+
+
+def benchBodyFile(pages, path, mapMinBytes=None):
+    ps.PageCache.cacheDir = path + '/'
+    ps.PageCache.mapMinBytes = mapMinBytes
+    files = []
+    startTime = time.time()
+    for page in pages:
+        files.append(ps.PageCache._writePage(page))
+    writeTime = time.time() - startTime
+    startTime = time.time()
+    for fileName, meta in files:
+        page = ps.PageCache._readPage(fileName, meta)
+        # the mapped body is read here
+        str(page.httpBody)
+    readTime = time.time() - startTime
+    metaSize = sum([len(meta) for _, meta in files])
+    return writeTime, readTime, dirSize(path) + metaSize
+
+
+def benchRawFile(pages, path):
+    return benchBodyFile(pages, path, mapMinBytes=0)
+
+
+def report(name, result, bodySize):
+    writeTime, readTime, size = result
+    print('{0:<10} write {1:7.1f} MB/s, read {2:7.1f} MB/s, disk {3:6.2f} MB'
+          .format(name, bodySize / writeTime / 2**20
+                  , bodySize / readTime / 2**20, float(size) / 2**20))
+
+
+if __name__ == '__main__':
+    pages = createPages()
+    bodySize = sum([len(page.httpBody) for page in pages])
+    print('pages:', PAGES, 'body: {0:.2f} MB'.format(float(bodySize) / 2**20))
+    for name, bench in (('pickle', benchPickle), ('body file', benchBodyFile)
+                        , ('raw file', benchRawFile)):
+        path = tempfile.mkdtemp()
+        try:
+            report(name, bench(pages, path), bodySize)
+        finally:
+            shutil.rmtree(path)
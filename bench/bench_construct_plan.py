@@ -0,0 +1,108 @@
+"""
+Construct throughput of Processor on a 10k row listing page without the
+web: the generic construction (Processor.compilePlan = False) against the
+compiled plan. Every row has 5 nodes and a catcher. The two modes are
+run in turns, ROUNDS times each, so that the noise of the machine falls
+on both, and the medians are printed. The printed trees and the catcher
+calls of both modes are compared. With --profile every mode is run once
+under cProfile and the functions with the most own time are printed.
+"""
+from __future__ import print_function
+import cProfile
+import os
+import os.path
+import pstats
+import StringIO
+import sys
+import time
+from lxml import etree
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+ROWS = 10000
+ROUNDS = 7
+
+
+def createTree():
+    rows = []
+    i = 0
+    while i < ROWS:
+        rows.append('<tr><td class="name"><a href="/item/{0}">Item {0}</a>'
+                    '</td><td class="price">{1} USD</td>'
+                    '<td class="stock">in stock</td></tr>'.format(
+                        i, i * 7 % 1000))
+        i += 1
+    body = '<html><body><table>{0}</table></body></html>'.format(
+        ''.join(rows))
+    return etree.fromstring(body, etree.HTMLParser())
+
+
+def createTemplate(tree, calls):
+    def catcher(instance):
+        calls.append(instance.name._elem)
+    row = ps.TreeXpath(ps.xpath('//tr'), catcher=catcher)
+    row.name = ps.Str(ps.xpath('./td[@class="name"]/a/text()'))
+    price = ps.Str(ps.xpath('./td[@class="price"]/text()'))
+    price.value = ps.Value(ps.reValue('USD'))
+    row.price = price
+    row.link = ps.Url(ps.href('./td[@class="name"]/a'))
+    row.stock = ps.Text(ps.xpath('./td[@class="stock"]'))
+    root = ps.TreeXpath(ps.value(tree))
+    root.rows = [row]
+    return root
+
+
+def construct(tree, compilePlan):
+    calls = []
+    processor = ps.Processor()
+    processor.compilePlan = compilePlan
+    processor.root = createTemplate(tree, calls)
+    startTime = time.time()
+    processor(processor.root)
+    elapsed = time.time() - startTime
+    output = StringIO.StringIO()
+    processor.result.root.printTree(fileObject=output)
+    return elapsed, output.getvalue(), calls
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def profile(tree, compilePlan):
+    processor = ps.Processor()
+    processor.compilePlan = compilePlan
+    processor.root = createTemplate(tree, [])
+    profiler = cProfile.Profile()
+    profiler.runcall(processor, processor.root)
+    stats = pstats.Stats(profiler)
+    print('{0:.2f} s, {1} calls'.format(stats.total_tt, stats.total_calls))
+    stats.sort_stats('tottime').print_stats(8)
+
+
+if __name__ == '__main__':
+    tree = createTree()
+    if '--profile' in sys.argv:
+        for name, compilePlan in (('generic', False), ('plan', True)):
+            print(name, end=': ')
+            profile(tree, compilePlan)
+        sys.exit(0)
+    nodes = ROWS * 6
+    modes = (('generic', False), ('plan', True))
+    times = dict((name, []) for name, _ in modes)
+    results = {}
+    for _ in range(ROUNDS):
+        for name, compilePlan in modes:
+            elapsed, output, calls = construct(tree, compilePlan)
+            times[name].append(elapsed)
+            results[name] = (output, calls)
+    for name, _ in modes:
+        elapsed = median(times[name])
+        print('{0:<8} {1:7.3f} s, {2:8.0f} nodes/s (median of {3})'.format(
+            name, elapsed, nodes / elapsed, ROUNDS))
+    print('plan / generic time: {0:.2f}'.format(
+        median(times['plan']) / median(times['generic'])))
+    print('identical trees:', results['generic'][0] == results['plan'][0]
+          , 'identical catcher calls:'
+          , results['generic'][1] == results['plan'][1])
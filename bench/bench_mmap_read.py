@@ -0,0 +1,149 @@
+"""
+Cached body reads: the zlib body file read into a string (the path before
+MappedBody) against the uncompressed body file mapped by MappedBody.
+Every page is read by PageCache._readPage, hashed and, if it is html,
+parsed, like the parser does. Cold reads drop the files from the OS page
+cache first (posix_fadvise, linux). RSS is measured with the pages held
+the way File instances hold their bodies. Each mode runs in its own
+process.
+"""
+from __future__ import print_function
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+HTML_PAGES = 20
+BINARY_PAGES = 20
+BODY_BYTES = 2 * 2**20
+POSIX_FADV_DONTNEED = 4
+
+
+def createBody(n, html):
+    if not html:
+        return os.urandom(BODY_BYTES)
+    rows = []
+    size = 0
+    i = 0
+    while size < BODY_BYTES:
+        row = '<li class="item"><a href="/item/{0}/{1}">Item {1}</a>' \
+            '<span class="price">{2} USD</span></li>'.format(
+                n, i, i * 7 % 1000)
+        rows.append(row)
+        size += len(row)
+        i += 1
+    return '<html><head><meta charset="utf-8"><title>Page {0}</title>' \
+        '</head><body><ul>{1}</ul></body></html>'.format(n, ''.join(rows))
+
+
+def createPage(n, html):
+    url = 'http://example.com/file/{0}'.format(n)
+    contentType = 'text/html; charset=utf-8' if html \
+        else 'application/octet-stream'
+    response = ps.WebResponse(200, createBody(n, html), url
+                              , {'content-type': contentType})
+    return ps.WebPage(ps.WebDocument(response), url=url)
+
+
+def rss():
+    statm = open('/proc/self/statm').read().split()
+    return int(statm[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def dropFiles(path):
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    for dirPath, _, fileNames in os.walk(path):
+        for fileName in fileNames:
+            fileObject = open(os.path.join(dirPath, fileName), 'rb')
+            libc.posix_fadvise(fileObject.fileno(), ctypes.c_long(0)
+                               , ctypes.c_long(0), POSIX_FADV_DONTNEED)
+            fileObject.close()
+
+
+def readPages(files):
+    """
+    Returns the pages and the read times of the html and binary pages.
+    """
+    pages = []
+    times = {True: 0.0, False: 0.0}
+    for fileName, meta, html in files:
+        startTime = time.time()
+        page = ps.PageCache._readPage(fileName, meta)
+        hashlib.sha1(ps.PageCache._bodyBuffer(page)).hexdigest()
+        if html:
+            page.page.tree
+            page.page._tree = None
+        times[html] += time.time() - startTime
+        pages.append(page)
+    return pages, times[True], times[False]
+
+
+def holdBodies(pages):
+    # File._processing: the mapped body or the body string
+    bodies = []
+    for page in pages:
+        body = page.response.mappedBody
+        if body is None:
+            body = page.httpBody
+        bodies.append(body)
+    return bodies
+
+
+def runMode(mode, path):
+    ps.PageCache.cacheDir = path + '/'
+    ps.PageCache.writeBehind = False
+    if mode == 'zlib':
+        ps.PageCache.mapMinBytes = None
+    files = []
+    n = 0
+    for html, count in ((True, HTML_PAGES), (False, BINARY_PAGES)):
+        for _ in range(count):
+            fileName, meta = ps.PageCache._writePage(createPage(n, html))
+            files.append((fileName, meta, html))
+            n += 1
+    dropFiles(path)
+    _, coldHtml, coldBinary = readPages(files)
+    _, warmHtml, warmBinary = readPages(files)
+    startRss = rss()
+    bodies = holdBodies(readPages(files)[0])
+    heldRss = rss() - startRss
+    print(mode, coldHtml, coldBinary, warmHtml, warmBinary, heldRss)
+
+
+def report(line):
+    values = line.split()
+    mode = values[0]
+    coldHtml, coldBinary, warmHtml, warmBinary, heldRss = \
+        [float(value) for value in values[1:]]
+    print('{0:<5} html (read, hash, parse): cold {1:6.2f}, warm {2:6.2f}'
+          ' ms/page'.format(mode, coldHtml * 1000 / HTML_PAGES
+                            , warmHtml * 1000 / HTML_PAGES))
+    print('{0:<5} binary (read, hash):      cold {1:6.2f}, warm {2:6.2f}'
+          ' ms/page'.format(mode, coldBinary * 1000 / BINARY_PAGES
+                            , warmBinary * 1000 / BINARY_PAGES))
+    print('{0:<5} RSS of the held bodies: {1:.1f} MB'.format(
+        mode, heldRss / 2**20))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        runMode(sys.argv[1], sys.argv[2])
+        sys.exit(0)
+    print('pages: {0} html, {1} binary, {2:.1f} MB each'.format(
+        HTML_PAGES, BINARY_PAGES, float(BODY_BYTES) / 2**20))
+    for mode in ('zlib', 'mmap'):
+        path = tempfile.mkdtemp()
+        try:
+            output = subprocess.check_output([sys.executable, __file__
+                                              , mode, path])
+            report(output.strip().splitlines()[-1])
+        finally:
+            shutil.rmtree(path)
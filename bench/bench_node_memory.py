@@ -0,0 +1,66 @@
+"""
+Memory of a constructed tree of 1M nodes without the web: 200k rows of
+a Str with Value, Unit, Int and Url children, built by Processor from
+value queries. The RSS growth of the construction is divided by the
+number of nodes. An other parssite (a checkout of an older revision) is
+measured when its directory is passed as the argument.
+"""
+from __future__ import print_function
+import gc
+import os
+import os.path
+import sys
+import time
+if len(sys.argv) > 1:
+    sys.path.insert(0, sys.argv[1])
+else:
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+ROWS = 200000
+NODES = ROWS * 5
+
+
+def rss():
+    statm = open('/proc/self/statm').read().split()
+    return int(statm[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def createRows():
+    rows = []
+    i = 0
+    while i < ROWS:
+        rows.append(u'Item #{0} /item/{0} {1} USD'.format(i, i * 7 % 1000))
+        i += 1
+    return rows
+
+
+def createTemplate(rows):
+    row = ps.Str(ps.valueList(rows))
+    row.price = ps.Value(ps.regex(r'(\d+) (USD)'))
+    row.unit = ps.Unit(ps.regex(r'(\d+) (USD)'))
+    row.number = ps.Int(ps.regex(r'#(\d+)'))
+    row.link = ps.Url(ps.regex(r'(/item/\d+)'))
+    root = ps.Str(ps.value(u'listing'))
+    root.rows = [row]
+    return root
+
+
+if __name__ == '__main__':
+    rows = createRows()
+    processor = ps.Processor()
+    processor.root = createTemplate(rows)
+    gc.collect()
+    startRss = rss()
+    startTime = time.time()
+    processor(processor.root)
+    elapsed = time.time() - startTime
+    gc.collect()
+    tree = processor.result.root
+    nodes = len(tree.rows) * 5
+    assert nodes == NODES
+    treeRss = rss() - startRss
+    print('parssite:', os.path.abspath(ps.__file__))
+    print('nodes: {0}, construction {1:.1f} s'.format(nodes, elapsed))
+    print('RSS of the tree: {0:.1f} MB, {1:.0f} bytes/node'.format(
+        float(treeRss) / 2**20, float(treeRss) / nodes))
@@ -0,0 +1,94 @@
+"""
+Proxy failover: the recursive Web._getGrabPageProxy of the previous
+version against the failover loop. Web._loadGrabPage is replaced with a
+stub that fails the first N proxies with a server error holding a
+100 KB body and then returns a page.
+"""
+from __future__ import print_function
+import os.path
+import sys
+import time
+import resource
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+BODY_SIZE = 100000
+
+
+class StubLoader(object):
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, url, currentProxy=None, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            page = ps.WebPage(None, proxy=currentProxy, url=url)
+            raise ps.ProxyServerError(httpCode=504, httpBody='x' * BODY_SIZE
+                                      , page=page)
+        return ps.WebPage(None, proxy=currentProxy, url=url)
+
+
+def recursiveGetGrabPageProxy(url, exceptProxy=None, waitCnt=0
+                              , httpCodeCheck=None):
+    if httpCodeCheck is None:
+        httpCodeCheck = ps.HttpCodeCheck()
+    if exceptProxy is None:
+        exceptProxy = set()
+    proxy = ps.Web._nextProxy(exceptProxy)
+    try:
+        page = ps.Web._loadGrabPage(url, proxy)
+        if page.pageConfirmed:
+            page.regProxyGoodPage()
+    except ps.WebError as e:
+        httpCodeCheck(e.httpCode)
+        exceptProxy.add(proxy)
+        try:
+            page = recursiveGetGrabPageProxy(url, exceptProxy, waitCnt
+                                             , httpCodeCheck)
+            proxy.regFailedRequest(url, e)
+        except ps.AllProxyAlreadyUsed as e1:
+            exceptionList = getattr(e1, 'exceptionList', None)
+            if exceptionList is None:
+                e1.exceptionList = []
+            e1.exceptionList.append(e)
+            raise e1
+    return page
+
+
+def setup(failures):
+    proxies = []
+    i = 0
+    while i < failures + 1:
+        proxies.append(ps.Proxy('10.0.{0}.{1}'.format(i // 256, i % 256)
+                                , '8080', 'http'))
+        i += 1
+    ps.Web._proxies = ps.ProxyPool(proxies)
+    ps.Web._failedProxies = set()
+    ps.Web._retryProxies = []
+    ps.Web._loadGrabPage = staticmethod(StubLoader(failures))
+
+
+def run(getPage, failures):
+    setup(failures)
+    startTime = time.time()
+    try:
+        getPage('http://example.com/')
+        result = '{0:.3f} s'.format(time.time() - startTime)
+    except RuntimeError as e:
+        result = 'RuntimeError: ' + str(e)
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result, maxRss
+
+
+if __name__ == '__main__':
+    ps.Web.proxyStatDir = None
+    ps.Web.maxFailedProxyRequests = 10 ** 6
+    failures = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    if len(sys.argv) > 1 and sys.argv[1] == 'recursive':
+        getPage = recursiveGetGrabPageProxy
+    else:
+        getPage = ps.Web._getGrabPageProxy
+    result, maxRss = run(getPage, failures)
+    print('failures:', failures, result, 'max RSS:', maxRss, 'KB')
@@ -0,0 +1,71 @@
+"""
+Proxy selection: the set difference and reduce of the old Web._nextProxy
+against ProxyPool. Every request selects a proxy with a few excluded ones
+(failover) and then registers the request on it.
+"""
+from __future__ import print_function
+import os.path
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+PROXIES = 10000
+REQUESTS = 500
+EXCLUDED = 3
+
+
+def createProxies():
+    proxies = []
+    i = 0
+    while i < PROXIES:
+        address = '10.{0}.{1}.{2}'.format(i // 65536, i // 256 % 256, i % 256)
+        proxies.append(ps.Proxy(address, '8080', 'http'))
+        i += 1
+    return proxies
+
+
+def oldNextProxy(proxies, exceptProxy):
+    proxies = proxies - exceptProxy
+    return reduce((lambda x, y: x if x.requests <= y.requests else y)
+                  , proxies)
+
+
+def benchOld():
+    proxies = set(createProxies())
+    startTime = time.time()
+    i = 0
+    while i < REQUESTS:
+        exceptProxy = set()
+        while len(exceptProxy) < EXCLUDED:
+            exceptProxy.add(oldNextProxy(proxies, exceptProxy))
+        proxy = oldNextProxy(proxies, exceptProxy)
+        proxy.requests += 1
+        i += 1
+    return time.time() - startTime
+
+
+def benchPool():
+    pool = ps.ProxyPool(createProxies())
+    startTime = time.time()
+    i = 0
+    while i < REQUESTS:
+        exceptProxy = set()
+        while len(exceptProxy) < EXCLUDED:
+            exceptProxy.add(pool.next(exceptProxy))
+        proxy = pool.next(exceptProxy)
+        proxy.requests += 1
+        pool.update(proxy)
+        i += 1
+    return time.time() - startTime
+
+
+if __name__ == '__main__':
+    selections = REQUESTS * (EXCLUDED + 1)
+    oldTime = benchOld()
+    poolTime = benchPool()
+    print('proxies:', PROXIES, 'selections:', selections)
+    print('set + reduce: {0:.3f} s, {1:.1f} us per selection'.format(
+        oldTime, oldTime / selections * 1e6))
+    print('ProxyPool:    {0:.3f} s, {1:.1f} us per selection'.format(
+        poolTime, poolTime / selections * 1e6))
@@ -0,0 +1,74 @@
+"""
+Url reads of nodes deep in a tree without the web: a root with the page
+url, a chain of nodes without urls and a leaf with a relative href, like
+a Url or a Page node under the rows of a listing page. The leaf _url and
+the five _url_* parts are read for every row, the first time and again.
+An other parssite (a checkout of an older revision) is measured when its
+directory is passed as the argument.
+"""
+from __future__ import print_function
+import os
+import os.path
+import sys
+import time
+if len(sys.argv) > 1:
+    sys.path.insert(0, sys.argv[1])
+else:
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+ROWS = 10000
+DEPTHS = (1, 4, 8)
+REPEATS = 3
+
+
+def createRows(depth):
+    root = ps.Str(None)
+    root._url = 'http://example.com/catalog/list?page=3'
+    leaves = []
+    i = 0
+    while i < ROWS:
+        node = root
+        for _ in range(depth):
+            child = ps.Str(None)
+            child.parent = node
+            node = child
+        leaf = ps.Url(None)
+        leaf.parent = node
+        leaf._url = '/item/{0}'.format(i)
+        leaves.append(leaf)
+        i += 1
+    return leaves
+
+
+def readUrls(leaves):
+    for leaf in leaves:
+        leaf._url
+        leaf._url_scheme
+        leaf._url_netloc
+        leaf._url_path
+        leaf._url_query
+        leaf._url_fragment
+
+
+def bench(leaves):
+    startTime = time.time()
+    readUrls(leaves)
+    first = time.time() - startTime
+    best = None
+    for _ in range(REPEATS):
+        startTime = time.time()
+        readUrls(leaves)
+        elapsed = time.time() - startTime
+        if best is None or elapsed < best:
+            best = elapsed
+    return first, best
+
+
+if __name__ == '__main__':
+    print('parssite:', os.path.abspath(ps.__file__))
+    for depth in DEPTHS:
+        leaves = createRows(depth)
+        first, again = bench(leaves)
+        print('depth {0:2}: first {1:6.1f} us/row, again {2:6.1f} us/row'
+              .format(depth, first * 1e6 / ROWS, again * 1e6 / ROWS))
@@ -0,0 +1,77 @@
+"""
+Per node xpath queries on a 10k row listing page: the expression strings
+passed to elem.xpath() (the queries before XPathCache) against
+XpathQueryMixin with the compiled expressions of XPathCache. Every row
+runs the _xpath, _href, _text and _area queries.
+"""
+from __future__ import print_function
+import os
+import os.path
+import sys
+import time
+from lxml import etree
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+ROWS = 10000
+REPEATS = 3
+
+
+def createTree():
+    rows = []
+    i = 0
+    while i < ROWS:
+        rows.append('<tr class="row"><td class="name"><a href="/item/{0}">'
+                    'Item {0}</a></td><td class="price">{1} USD</td>'
+                    '<td class="stock">in stock</td></tr>'.format(
+                        i, i * 7 % 1000))
+        i += 1
+    body = '<html><body><table>{0}</table></body></html>'.format(
+        ''.join(rows))
+    return etree.fromstring(body, etree.HTMLParser())
+
+
+class Node(ps.XpathQueryMixin):
+
+    def __init__(self, elem):
+        self._elem = elem
+
+
+def stringQueries(row):
+    row.xpath('./td[@class="price"]/text()')
+    row.xpath('./td[@class="name"]/a/attribute::href')
+    row.xpath(".//*[normalize-space(text())='in stock']")
+    for element in row.xpath('./td'):
+        if len(element.xpath(u'self::*[@class]')) == 0:
+            break
+
+
+def cachedQueries(row):
+    node = Node(row)
+    node._xpath('./td[@class="price"]/text()')
+    node._href('./td[@class="name"]/a')
+    node._text(u'in stock')
+    node._area('./td', u'[@class]')
+
+
+def bench(queries, rows):
+    best = None
+    for _ in range(REPEATS):
+        startTime = time.time()
+        for row in rows:
+            queries(row)
+        elapsed = time.time() - startTime
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == '__main__':
+    rows = createTree().xpath('//tr')
+    print('rows:', len(rows), 'queries per row: 4')
+    for name, queries in (('strings', stringQueries)
+                          , ('XPathCache', cachedQueries)):
+        elapsed = bench(queries, rows)
+        print('{0:<10} {1:7.1f} us/row, {2:6.3f} s/page'.format(
+            name, elapsed * 1e6 / len(rows), elapsed))
+    print('XPathCache:', ps.XPathCache.stats())
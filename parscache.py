@@ -0,0 +1,262 @@
+# Copyright: 2016, Pavel Konurkin
+# Author: Pavel Konurkin
+# License: BSD
+"""
+Page cache tools
+
+    python parscache.py stats CACHE_DIR
+    python parscache.py compact CACHE_DIR
+    python parscache.py gc CACHE_DIR [--min-age SECONDS]
+    python parscache.py evict CACHE_DIR [--max-bytes BYTES]
+                                        [--max-age SECONDS]
+
+stats prints the page count, the disk size and the age histogram. compact
+removes the index rows of the missing files and vacuums the index. gc
+removes the files not referenced by the index and the temp files left by
+crashes. evict removes the pages loaded longer than --max-age ago (the age
+of the pages imported from url_file.map is the file mtime), then the least
+recently read pages until the cache fits --max-bytes.
+The files are walked by the shard dirs in parallel processes.
+"""
+from __future__ import print_function
+import argparse
+import os
+import os.path
+import re
+import time
+from multiprocessing import Pool
+import parssite as ps
+
+AGE_BOUNDS = ((3600, '1 hour'), (24*3600, '1 day'), (7*24*3600, '1 week')
+              , (30*24*3600, '30 days'), (365*24*3600, '1 year'))
+
+
+def _shards(cacheDir):
+    shards = []
+    for name in sorted(os.listdir(cacheDir)):
+        if len(name) == 2 and os.path.isdir(os.path.join(cacheDir, name)):
+            shards.append(name)
+    return shards
+
+
+def _legacyFileNames(cacheDir):
+    pattern = re.compile(r'^\d+\.pickle$')
+    return [name for name in os.listdir(cacheDir) if pattern.match(name)]
+
+
+def _shardFiles(cacheDir, shard):
+    """
+    (fileName, size, mtime) of the files in the shard dir.
+    """
+    files = []
+    shardDir = os.path.join(cacheDir, shard)
+    for dirPath, _, names in os.walk(shardDir):
+        for name in names:
+            path = os.path.join(dirPath, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            fileName = os.path.relpath(path, cacheDir).replace(os.sep, '/')
+            files.append((fileName, stat.st_size, stat.st_mtime))
+    return files
+
+
+def _shardStats(args):
+    cacheDir, shard = args
+    files = _shardFiles(cacheDir, shard)
+    return len(files), sum([size for _, size, _ in files])
+
+
+def _shardGc(args):
+    cacheDir, shard, minAge = args
+    ps.PageCache.cacheDir = cacheDir
+    referenced = ps.CacheIndex.fileNames(shard + '/')
+    now = time.time()
+    removed = 0
+    removedBytes = 0
+    for fileName, size, mtime in _shardFiles(cacheDir, shard):
+        if fileName in referenced or now - mtime < minAge:
+            continue
+        try:
+            os.remove(os.path.join(cacheDir, fileName))
+        except OSError:
+            continue
+        removed += 1
+        removedBytes += size
+    return removed, removedBytes
+
+
+def _shardMissing(args):
+    cacheDir, shard = args
+    ps.PageCache.cacheDir = cacheDir
+    missing = []
+    for fileName in ps.CacheIndex.fileNames(shard + '/'):
+        if not os.path.exists(os.path.join(cacheDir, fileName)):
+            missing.append(fileName)
+    return missing
+
+
+def _map(function, argsList, processes):
+    pool = Pool(processes)
+    try:
+        return pool.map(function, argsList)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _diskUsage(cacheDir, processes):
+    shards = _shards(cacheDir)
+    results = _map(_shardStats, [(cacheDir, shard) for shard in shards]
+                   , processes)
+    files = sum([count for count, _ in results])
+    size = sum([size for _, size in results])
+    for fileName in _legacyFileNames(cacheDir):
+        files += 1
+        size += os.path.getsize(os.path.join(cacheDir, fileName))
+    return files, size
+
+
+def stats(args):
+    files, size = _diskUsage(args.cacheDir, args.processes)
+    print('pages:', ps.CacheIndex.count())
+    print('files:', files)
+    print('bytes:', size)
+    counts = ps.CacheIndex.ageCounts([bound for bound, _ in AGE_BOUNDS])
+    for (_, name), count in zip(AGE_BOUNDS, counts):
+        print('younger than {0}: {1}'.format(name, count))
+    print('older or unknown:', counts[-1])
+
+
+def compact(args):
+    cacheDir = args.cacheDir
+    argsList = [(cacheDir, shard) for shard in _shards(cacheDir)]
+    missing = set()
+    for shardMissing in _map(_shardMissing, argsList, args.processes):
+        missing.update(shardMissing)
+    for fileName in ps.CacheIndex.legacyFileNames():
+        if not os.path.exists(os.path.join(cacheDir, fileName)):
+            missing.add(fileName)
+    removed = 0
+    for fileName in missing:
+        removed += ps.CacheIndex.removeFileName(fileName)
+    ps.CacheIndex.compact()
+    print('removed rows of missing files:', removed)
+
+
+def gc(args):
+    cacheDir = args.cacheDir
+    argsList = [(cacheDir, shard, args.minAge) for shard in _shards(cacheDir)]
+    results = _map(_shardGc, argsList, args.processes)
+    removed = sum([count for count, _ in results])
+    removedBytes = sum([size for _, size in results])
+    now = time.time()
+    for fileName in _legacyFileNames(cacheDir):
+        path = os.path.join(cacheDir, fileName)
+        if now - os.path.getmtime(path) < args.minAge \
+                or ps.CacheIndex.isReferenced(fileName):
+            continue
+        removedBytes += os.path.getsize(path)
+        os.remove(path)
+        removed += 1
+    print('removed files:', removed, 'bytes:', removedBytes)
+
+
+def _removePage(cacheDir, url, fileName):
+    """
+    Removes the index row of the url and the file if no other row refers to
+    it, returns the freed bytes.
+    """
+    ps.CacheIndex.remove(url)
+    if ps.CacheIndex.isReferenced(fileName):
+        # the same body of another page
+        return 0
+    path = os.path.join(cacheDir, fileName)
+    try:
+        fileSize = os.path.getsize(path)
+        os.remove(path)
+    except OSError:
+        return 0
+    return fileSize
+
+
+def evict(args):
+    cacheDir = args.cacheDir
+    _, size = _diskUsage(cacheDir, args.processes)
+    now = time.time()
+    removed = 0
+    removedBytes = 0
+    done = args.maxAge is None
+    while not done:
+        rows = ps.CacheIndex.oldest()
+        done = len(rows) == 0
+        for url, fileName, loadTime in rows:
+            if loadTime is None:
+                # the rows imported from url_file.map have no load time, the
+                # file tells the age and it is kept in the index
+                try:
+                    loadTime = os.path.getmtime(os.path.join(cacheDir
+                                                             , fileName))
+                except OSError:
+                    loadTime = 0
+                if now - loadTime <= args.maxAge:
+                    ps.CacheIndex.setLoadTime(url, loadTime)
+                    continue
+            elif now - loadTime <= args.maxAge:
+                done = True
+                break
+            fileSize = _removePage(cacheDir, url, fileName)
+            removed += 1
+            size -= fileSize
+            removedBytes += fileSize
+    done = args.maxBytes is None
+    while not done:
+        rows = ps.CacheIndex.leastRecentlyUsed()
+        done = len(rows) == 0
+        for url, fileName, _ in rows:
+            if size <= args.maxBytes:
+                done = True
+                break
+            fileSize = _removePage(cacheDir, url, fileName)
+            removed += 1
+            size -= fileSize
+            removedBytes += fileSize
+    print('removed pages:', removed, 'bytes:', removedBytes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Page cache tools')
+    parser.add_argument('--processes', type=int, default=None
+                        , help='parallel processes, cpu count by default')
+    commands = parser.add_subparsers()
+    command = commands.add_parser('stats', help='page count, size and ages')
+    command.set_defaults(func=stats)
+    command = commands.add_parser('compact'
+                                  , help='remove rows of missing files'
+                                  ' and vacuum the index')
+    command.set_defaults(func=compact)
+    command = commands.add_parser('gc', help='remove unreferenced files')
+    command.add_argument('--min-age', dest='minAge', type=float
+                         , default=3600
+                         , help='keep files younger than it, they can be'
+                         ' written by a running parser right now')
+    command.set_defaults(func=gc)
+    command = commands.add_parser('evict', help='remove the expired and the'
+                                  ' least recently read pages')
+    command.add_argument('--max-bytes', dest='maxBytes', type=int
+                         , default=None, help='disk budget of the cache')
+    command.add_argument('--max-age', dest='maxAge', type=float
+                         , default=None
+                         , help='remove pages older than it in seconds')
+    command.set_defaults(func=evict)
+    for command in commands.choices.values():
+        command.add_argument('cacheDir', help='PageCache.cacheDir')
+    args = parser.parse_args()
+    args.cacheDir = ps.normalizePath(args.cacheDir, itDir=True)
+    ps.PageCache.cacheDir = args.cacheDir
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+# Copyright: 2016, Pavel Konurkin
+# Author: Pavel Konurkin
+# License: BSD
+"""
+Proxy tools
+
+    python parsproxy.py scores PROXY_STAT_DIR SCORE_FILE
+
+builds the proxy score file (Web.proxyScoreFile) from the .proxystat logs
+written by Web._writeLogProxyEvent. The scores of the replayed proxies
+are merged into an existing score file.
+"""
+from __future__ import print_function
+import argparse
+import glob
+import parssite as ps
+
+
+def buildScores(args):
+    statFileNames = []
+    for path in args.stat:
+        if path.endswith('.proxystat'):
+            statFileNames.append(path)
+        else:
+            path = ps.normalizePath(path, itDir=True)
+            statFileNames += glob.glob(path + '*.proxystat')
+    proxyCount = ps.Web.buildProxyScores(statFileNames, args.scoreFile)
+    print('stat files:', len(statFileNames), 'proxies:', proxyCount)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Proxy tools')
+    commands = parser.add_subparsers()
+    scores = commands.add_parser('scores'
+                                 , help='build score file from proxy stats')
+    scores.add_argument('stat', nargs='+'
+                        , help='.proxystat files or dirs with them')
+    scores.add_argument('scoreFile', help='output score file')
+    scores.set_defaults(func=buildScores)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,10 +6,10 @@ import re
 from enum import Enum
 import urlparse
 import urllib
-import copy
 import pickle
 import os
 import os.path
+import errno
 import time
 import random
 import grab.error
@@ -18,6 +18,22 @@ import sys
 import uuid
 import hashlib
 import glob
+import threading
+import collections
+import heapq
+import itertools
+import atexit
+import Queue
+import cStringIO
+import json
+import zlib
+import sqlite3
+import mmap
+from multiprocessing.pool import ThreadPool
+try:
+    import pycurl
+except ImportError:
+    pycurl = None
 
 
 class ParsException(Exception):
@@ -167,10 +183,18 @@ class AllProxyAlreadyUsed(ProxyError):
     pass
 
 
+class ProxyAttemptsExceeded(AllProxyAlreadyUsed):
+    pass
+
+
 class PageCacheError(ParsError):
     pass
 
 
+class NegativeCacheError(WebError):
+    pass
+
+
 class PageCacheWarning(ParsException):
     pass
 
@@ -213,7 +237,12 @@ def mkdirs(path):
         if not os.path.isdir(path):
             raise ParsFileSystemError('Cannot create dir: '+path)
     else:
-        os.makedirs(path)
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            # the dir is created by another process at the same time
+            if e.errno != 17 or not os.path.isdir(path):
+                raise
 
 def normalizePath(path, itDir=False):
     path = path.strip()
@@ -332,6 +361,12 @@ class ControlResult(Enum):
     ok = 2
 
 
+class ProxyState(Enum):
+    closed = 0
+    open = 1
+    halfOpen = 2
+
+
 def printUnicodeInfoByChr(str):
     for ch in str:
         info = "ch='" + ch.encode(ParsBase._encoding) + "' " + \
@@ -401,6 +436,45 @@ class RegexCache(object):
         return pattern
 
 
+class XPathCache(object):
+    """
+    Compiled etree.XPath objects by the expression. The least recently
+    used ones are dropped beyond maxSize.
+    """
+
+    maxSize = 1000
+    _cache = collections.OrderedDict()
+    _hits = 0
+    _misses = 0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def compile(path):
+        with XPathCache._lock:
+            xpath = XPathCache._cache.pop(path, None)
+            if xpath is not None:
+                # move to the most recently used end
+                XPathCache._cache[path] = xpath
+                XPathCache._hits += 1
+                return xpath
+            XPathCache._misses += 1
+        xpath = etree.XPath(path)
+        with XPathCache._lock:
+            XPathCache._cache[path] = xpath
+            while len(XPathCache._cache) > XPathCache.maxSize:
+                XPathCache._cache.popitem(last=False)
+        return xpath
+
+    @staticmethod
+    def stats():
+        with XPathCache._lock:
+            return {
+                'hits': XPathCache._hits,
+                'misses': XPathCache._misses,
+                'size': len(XPathCache._cache),
+            }
+
+
 class Query:
 
     def __init__(self, *args, **kwargs):
@@ -503,8 +577,10 @@ class selfUrl(Query):
 
 class XpathQueryMixin(object):
 
+    __slots__ = ()
+
     def _xpath(self, xpath):
-        return self._elem.xpath(xpath)
+        return XPathCache.compile(xpath)(self._elem)
 
     def _attribute(self, attribute, xpath=None):
         if xpath is None or xpath == '':
@@ -512,7 +588,7 @@ class XpathQueryMixin(object):
         if xpath[len(xpath)-1] != '/':
             xpath += '/'
         xpath += 'attribute::'+attribute
-        return self._elem.xpath(xpath)
+        return XPathCache.compile(xpath)(self._elem)
 
     def _href(self, xpath=None):
         return self._attribute('href', xpath)
@@ -526,8 +602,9 @@ class XpathQueryMixin(object):
             xpath = './/'
         if xpath[len(xpath)-1] == '/':
             xpath += '*'
-        xpath += "[normalize-space(text())='"+text+"']"
-        return self._elem.xpath(xpath)
+        # the text is the variable, the expression is compiled once
+        xpath += '[normalize-space(text())=$text]'
+        return XPathCache.compile(xpath)(self._elem, text=text)
 
     def _tail(self, xpath=None):
         result = []
@@ -542,9 +619,9 @@ class XpathQueryMixin(object):
     def _area(self, xpath, predicate):
         elements = self._xpath(xpath)
         result = []
-        predicate = u'self::*' + predicate
+        predicate = XPathCache.compile(u'self::*' + predicate)
         for element in elements:
-            if len(element.xpath(predicate)) == 0:
+            if len(predicate(element)) == 0:
                 break
             result.append(element)
         return result
@@ -552,6 +629,8 @@ class XpathQueryMixin(object):
 
 class RegexQueryMixin(object):
 
+    __slots__ = ()
+
     def _regex(self, regex):
         pattern = RegexCache.compile(regex)
         return pattern.findall(self._unicode)
@@ -675,12 +754,165 @@ def getHash(instance):
                         + ' or dict ParsBase')
 
 
+class _Prefetcher(object):
+    """
+    Runs instance._prefetch for the query results on a pool of worker
+    threads, keeping at most `concurrency` results ahead of the construction
+    loop. Instances are still constructed one by one in the calling thread,
+    so the result order, catchers and breakers work as without prefetching.
+    The pool is the one of the running Processor call, or an own pool
+    outside of a call. close() drops the pages prefetched for the results
+    that were not constructed.
+    """
+
+    def __init__(self, instance, queryResult, concurrency, pool=None
+                 , args=()):
+        self._instance = instance
+        self._args = args
+        self._queryResult = queryResult
+        self._concurrency = concurrency
+        self._ownPool = pool is None
+        if pool is None:
+            pool = ThreadPool(min(concurrency, len(queryResult)))
+        self._pool = pool
+        self._pending = collections.deque()
+        self._submitted = 0
+        self._urls = []
+        self._closed = False
+
+    def _run(self, queryResult):
+        if self._closed:
+            return
+        try:
+            url = self._instance._prefetch(queryResult, *self._args)
+        except Exception:
+            # The error will be raised again during the construction
+            return
+        if url is not None:
+            self._urls.append(url)
+
+    def _fill(self):
+        resultLen = len(self._queryResult)
+        while self._submitted < resultLen \
+                and len(self._pending) < self._concurrency:
+            queryResult = self._queryResult[self._submitted]
+            self._pending.append(self._pool.apply_async(self._run
+                                                        , (queryResult,)))
+            self._submitted += 1
+
+    def wait(self):
+        self._fill()
+        if len(self._pending) > 0:
+            self._pending.popleft().wait()
+            self._fill()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        # the tasks not started yet return at once
+        while len(self._pending) > 0:
+            self._pending.popleft().wait()
+        if self._ownPool:
+            self._pool.close()
+            self._pool.join()
+        for url in self._urls:
+            PageCache.dropPrefetched(url)
+
+
+class _PostProcessedUnicode(object):
+    """
+    The _unicode of the nodes: the _rawUnicode of the node class passed
+    through _unicodePostProcessing.
+    """
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return instance._unicodePostProcessing(instance._rawUnicode)
+
+    def __set__(self, instance, value):
+        raise AttributeError("can't set attribute")
+
+
+_postProcessedUnicode = _PostProcessedUnicode()
+
+
+class _ParsMeta(type):
+    """
+    Keeps the _unicode of a node class, defined in it or in a mixin, as
+    _rawUnicode and puts _postProcessedUnicode in its place.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        cls = type.__new__(mcs, name, bases, namespace)
+        for klass in cls.__mro__:
+            unicodeAttribute = klass.__dict__.get('_unicode')
+            if unicodeAttribute is not None:
+                if unicodeAttribute is not _postProcessedUnicode:
+                    cls._rawUnicode = unicodeAttribute
+                    cls._unicode = _postProcessedUnicode
+                break
+        return cls
+
+
+class _ParsDefault(object):
+    """
+    A class attribute with the current value of a default of ParsBase. An
+    attribute of the instance or of a subclass overrides it.
+    """
+
+    def __init__(self, defaultName):
+        self.defaultName = defaultName
+
+    def __get__(self, instance, owner):
+        return getattr(ParsBase, self.defaultName)
+
+
+def _urlPartProperty(index):
+    def getPart(self):
+        urlParts = self._urlParts
+        if urlParts is None:
+            return ''
+        return urlParts[index]
+
+    def setPart(self, value):
+        self._setUrlPart(index, value)
+    return property(getPart, setPart)
+
+
 class ParsBase(object):
 
+    __metaclass__ = _ParsMeta
+
+    # The nodes keep their attributes in slots. The children and the
+    # attributes set by the user go to __dict__, which is created on the
+    # first such attribute, so a leaf has no dict.
+    __slots__ = ('_query', 'parent', '_childNames', '_structure', '_name'
+                 , '_urlParts', '_queryArgs', '_queryKwargs', '_key', '_elem'
+                 , '_replaceObj', '_catcher', '_flags', '_breaker'
+                 , '_maxIteration', '_hash', '_treeHash', '_urlCache'
+                 , '__dict__')
+
+    _needControlFlag = 1
+    _catcherCalledFlag = 2
+    _treeKeyFlag = 4
+    # the kept url of another node depends on the url or the parent of
+    # this node
+    _urlBaseFlag = 8
+    # _url_local and its split parts when any of them is set, the resolved
+    # url and its parts have the same layout
+    _urlPartsEmpty = ('', '', '', '', '', '')
+    # the kept urls are valid while the generation is the same
+    _urlGeneration = 0
+    _urlLock = threading.Lock()
+    _slotAccessors = {}
+
     _encoding = 'utf-8'
     _NoneObjectUnicode = u'None'
     _saveInstanceDefault = True
     _maxAttemptsDefault = 3
+    _concurrencyDefault = None
 
     @staticmethod
     def _unicodePostProcessingDefault(unistr):
@@ -691,19 +923,20 @@ class ParsBase(object):
         pass
 
     _unicodePostProcessing = _unicodePostProcessingDefault
+    _saveInstance = _ParsDefault('_saveInstanceDefault')
+    _maxAttempts = _ParsDefault('_maxAttemptsDefault')
+    _concurrency = _ParsDefault('_concurrencyDefault')
+    _maxAge = None
 
     def __init__(self, query, replaceObj=None, **kwargs):
+        self._urlCache = None
+        self._flags = 0
         self._query = query
         self.parent = None
         self._childNames = set()
         self._structure = Structure.single
         self._name = None
-        self._url_local = ''
-        self._url_scheme_local = ''
-        self._url_netloc_local = ''
-        self._url_path_local = ''
-        self._url_query_local = ''
-        self._url_fragment_local = ''
+        self._urlParts = None
         self._queryArgs = ()
         self._queryKwargs = {}
         self._key = None
@@ -716,6 +949,9 @@ class ParsBase(object):
         maxAttempts = kwargs.pop('maxAttempts', None)
         if maxAttempts is not None:
             self._maxAttempts = maxAttempts
+        concurrency = kwargs.pop('concurrency', None)
+        if concurrency is not None:
+            self._concurrency = concurrency
         self._breaker = kwargs.pop('breaker', ParsBase._breakerDefault)
         self._maxIteration = kwargs.pop('maxIteration', None)
         self._hash = None
@@ -738,36 +974,74 @@ class ParsBase(object):
         if self._url_fragment_local == '':
             self._url_fragment_local = fromInstance._url_fragment_local
 
-    def __getattribute__(self, name):
-        if name == '_unicode':
-            result = object.__getattribute__(self, name)
-            return self._unicodePostProcessing(result)
+    def _setFlag(self, flag, value):
+        if value:
+            object.__setattr__(self, '_flags', self._flags | flag)
         else:
-            return object.__getattribute__(self, name)
+            object.__setattr__(self, '_flags', self._flags & ~flag)
 
-    def __getattr__(self, name):
-        if name == '_unicodePostProcessing':
-            return ParsBase._unicodePostProcessing
-        elif name == '_saveInstance':
-            return ParsBase._saveInstanceDefault
-        elif name == '_maxAttempts':
-            return ParsBase._maxAttemptsDefault
-        else:
-            raise AttributeError(name)
+    @property
+    def _needControl(self):
+        return self._flags & ParsBase._needControlFlag != 0
+
+    @_needControl.setter
+    def _needControl(self, value):
+        self._setFlag(ParsBase._needControlFlag, value)
+
+    @property
+    def _catcherCalled(self):
+        return self._flags & ParsBase._catcherCalledFlag != 0
+
+    @_catcherCalled.setter
+    def _catcherCalled(self, value):
+        self._setFlag(ParsBase._catcherCalledFlag, value)
+
+    @property
+    def _treeKey(self):
+        return self._flags & ParsBase._treeKeyFlag != 0
+
+    @_treeKey.setter
+    def _treeKey(self, value):
+        self._setFlag(ParsBase._treeKeyFlag, value)
+
+    def _setUrlPart(self, index, value):
+        if value is None:
+            value = ''
+        urlParts = self._urlParts
+        if urlParts is None:
+            if value == '':
+                return
+            urlParts = ParsBase._urlPartsEmpty
+        urlParts = urlParts[:index] + (value,) + urlParts[index + 1:]
+        if urlParts == ParsBase._urlPartsEmpty:
+            urlParts = None
+        object.__setattr__(self, '_urlParts', urlParts)
+        self._dropUrlCache()
+
+    def _setUrlLocal(self, value):
+        if value is None:
+            value = ''
+        urlParts = (value,) + tuple(urlparse.urlsplit(value))
+        if urlParts == ParsBase._urlPartsEmpty:
+            urlParts = None
+        object.__setattr__(self, '_urlParts', urlParts)
+        self._dropUrlCache()
+
+    _url_local = property(_urlPartProperty(0).fget, _setUrlLocal)
+    _url_scheme_local = _urlPartProperty(1)
+    _url_netloc_local = _urlPartProperty(2)
+    _url_path_local = _urlPartProperty(3)
+    _url_query_local = _urlPartProperty(4)
+    _url_fragment_local = _urlPartProperty(5)
 
     def __setattr__(self, name, value):
         if name[0] != '_' and name != 'parent': # and isParsStructure(value):
             if not self._childNameExists(name):
                 return self._setChild(value, name)
             return object.__setattr__(self, name, value)
-        if name in ('_url_local', '_url_scheme_local', '_url_netloc_local'
-                    , '_url_path_local', '_url_query_local'
-                    , '_url_fragment_local') and value is None:
-            value = ''
-        if name == '_url_local':
-            self._url_scheme, self._url_netloc, self._url_path, self._url_query\
-                , self._url_fragment = urlparse.urlsplit(value)
-        if name == '_structure':
+        if name == 'parent':
+            self._dropUrlCache()
+        elif name == '_structure':
             if value not in (Structure.single, Structure.list, Structure.dict):
                 raise StructureError('Structure should by Structure.single or \
                                     Structure.list')
@@ -786,21 +1060,86 @@ class ParsBase(object):
 
     @property
     def _url(self):
-        return urlparse.urlunsplit((self._url_scheme, self._url_netloc,
-                                   self._url_path, self._url_query,
-                                   self._url_fragment))
+        return self._resolvedUrlParts()[0]
 
     @_url.setter
     def _url(self, value):
-        self._url_local = value
+        self._setUrlLocal(value)
+
+    def _resolvedUrlParts(self):
+        """
+        The url and its parts resolved against the url of the parents, in
+        the layout of _urlParts. The local url is joined with the parent url
+        as urljoin does, so it is the url PageBase._absoluteUrl gives for
+        the same href: a relative path is resolved against the directory of
+        the parent url, not appended to it. A node without local parts has
+        the tuple of its nearest parent with them. A url with a scheme does
+        not depend on the parents.
+        The result is kept with the generation it was resolved in. The
+        parents it was resolved through are marked by _urlBaseFlag, only
+        their changes start a new generation, see _dropUrlCache.
+        """
+        urlCache = self._urlCache
+        if urlCache is not None and urlCache[0] == ParsBase._urlGeneration:
+            return urlCache[1]
+        generation = ParsBase._urlGeneration
+        urlBaseFlag = ParsBase._urlBaseFlag
+        urlParts = self._urlParts
+        parentParts = ParsBase._urlPartsEmpty
+        if urlParts is None or urlParts[1] == '':
+            # the parents without local parts are passed over, the mark is
+            # set before the parent is read, so a later change is seen
+            parent = self.parent
+            while parent is not None:
+                if not parent._flags & urlBaseFlag:
+                    object.__setattr__(parent, '_flags'
+                                       , parent._flags | urlBaseFlag)
+                if parent._urlParts is not None:
+                    parentParts = parent._resolvedUrlParts()
+                    break
+                parent = parent.parent
+        if urlParts is None:
+            resolved = parentParts
+        elif parentParts[0] == '':
+            url = urlparse.urlunsplit(urlParts[1:])
+            resolved = (url,) + urlParts[1:]
+        else:
+            _, scheme, netloc, path, query, fragment = urlParts
+            if (netloc == '' and path[:1] not in ('', '/')) \
+                    or parentParts[1] not in urlparse.uses_relative:
+                # the relative path is merged with the parent path
+                url = urlparse.urljoin(parentParts[0]
+                                       , urlparse.urlunsplit(urlParts[1:]))
+                resolved = (url,) + tuple(urlparse.urlsplit(url))
+            else:
+                # the shortcuts of urljoin: the query is inherited with the
+                # path, the fragment is not
+                if scheme == '':
+                    scheme = parentParts[1]
+                    if netloc == '':
+                        netloc = parentParts[2]
+                        if path == '':
+                            path = parentParts[3]
+                            if query == '':
+                                query = parentParts[4]
+                url = urlparse.urlunsplit((scheme, netloc, path, query
+                                           , fragment))
+                resolved = (url, scheme, netloc, path, query, fragment)
+        object.__setattr__(self, '_urlCache', (generation, resolved))
+        return resolved
+
+    def _dropUrlCache(self):
+        if self._urlCache is not None:
+            object.__setattr__(self, '_urlCache', None)
+        if self._flags & ParsBase._urlBaseFlag:
+            # the urls kept through this node are stale, the changes of
+            # the nodes nobody resolved through keep the others
+            with ParsBase._urlLock:
+                ParsBase._urlGeneration += 1
 
     @property
     def _url_scheme(self):
-        result = self._url_scheme_local
-        if result == '':
-            if self.parent is not None:
-                result = self.parent._url_scheme
-        return result
+        return self._resolvedUrlParts()[1]
 
     @_url_scheme.setter
     def _url_scheme(self, value):
@@ -808,12 +1147,7 @@ class ParsBase(object):
 
     @property
     def _url_netloc(self):
-        result = self._url_netloc_local
-        if result == '':
-            if self._url_scheme_local == '':
-                if self.parent is not None:
-                    result = self.parent._url_netloc
-        return result
+        return self._resolvedUrlParts()[2]
 
     @_url_netloc.setter
     def _url_netloc(self, value):
@@ -821,12 +1155,7 @@ class ParsBase(object):
 
     @property
     def _url_path(self):
-        result = self._url_path_local
-        if result == '':
-            if self._url_scheme_local == self._url_netloc_local == '':
-                if self.parent is not None:
-                    result = self.parent._url_path
-        return result
+        return self._resolvedUrlParts()[3]
 
     @_url_path.setter
     def _url_path(self, value):
@@ -834,13 +1163,7 @@ class ParsBase(object):
 
     @property
     def _url_query(self):
-        result = self._url_query_local
-        if result == '':
-            if self._url_scheme_local == self._url_netloc_local ==\
-                    self._url_path_local == '':
-                if self.parent is not None:
-                    result = self.parent._url_query
-        return result
+        return self._resolvedUrlParts()[4]
 
     @_url_query.setter
     def _url_query(self, value):
@@ -848,13 +1171,7 @@ class ParsBase(object):
 
     @property
     def _url_fragment(self):
-        result = self._url_fragment_local
-        if result == '':
-            if self._url_scheme_local == self._url_netloc_local ==\
-                    self._url_path_local == '':
-                if self.parent is not None:
-                    result = self.parent._url_fragment
-        return result
+        return self._resolvedUrlParts()[5]
 
     @_url_fragment.setter
     def _url_fragment(self, value):
@@ -863,9 +1180,40 @@ class ParsBase(object):
     def _selfUrl(self):
         return [self._url]
 
+    @staticmethod
+    def _slotAccessorList(cls):
+        """
+        The (get, set) pairs of the slot descriptors of the class.
+        """
+        accessors = ParsBase._slotAccessors.get(cls)
+        if accessors is None:
+            accessors = []
+            for klass in cls.__mro__:
+                slots = klass.__dict__.get('__slots__', ())
+                if isinstance(slots, basestring):
+                    slots = (slots,)
+                for name in slots:
+                    if name not in ('__dict__', '__weakref__'):
+                        descriptor = klass.__dict__[name]
+                        accessors.append((descriptor.__get__
+                                          , descriptor.__set__))
+            ParsBase._slotAccessors[cls] = accessors
+        return accessors
+
+    def _copyTo(self, clone):
+        for getSlot, setSlot in ParsBase._slotAccessorList(self.__class__):
+            try:
+                setSlot(clone, getSlot(self))
+            except AttributeError:
+                pass
+        attributes = self.__dict__
+        if attributes:
+            clone.__dict__.update(attributes)
+
     def _clone(self):
-        clone = copy.copy(self)
-        clone._childNames = copy.copy(self._childNames)
+        # _childNames is shared with the clone, _setChild replaces it
+        clone = self.__class__.__new__(self.__class__)
+        self._copyTo(clone)
         if clone._replaceObj is not None:
             clone._replaceObj = clone._replaceObj._clone()
         return clone
@@ -891,7 +1239,7 @@ class ParsBase(object):
         if hasattr(self, name):
             raise SetChildError('Attribute ' + name + ' already exists')
         result = object.__setattr__(self, name, child)
-        self._childNames.add(name)
+        self._childNames = self._childNames | set([name])
         return result
 
     def __call__(self, *args, **kwargs):
@@ -911,6 +1259,9 @@ class ParsBase(object):
 
     def _runQuery(self, query=None):
         if query is None:
+            plan = _Plan.of(self)
+            if plan is not None:
+                return plan.runQuery(self)
             query = self._query
         if query is None:
             raise UndefinedQuery
@@ -1046,7 +1397,7 @@ class ParsBase(object):
             return {}
         elif self._structure == Structure.single:
             instance = self._clone()
-            instance._elem = None
+            _setElem(instance, None)
             for childName in instance:
                 instance[childName].parent = instance
                 instance[childName] = instance[childName]._noneConstruct()
@@ -1058,6 +1409,11 @@ class ParsBase(object):
     def _instanceConstruct(self, queryResult
                            , saveInstance=False
                            , oldAttemptsInstances=None):
+        if oldAttemptsInstances is None:
+            plan = _Plan.of(self)
+            if plan is not None:
+                return plan.instanceConstruct(self, queryResult
+                                              , saveInstance)
         saveInstanceOriginal = saveInstance
         saveInstance = saveInstance or self._saveInstance
         catcher = self._catcher
@@ -1067,7 +1423,7 @@ class ParsBase(object):
             saveChild = True
         saveChild = saveChild or saveInstance
         instance = self._clone()
-        instance._elem = queryResult
+        _setElem(instance, queryResult)
         if oldAttemptsInstances is None or oldAttemptsInstances == []:
             instance._processing()
         else:
@@ -1122,7 +1478,7 @@ class ParsBase(object):
                     catcher(instance)
                 except DuplicateTree:
                     pass
-                instance._catcherCalled = True
+                instance._setFlag(ParsBase._catcherCalledFlag, True)
         if self._structure == Structure.dict:
             if key is None and (instance is None or instance._elem is None):
                 return None, None
@@ -1139,19 +1495,54 @@ class ParsBase(object):
             else:
                 return None
 
+    def _prefetch(self, queryResult):
+        """
+        Loads in a worker thread what the construction of the instance for
+        queryResult will need. Returns the url of the prefetched page, or
+        None. The nodes are shared with the constructing thread, so it only
+        reads them; what it needs from the tree is passed by _prefetchArgs.
+        """
+        pass
+
+    def _prefetchArgs(self):
+        """
+        The arguments of _prefetch after queryResult, taken from the tree in
+        the constructing thread.
+        """
+        return ()
+
+    def _prefetcher(self, queryResult):
+        if type(self)._prefetch.im_func is ParsBase._prefetch.im_func:
+            return None
+        concurrency = self._concurrency
+        if concurrency is None or concurrency <= 1 or len(queryResult) < 2:
+            return None
+        if self._maxIteration is not None:
+            queryResult = queryResult[:self._maxIteration]
+        return _Prefetcher(self, queryResult, concurrency
+                           , Processor._prefetchPool(concurrency)
+                           , self._prefetchArgs())
+
     def _listInstanceConstruct(self, listQueryResult, saveInstance=False):
         saveInstance = saveInstance or self._saveInstance
         instanceList = []
         iterNumber = 0
-        for queryResult in listQueryResult:
-            if self._maxIteration is not None:
-                iterNumber += 1
-                if iterNumber > self._maxIteration:
-                    break
-            instance = self._instanceConstruct(queryResult, saveInstance)
-            if saveInstance and instance is not None \
-                    and instance._elem is not None:
-                instanceList.append(instance)
+        prefetcher = self._prefetcher(listQueryResult)
+        try:
+            for queryResult in listQueryResult:
+                if self._maxIteration is not None:
+                    iterNumber += 1
+                    if iterNumber > self._maxIteration:
+                        break
+                if prefetcher is not None:
+                    prefetcher.wait()
+                instance = self._instanceConstruct(queryResult, saveInstance)
+                if saveInstance and instance is not None \
+                        and instance._elem is not None:
+                    instanceList.append(instance)
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
         if saveInstance:
             return instanceList
         else:
@@ -1163,21 +1554,28 @@ class ParsBase(object):
         resultLen = len(queryResult)
         i = 0
         iterNumber = 0
-        while i < resultLen:
-            if self._maxIteration is not None:
-                iterNumber += 1
-                if iterNumber > self._maxIteration:
-                    break
-            key, instance = self._instanceConstruct(queryResult[i]
-                                                    , saveInstance)
-            if key is None and instance is None:
+        prefetcher = self._prefetcher(queryResult)
+        try:
+            while i < resultLen:
+                if self._maxIteration is not None:
+                    iterNumber += 1
+                    if iterNumber > self._maxIteration:
+                        break
+                if prefetcher is not None:
+                    prefetcher.wait()
+                key, instance = self._instanceConstruct(queryResult[i]
+                                                        , saveInstance)
+                if key is None and instance is None:
+                    i += 1
+                    continue
+                if key is None:
+                    key = i
+                if saveInstance and instance is not None:
+                    instanceDict[key] = instance
                 i += 1
-                continue
-            if key is None:
-                key = i
-            if saveInstance and instance is not None:
-                instanceDict[key] = instance
-            i += 1
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
         if saveInstance:
             return instanceDict
         else:
@@ -1187,6 +1585,9 @@ class ParsBase(object):
         return queryResult
 
     def _construct(self, saveInstance=False):
+        plan = _Plan.of(self)
+        if plan is not None:
+            return plan.construct(self, saveInstance)
         saveInstance = saveInstance or self._saveInstance
         queryResult = self._runQuery()
         queryResult = self._prepareQueryResult(queryResult)
@@ -1300,10 +1701,276 @@ class Container:
     pass
 
 
+# the construction sets these slots past ParsBase.__setattr__
+_setParent = ParsBase.__dict__['parent'].__set__
+_setElem = ParsBase.__dict__['_elem'].__set__
+_setReplaceObj = ParsBase.__dict__['_replaceObj'].__set__
+
+
+class _Plan(object):
+    """
+    The construction of a template node compiled by Processor. The query
+    with its merged arguments, the child names and the attributes of the
+    template are read once, the instances are cloned and filled through
+    the slot descriptors and __dict__. The retries of the instance control
+    and the replaceObj nodes go through the ParsBase methods. The Enum
+    members are compared by identity.
+    """
+
+    _methodNames = ('_construct', '_instanceConstruct', '_runQuery', '_clone'
+                    , '__setattr__', '__setitem__', '_setChild'
+                    , '_childNameExists')
+
+    def __init__(self, template):
+        self.cls = template.__class__
+        self.structure = template._structure
+        self.saveInstance = template._saveInstance
+        self.catcher = template._catcher
+        self.breaker = template._breaker
+        self.childNames = tuple(template._childNames)
+        self.slotAccessors = ParsBase._slotAccessorList(self.cls)
+        self.prepare = self.cls._prepareQueryResult.im_func \
+            is not ParsBase._prepareQueryResult.im_func
+        self.query = template._query
+        self.queryName = None
+        self.target = None
+        query = self.query
+        if isinstance(query, Query) \
+                and query.__class__.__call__.im_func is Query.__call__.im_func:
+            getTarget = query.__class__.getTargetInstance.im_func
+            if getTarget is Query.getTargetInstance.im_func:
+                self.queryName = query.queryName
+            elif getTarget in (value.getTargetInstance.im_func
+                               , valueList.getTargetInstance.im_func):
+                self.queryName = query.queryName
+                self.target = query
+        if self.queryName is not None:
+            self.args = query.args + template._queryArgs
+            self.kwargs = query.kwargs.copy()
+            self.kwargs.update(template._queryKwargs)
+            processingName = query.queryResultProcessingName
+            self.processingName = None
+            if getattr(template, processingName, None) is not None:
+                self.processingName = processingName
+
+    @staticmethod
+    def compilable(template):
+        cls = template.__class__
+        for name in _Plan._methodNames:
+            if getattr(cls, name).im_func \
+                    is not getattr(ParsBase, name).im_func:
+                return False
+        return True
+
+    @staticmethod
+    def templates(template):
+        """
+        The template nodes of the tree: children, dict keys and replaceObj.
+        """
+        result = []
+        stack = [template]
+        while len(stack) > 0:
+            node = stack.pop()
+            result.append(node)
+            for childName in node._childNames:
+                stack.append(node.__dict__[childName])
+            if node._key is not None:
+                stack.append(node._key)
+            if node._replaceObj is not None:
+                stack.append(node._replaceObj)
+        return result
+
+    @staticmethod
+    def compile(template):
+        """
+        The plans of all nodes of the template tree by the node id, or None
+        when a node class overrides the construction. The templates are
+        shared by the callers, so the plans are kept by the Processor call
+        and not set on the nodes.
+        """
+        templates = _Plan.templates(template)
+        for node in templates:
+            if not _Plan.compilable(node):
+                return None
+        return dict((id(node), _Plan(node)) for node in templates)
+
+    @staticmethod
+    def of(node):
+        """
+        The plan of the template node in the Processor call running in this
+        thread or None.
+        """
+        processor = getattr(Processor._current, 'processor', None)
+        if processor is None:
+            return None
+        plans = processor._plans
+        if plans is None:
+            return None
+        return plans.get(id(node), None)
+
+    def runQuery(self, node):
+        queryName = self.queryName
+        if queryName is None:
+            query = self.query
+            if query is None:
+                raise UndefinedQuery
+            return query(node, *node._queryArgs, **node._queryKwargs)
+        target = self.target
+        if target is None:
+            target = node.parent
+            if target is None:
+                raise UndefinedParent
+        queryResult = getattr(target, queryName)(*self.args, **self.kwargs)
+        if self.processingName is not None:
+            queryResult = getattr(node, self.processingName)(queryResult)
+        return queryResult
+
+    def construct(self, node, saveInstance):
+        saveInstance = saveInstance or self.saveInstance
+        queryResult = self.runQuery(node)
+        if self.prepare:
+            queryResult = node._prepareQueryResult(queryResult)
+        if type(queryResult) is not list:
+            raise BadQueryResult('The query result should be a list')
+        structure = self.structure
+        if structure is Structure.single:
+            if len(queryResult) == 1:
+                result = self.instanceConstruct(node, queryResult[0]
+                                                , saveInstance)
+            else:
+                result = node._noneConstruct()
+        elif structure is Structure.list:
+            result = node._listInstanceConstruct(queryResult, saveInstance)
+        elif structure is Structure.dict:
+            result = node._dictInstanceConstruct(queryResult, saveInstance)
+        else:
+            raise StructureError('Structure should by Structure.single or \
+                                 Structure.list or Structure.dict')
+        if saveInstance:
+            return result
+        else:
+            return None
+
+    def instanceConstruct(self, node, queryResult, saveInstance):
+        """
+        ParsBase._instanceConstruct of the first attempt.
+        """
+        saveInstanceOriginal = saveInstance
+        saveInstance = saveInstance or self.saveInstance
+        catcher = self.catcher
+        saveChild = catcher is not None or saveInstance
+        instance = self.cls.__new__(self.cls)
+        for getSlot, setSlot in self.slotAccessors:
+            try:
+                setSlot(instance, getSlot(node))
+            except AttributeError:
+                pass
+        nodeDict = node.__dict__
+        if nodeDict:
+            instance.__dict__.update(nodeDict)
+        replaceObj = instance._replaceObj
+        if replaceObj is not None:
+            _setReplaceObj(instance, replaceObj._clone())
+        _setElem(instance, queryResult)
+        instance._processing()
+        needControl = instance._flags & ParsBase._needControlFlag != 0
+        saveChild = saveChild or needControl
+        structure = self.structure
+        key = None
+        if instance._structure is Structure.dict:
+            key = instance._key
+            if key is not None:
+                key.parent = instance
+                key = key._construct(saveInstance=True)
+                key = key._elem
+        noneChilds = saveChild and (structure is Structure.single
+                                    or (structure is Structure.dict
+                                        and key is not None))
+        if instance._replaceObj is not None:
+            instance._replaceObj.parent = instance
+            newInstance = instance._replaceObj._construct(saveInstance=True)
+            newInstance._replaceAttributes(instance)
+            instance = newInstance
+            needControl = instance._needControl
+            for childName in instance:
+                instance[childName].parent = instance
+                if instance._elem is None:
+                    if noneChilds:
+                        instance[childName] = \
+                            instance[childName]._noneConstruct()
+                else:
+                    instance[childName] = \
+                        instance[childName]._construct(saveChild)
+        elif self.childNames:
+            instanceDict = instance.__dict__
+            for childName in self.childNames:
+                child = instanceDict[childName]
+                _setParent(child, instance)
+                if child._urlCache is not None \
+                        or child._flags & ParsBase._urlBaseFlag:
+                    child._dropUrlCache()
+                if instance._elem is None:
+                    if noneChilds:
+                        instanceDict[childName] = child._noneConstruct()
+                else:
+                    instanceDict[childName] = child._construct(saveChild)
+        if needControl:
+            controlResult = instance._instanceControl(None)
+            if controlResult == ControlResult.fault:
+                instance = NoneObject(node)
+            elif controlResult == ControlResult.bad:
+                instance = node._instanceConstruct(
+                    queryResult=queryResult
+                    , saveInstance=saveInstanceOriginal
+                    , oldAttemptsInstances=[instance]
+                )
+            elif controlResult == ControlResult.ok:
+                self.breaker()
+            else:
+                raise ControlResultError('ControlResult should by' \
+                                         + ' ControlResult.ok or' \
+                                         + ' ControlResult.bad or' \
+                                         + ' ControlResult.fault')
+        else:
+            self.breaker()
+        if (catcher is not None) and (not isinstance(instance, NoneObject)) \
+                and instance is not None and instance._elem is not None:
+            if not instance._catcherCalled:
+                try:
+                    catcher(instance)
+                except DuplicateTree:
+                    pass
+                instance._setFlag(ParsBase._catcherCalledFlag, True)
+        if structure is Structure.dict:
+            if key is None and (instance is None or instance._elem is None):
+                return None, None
+            if saveInstance:
+                return key, instance
+            else:
+                return None, None
+        elif structure is Structure.list \
+                and (instance is None or instance._elem is None):
+            return None
+        else:
+            if saveInstance:
+                return instance
+            else:
+                return None
+
+
 class Processor(object):
 
+    compilePlan = True
+    # The worker threads of the prefetch pool shared by the lists of one
+    # call. None: the _concurrency of the first list that prefetches.
+    prefetchThreads = None
+
+    _current = threading.local()
+
     def __init__(self):
         self._result = Container()
+        self._pool = None
+        self._plans = None
 
     @property
     def result(self):
@@ -1319,18 +1986,55 @@ class Processor(object):
         resultName = queryRoot._name
         if resultName is None:
             raise UndefinedQueryRootName()
-        result = queryRoot._construct()
+        outerPlans = self._plans
+        self._plans = None
+        if self.compilePlan:
+            self._plans = _Plan.compile(queryRoot)
+        outerProcessor = getattr(Processor._current, 'processor', None)
+        Processor._current.processor = self
+        constructed = False
+        try:
+            result = queryRoot._construct()
+            constructed = True
+        finally:
+            Processor._current.processor = outerProcessor
+            self._plans = outerPlans
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+            # the pages are on disk when the parsing is over or stopped, the
+            # failed write does not hide the error of the parsing
+            PageCache.flush(raiseError=constructed)
         setattr(self._result, resultName, result)
 
+    @staticmethod
+    def _prefetchPool(concurrency):
+        """
+        The prefetch pool of the Processor call running in this thread,
+        None outside of a call.
+        """
+        processor = getattr(Processor._current, 'processor', None)
+        if processor is None:
+            return None
+        if processor._pool is None:
+            processor._pool = ThreadPool(processor.prefetchThreads
+                                         or concurrency)
+        return processor._pool
+
 
 class ElemTypeMixin(object):
 
+    __slots__ = ()
+
     def printElemType(self):
         print(type(self._elem))
 
 
 class ListElemTypeMixin(object):
 
+    __slots__ = ()
+
     def printElemType(self):
         print('[', end='')
         sep = ''
@@ -1343,6 +2047,8 @@ class ListElemTypeMixin(object):
 
 class UnicodeListMixin(object):
 
+    __slots__ = ()
+
     @property
     def _unicode(self):
         unistr = u'[\n'
@@ -1355,6 +2061,8 @@ class UnicodeListMixin(object):
 
 class UnicodeTextMixin(object):
 
+    __slots__ = ()
+
     @property
     def _unicode(self):
         return etree.tounicode(self._elem, method='text', pretty_print=False
@@ -1363,6 +2071,8 @@ class UnicodeTextMixin(object):
 
 class UnicodeStrMixin(object):
 
+    __slots__ = ()
+
     @property
     def _unicode(self):
         return self._elem
@@ -1370,6 +2080,8 @@ class UnicodeStrMixin(object):
 
 class UnicodeTreeMixin(object):
 
+    __slots__ = ()
+
     @property
     def _unicode(self):
         return etree.tounicode(self._elem, method='html', pretty_print=True
@@ -1382,6 +2094,8 @@ class TreeXpath(UnicodeTreeMixin, XpathQueryMixin, RegexQueryMixin, ParsBase):
 
 class Str(UnicodeStrMixin, RegexQueryMixin, ParsBase):
 
+    __slots__ = ()
+
     def _processing(self):
         elem = self._elem
         if type(elem) is unicode:
@@ -1389,7 +2103,7 @@ class Str(UnicodeStrMixin, RegexQueryMixin, ParsBase):
         if type(elem) is str:
             elem = unicode(elem.decode(ParsBase._encoding))
         else:
-            self._elem = unicode(elem)
+            _setElem(self, unicode(elem))
 
     @property
     def _unicode(self):
@@ -1403,46 +2117,58 @@ class Str(UnicodeStrMixin, RegexQueryMixin, ParsBase):
 
 class Value(Str):
 
+    __slots__ = ()
+
     def _processing(self):
-        self._elem = self._elem[0]
+        _setElem(self, self._elem[0])
         Str._processing(self)
 
 
 class Unit(Str):
 
+    __slots__ = ()
+
     def _processing(self):
-        self._elem = self._elem[1]
+        _setElem(self, self._elem[1])
         Str._processing(self)
 
 
 class Tail(Str):
 
+    __slots__ = ()
+
     def _processing(self):
-        self._elem = unicode(self._elem.tail)
+        _setElem(self, unicode(self._elem.tail))
 
 
 class Text(Str):
 
+    __slots__ = ()
+
     def _processing(self):
-        self._elem = unicode(self._elem.text)
+        _setElem(self, unicode(self._elem.text))
 
 
 class Url(Str):
 
+    __slots__ = ()
+
     def _processing(self):
         Str._processing(self)
-        self._url = self._elem
-        self._elem = self._url
+        self._setUrlLocal(self._elem)
+        _setElem(self, self._url)
 
 
 class Int(ParsBase):
 
+    __slots__ = ()
+
     def _processing(self):
         # intFunc = self._int
         # print(intFunc.func_name)
         # print(dir(intFunc))
         # print(type(intFunc))
-        self._elem = self._int(self._elem)
+        _setElem(self, self._int(self._elem))
 
     @staticmethod
     def _intDefault(number):
@@ -1472,6 +2198,101 @@ class HtmlElements(UnicodeStrMixin, ParsBase):
         self._elem = str
 
 
+class LogSink(object):
+    """
+    Appends lines to the log files on a background thread. write only puts
+    the line into the bounded queue (and waits if the queue is full), the
+    thread writes the lines in batches grouped by file every flushPeriod
+    seconds or every batchSize lines. The lines are written at exit too.
+    """
+
+    queueSize = 10000
+    batchSize = 1000
+    flushPeriod = 1.0
+    _queue = None
+    _thread = None
+    _files = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _start():
+        with LogSink._lock:
+            if LogSink._thread is None:
+                LogSink._queue = Queue.Queue(LogSink.queueSize)
+                LogSink._thread = threading.Thread(target=LogSink._loop
+                                                   , name='LogSink')
+                LogSink._thread.daemon = True
+                LogSink._thread.start()
+                atexit.register(LogSink.close)
+
+    @staticmethod
+    def write(fileName, string):
+        if LogSink._thread is None:
+            LogSink._start()
+        LogSink._queue.put((fileName, string))
+
+    @staticmethod
+    def flush():
+        if LogSink._thread is None:
+            return
+        flushed = threading.Event()
+        LogSink._queue.put((None, flushed))
+        flushed.wait()
+
+    @staticmethod
+    def close():
+        LogSink.flush()
+        with LogSink._lock:
+            for fileName in LogSink._files:
+                LogSink._files[fileName].close()
+            LogSink._files = {}
+
+    @staticmethod
+    def _writeBatch(batch):
+        lines = {}
+        for fileName, string in batch:
+            fileLines = lines.get(fileName, None)
+            if fileLines is None:
+                fileLines = []
+                lines[fileName] = fileLines
+            fileLines.append(string)
+        with LogSink._lock:
+            for fileName in lines:
+                logFile = LogSink._files.get(fileName, None)
+                if logFile is None:
+                    logFile = open(fileName, 'a')
+                    LogSink._files[fileName] = logFile
+                logFile.write(''.join(lines[fileName]))
+                logFile.flush()
+
+    @staticmethod
+    def _loop():
+        queue = LogSink._queue
+        while True:
+            batch = []
+            flushed = []
+            flushTime = time.time() + LogSink.flushPeriod
+            while len(batch) < LogSink.batchSize and len(flushed) == 0:
+                timeout = flushTime - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    fileName, string = queue.get(True, timeout)
+                except Queue.Empty:
+                    break
+                if fileName is None:
+                    flushed.append(string)
+                else:
+                    batch.append((fileName, string))
+            try:
+                LogSink._writeBatch(batch)
+            except Exception as e:
+                print('LogSink: ' + className(e) + ': ' + str(e)
+                      , file=sys.stderr)
+            for event in flushed:
+                event.set()
+
+
 class WebPage(object):
 
     __module__ = os.path.splitext(os.path.basename(__file__))[0]
@@ -1487,12 +2308,15 @@ class WebPage(object):
         self.url = kwargs.get('url', None)
         self.uuid = uuid.uuid4()
         self.proxyEventRegistered = False
+        self.loadTime = time.time()
 
     def __getattr__(self, name):
         if name == 'pageConfirmed':
             return WebPage.pageConfirmedDefault
         if name == 'proxy':
             return None
+        if name == 'loadTime':
+            return None
         else:
             raise AttributeError(name)
 
@@ -1531,6 +2355,15 @@ class WebPage(object):
         except AttributeError:
             return None
 
+    def header(self, name):
+        """
+        The response header by the lowercase name or None.
+        """
+        headers = getattr(self.response, 'headers', None)
+        if headers is None:
+            return None
+        return headers.get(name, None)
+
 
 class Proxy(object):
 
@@ -1546,6 +2379,112 @@ class Proxy(object):
         self.successRequests = 0
         self.failedRequests = 0
         self.failed = False
+        self.latency = None
+        self.errorRate = 0.0
+        self.state = ProxyState.closed
+        self.stateFailedRequests = 0
+        self.trips = 0
+        self.retryTime = None
+
+    def cost(self):
+        latency = self.latency
+        if latency is None:
+            latency = Web.proxyDefaultLatency
+        return latency / max(1.0 - self.errorRate, 0.05)
+
+    def priority(self):
+        # The requests are spread inversely proportional to the cost
+        return (self.requests + 1) * self.cost()
+
+    def regLatency(self, seconds):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            alpha = Web.proxyEwmaAlpha
+            self.latency = (1 - alpha) * self.latency + alpha * seconds
+        Web._proxyChanged(self)
+
+    def _regResult(self, failed):
+        alpha = Web.proxyEwmaAlpha
+        self.errorRate = (1 - alpha) * self.errorRate
+        if failed:
+            self.errorRate += alpha
+
+    def _needTrip(self):
+        if self.state == ProxyState.halfOpen:
+            return True
+        if self.stateFailedRequests <= Web.maxFailedProxyRequests:
+            return False
+        if self.successRequests == 0:
+            return True
+        if Web._proxyCount() > Web.minimumProxies:
+            if 1.0 - self.errorRate < Web.proxyRejectRatio:
+                return True
+        return False
+
+    def trip(self):
+        self.trips += 1
+        retryPeriod = Web.proxyRetryPeriod * 2 ** (self.trips - 1)
+        if Web.maxProxyRetryPeriod is not None:
+            retryPeriod = min(retryPeriod, Web.maxProxyRetryPeriod)
+        self.retryTime = time.time() + retryPeriod
+        self.state = ProxyState.open
+        self.stateFailedRequests = 0
+        self.failed = True
+        Web._setProxyFailed(self)
+
+    def scoreString(self):
+        latency = '-'
+        if self.latency is not None:
+            latency = repr(self.latency)
+        retryTime = '-'
+        if self.retryTime is not None:
+            retryTime = repr(self.retryTime)
+        fields = (self.address + ':' + self.port, str(self.requests)
+                  , str(self.successRequests), str(self.failedRequests)
+                  , latency, repr(self.errorRate), self.state.name
+                  , str(self.trips), retryTime)
+        return '\t'.join(fields)
+
+    def loadScore(self, scoreString):
+        fields = scoreString.rstrip('\n').split('\t')
+        self.requests = int(fields[1])
+        self.successRequests = int(fields[2])
+        self.failedRequests = int(fields[3])
+        if fields[4] != '-':
+            self.latency = float(fields[4])
+        self.errorRate = float(fields[5])
+        self.state = ProxyState[fields[6]]
+        self.trips = int(fields[7])
+        if fields[8] != '-':
+            self.retryTime = float(fields[8])
+        if self.state == ProxyState.halfOpen:
+            self.state = ProxyState.open
+        if self.state == ProxyState.open:
+            self.failed = True
+            if self.retryTime is None:
+                self.retryTime = time.time()
+
+    def replayEvent(self, event):
+        self.requests += 1
+        if event == 'successRequest':
+            self.successRequests += 1
+            self._regResult(failed=False)
+        else:
+            self.failedRequests += 1
+            self.stateFailedRequests += 1
+            self._regResult(failed=True)
+
+    def halfOpen(self):
+        self.state = ProxyState.halfOpen
+        self.stateFailedRequests = 0
+        self.failed = False
+
+    def close(self):
+        self.state = ProxyState.closed
+        self.stateFailedRequests = 0
+        self.trips = 0
+        self.retryTime = None
 
     def printInfo(self, event):
         def attrStr(self, attr):
@@ -1558,6 +2497,9 @@ class Proxy(object):
         res += attrStr(self, 'successRequests') + '\n'
         res += attrStr(self, 'failedRequests') + '\n'
         res += attrStr(self, 'failed') + '\n'
+        res += attrStr(self, 'latency') + '\n'
+        res += attrStr(self, 'errorRate') + '\n'
+        res += attrStr(self, 'state') + '\n'
         res += 'proxyCount: ' + str(Web._proxyCount()) + '\n'
         if self.requests == 0:
             res += 'proxyRatio: ' + 'undefined' + '\n'
@@ -1565,14 +2507,16 @@ class Proxy(object):
             proxyRatio = float(self.successRequests)/float(self.requests)
             res += 'proxyRatio: ' + repr(proxyRatio) + '\n'
         res += '---------------------------------------------\n'
-        f = open('var/log/proxyInfo.info', 'a')
-        f.write(res)
-        f.close()
+        LogSink.write('var/log/proxyInfo.info', res)
 
     def regSuccessRequest(self, url):
         # self.printInfo('successStart')
         self.requests += 1
         self.successRequests += 1
+        self._regResult(failed=False)
+        if self.state == ProxyState.halfOpen:
+            self.close()
+        Web._proxyChanged(self)
         proxy = self.address + ':' + self.port
         event = 'successRequest'
         Web._writeLogProxyEvent(proxy, event, url)
@@ -1582,15 +2526,11 @@ class Proxy(object):
         # self.printInfo('failedStart')
         self.requests += 1
         self.failedRequests += 1
-        if not self.failed and self.failedRequests > Web.maxFailedProxyRequests:
-            if self.successRequests == 0:
-                self.failed = True
-                Web._setProxyFailed(self)
-            elif Web._proxyCount() > Web.minimumProxies:
-                proxyRatio = float(self.successRequests)/float(self.requests)
-                if proxyRatio < Web.proxyRejectRatio:
-                    self.failed = True
-                    Web._setProxyFailed(self)
+        self.stateFailedRequests += 1
+        self._regResult(failed=True)
+        Web._proxyChanged(self)
+        if not self.failed and self._needTrip():
+            self.trip()
         if isinstance(exception, ProxyServerError):
             event = 'proxyServerError'
         elif isinstance(exception, BadPageError):
@@ -1618,6 +2558,83 @@ class Proxy(object):
         # self.printInfo('failedEnd')
 
 
+class ProxyPool(object):
+    """
+    Proxies in the heap ordered by Proxy.priority(), the least first.
+    update pushes the changed proxy again and the old heap entry is skipped
+    as stale, so nothing is rebuilt on change, removal or exclusion.
+    """
+
+    def __init__(self, proxies=()):
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        for proxy in proxies:
+            self.add(proxy)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, proxy):
+        return proxy in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def _push(self, proxy):
+        entry = [proxy.priority(), next(self._counter), proxy]
+        self._entries[proxy] = entry
+        heapq.heappush(self._heap, entry)
+
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [entry for entry in self._heap
+                          if entry[2] is not None]
+            heapq.heapify(self._heap)
+
+    def add(self, proxy):
+        if proxy in self._entries:
+            self.update(proxy)
+        else:
+            self._push(proxy)
+
+    def update(self, proxy):
+        entry = self._entries.get(proxy, None)
+        if entry is None:
+            return
+        if entry[0] == proxy.priority():
+            return
+        entry[2] = None
+        self._push(proxy)
+        self._compact()
+
+    def remove(self, proxy):
+        entry = self._entries.pop(proxy)
+        entry[2] = None
+        self._compact()
+
+    def discard(self, proxy):
+        if proxy in self._entries:
+            self.remove(proxy)
+
+    def next(self, exceptProxy=None):
+        heap = self._heap
+        skipped = []
+        result = None
+        while len(heap) > 0:
+            proxy = heap[0][2]
+            if proxy is None:
+                heapq.heappop(heap)
+            elif exceptProxy is not None and proxy in exceptProxy:
+                skipped.append(heapq.heappop(heap))
+            else:
+                result = proxy
+                break
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+        return result
+
+
 class HttpCodeCheck(object):
     # TODO optimize class based statistical proxies
 
@@ -1648,28 +2665,766 @@ class HttpCodeCheck(object):
         return result
 
 
-class Web(object):
+class MappedBody(object):
+    """
+    The body kept in the uncompressed body file of PageCache. It is not
+    read into memory: buffer() maps the file (the read-only mmap is the
+    zero-copy buffer for hashing and writing), str() reads the file. The
+    buffer is released by closeBuffer().
+    """
 
-    _proxies = None
-    _failedProxies = set()
-    proxyFile = None
-    hammerTimeouts = None
-    randomDelayPeriod = None
-    considerTimeoutProxyError = True
-    maxFailedProxyRequests = 5
-    logDir = None
-    proxyStatDir = None
-    _proxyStatFileName = None
-    _lastReqTime = 0
-    attempts = 5
-    errorLogDir = None
-    _errorLogFilename = None
-    serverErrorWait = 120
-    minimumProxies = 10
-    proxyRejectRatio = 0.5
-    allow404 = False
-    log404dir = None
-    _log404fileName = None
+    __module__ = os.path.splitext(os.path.basename(__file__))[0]
+
+    def __init__(self, path):
+        self.path = path
+
+    def __len__(self):
+        return os.path.getsize(self.path)
+
+    def __str__(self):
+        bodyFile = open(self.path, 'rb')
+        try:
+            return bodyFile.read()
+        finally:
+            bodyFile.close()
+
+    def buffer(self):
+        bodyFile = open(self.path, 'rb')
+        try:
+            if os.fstat(bodyFile.fileno()).st_size == 0:
+                # the empty file can not be mapped
+                return ''
+            return mmap.mmap(bodyFile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            bodyFile.close()
+
+    @staticmethod
+    def closeBuffer(body):
+        """
+        Unmaps the buffer, the string bodies are left as they are.
+        """
+        if type(body) is mmap.mmap:
+            body.close()
+
+
+class WebResponse(object):
+
+    __module__ = os.path.splitext(os.path.basename(__file__))[0]
+
+    def __init__(self, code, body, url, headers=None):
+        """
+        body is the string or MappedBody.
+        """
+        self.code = code
+        self._body = body
+        self.url = url
+        if headers is None:
+            headers = {}
+        self.headers = headers
+
+    def __setstate__(self, state):
+        # the pickles of the old cache have the body attribute
+        if 'body' in state:
+            state['_body'] = state.pop('body')
+        self.__dict__.update(state)
+
+    @property
+    def body(self):
+        """
+        The string body. The MappedBody is read from its file on every
+        access and not kept, so the body of a large cached page is not held
+        in memory by the page cache. The parser reads such a page only
+        once: WebDocument parses the file, PageCache hashes and writes the
+        mapped buffer, a File node keeps the string as _elem and the http
+        code check reads the body only for the error. The callers that do
+        not need the string use mappedBody.
+        """
+        body = self._body
+        if type(body) is MappedBody:
+            return str(body)
+        return body
+
+    @body.setter
+    def body(self, body):
+        self._body = body
+
+    @property
+    def mappedBody(self):
+        """
+        MappedBody of the page read from the cache or None.
+        """
+        body = self._body
+        if type(body) is MappedBody:
+            return body
+        return None
+
+    @property
+    def charset(self):
+        contentType = self.headers.get('content-type', '')
+        pattern = RegexCache.compile(r'charset\s*=\s*["\']?([\w-]+)')
+        charset = pattern.findall(contentType)
+        if len(charset) == 0:
+            return None
+        return charset[0]
+
+
+class WebDocument(object):
+    """
+    The page loaded without grab. It has the part of the grab interface
+    used by the parser: response and xpath. The document tree is parsed
+    at the first xpath call.
+    """
+
+    __module__ = os.path.splitext(os.path.basename(__file__))[0]
+
+    def __init__(self, response):
+        self.response = response
+        self._tree = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_tree'] = None
+        return state
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            try:
+                parser = etree.HTMLParser(encoding=self.response.charset)
+            except LookupError:
+                parser = etree.HTMLParser()
+            mappedBody = self.response.mappedBody
+            if mappedBody is not None:
+                # libxml2 reads the file itself, the body string is not built
+                try:
+                    self._tree = etree.parse(mappedBody.path, parser).getroot()
+                except etree.XMLSyntaxError:
+                    self._tree = None
+                if self._tree is not None:
+                    return self._tree
+            body = self.response.body
+            if body is None or len(body.strip()) == 0:
+                body = '<html></html>'
+            self._tree = etree.fromstring(body, parser)
+        return self._tree
+
+    def xpath_list(self, path):
+        return XPathCache.compile(path)(self.tree)
+
+    def xpath(self, path):
+        result = self.xpath_list(path)
+        if len(result) == 0:
+            raise grab.error.DataNotFound('Xpath not found: ' + path)
+        return result[0]
+
+
+class Transport(object):
+    """
+    Loads a page by url, not before startTime (time.time() seconds) when it
+    is given. The keyword arguments are grab setup options (proxy,
+    proxy_type, proxy_userpwd, hammer_mode, hammer_timeouts). The result
+    must have a grab compatible response and xpath method.
+
+    How the wait for startTime costs depends on the transport.
+    GrabTransport (the default) sleeps the calling thread until startTime,
+    so the host delays, the bursts and the retry backoffs of HostScheduler
+    keep a parser or prefetch thread asleep, as the request itself does.
+    CurlMultiTransport holds the request in its event loop and the calling
+    thread only waits for the answer, so a prefetch pool with many threads
+    is not needed to cover the delays.
+    """
+
+    def go(self, url, startTime=None, **kwargs):
+        raise NotImplementedError(className(self, withPath=False)
+                                  + '.go is not implemented')
+
+
+class GrabTransport(Transport):
+
+    def go(self, url, startTime=None, **kwargs):
+        # Grab blocks the calling thread for the request, so for the
+        # delay too, see Transport
+        if startTime is not None:
+            delay = startTime - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        page = Grab()
+        if len(kwargs) > 0:
+            page.setup(**kwargs)
+        page.go(url)
+        return page
+
+
+class _CurlRequest(object):
+
+    def __init__(self, url, key, connectTimeout, timeout, kwargs):
+        self.url = url
+        self.key = key
+        self.connectTimeout = connectTimeout
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self.curl = None
+        self.body = None
+        self.headers = None
+        self.result = None
+        self.error = None
+        self.startTime = None
+        self.deadline = None
+        self.timedOut = False
+        self.cancelled = False
+        self.done = threading.Event()
+        self.cancelDone = threading.Event()
+
+    def writeHeader(self, line):
+        line = line.strip()
+        if line.startswith('HTTP/'):
+            # new response after redirect
+            self.headers = {}
+            return
+        if ':' not in line:
+            return
+        name, value = line.split(':', 1)
+        self.headers[name.strip().lower()] = value.strip()
+
+
+class CurlMultiTransport(Transport):
+    """
+    Loads pages on the single pycurl CurlMulti event loop. Any number of
+    threads may call go, every call waits only for its own request. The
+    easy handles are kept per host and proxy and reused, so connections
+    are kept alive between requests. The requests with a later startTime
+    wait in the loop, not in the calling thread. An error of the event
+    loop fails all requests in flight with WebInternalError and the loop
+    goes on. A watchdog thread fails the requests without an answer
+    connectTimeout + timeout + waitMargin seconds after go, it checks them
+    every watchPeriod seconds (go itself waits without a timeout, a timed
+    Event.wait polls). The request failed by the watchdog is cancelled in
+    the loop before go retries it, so the same url is never in flight
+    twice; when the loop does not confirm the cancel in waitMargin
+    seconds the request is not retried.
+    """
+
+    connectTimeout = 3
+    timeout = 15
+    maxConnects = 500
+    maxHostConnects = 8
+    maxIdleHandles = 8
+    maxRedirects = 10
+    selectTimeout = 0.05
+    waitMargin = 5
+    watchPeriod = 1
+    userAgent = 'Mozilla/5.0 (X11; Linux x86_64; rv:45.0)' \
+        + ' Gecko/20100101 Firefox/45.0'
+
+    _proxyTypes = {
+        'http': 'PROXYTYPE_HTTP',
+        'socks4': 'PROXYTYPE_SOCKS4',
+        'socks5': 'PROXYTYPE_SOCKS5',
+    }
+
+    def __init__(self):
+        if pycurl is None:
+            raise WebInternalError('pycurl is not installed')
+        self._queue = Queue.Queue()
+        self._idle = {}
+        self._active = set()
+        self._multi = pycurl.CurlMulti()
+        self._multi.setopt(pycurl.M_MAXCONNECTS, self.maxConnects)
+        maxHostConnections = getattr(pycurl, 'M_MAX_HOST_CONNECTIONS', None)
+        if maxHostConnections is not None:
+            self._multi.setopt(maxHostConnections, self.maxHostConnects)
+        self._thread = None
+        self._waiting = set()
+        # heap of (startTime, number, request) of the delayed requests
+        self._delayed = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop
+                                                , name='CurlMultiTransport')
+                self._thread.daemon = True
+                self._thread.start()
+                watchdog = threading.Thread(target=self._watch
+                                            , name='CurlMultiWatchdog')
+                watchdog.daemon = True
+                watchdog.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watchPeriod)
+            now = time.time()
+            with self._lock:
+                expired = [request for request in self._waiting
+                           if request.deadline < now]
+            for request in expired:
+                request.timedOut = True
+                request.done.set()
+
+    def go(self, url, startTime=None, **kwargs):
+        self._start()
+        if type(url) is unicode:
+            url = url.encode(ParsBase._encoding)
+        timeouts = ((self.connectTimeout, self.timeout),)
+        if kwargs.get('hammer_mode', False):
+            timeouts = kwargs.get('hammer_timeouts', timeouts)
+        key = (urlparse.urlsplit(url).netloc, kwargs.get('proxy', None))
+        attempt = 0
+        while True:
+            attempt += 1
+            connectTimeout, timeout = timeouts[attempt-1]
+            request = _CurlRequest(url, key, connectTimeout, timeout, kwargs)
+            request.startTime = startTime
+            request.deadline = time.time()
+            if startTime is not None and startTime > request.deadline:
+                request.deadline = startTime
+            request.deadline += connectTimeout + timeout + self.waitMargin
+            with self._lock:
+                self._waiting.add(request)
+            self._queue.put(request)
+            try:
+                request.done.wait()
+            finally:
+                with self._lock:
+                    self._waiting.discard(request)
+            if request.timedOut:
+                # the loop drops the request before the next attempt
+                request.cancelled = True
+                self._queue.put(request)
+                timeoutError = CurlMultiTransport._grabError(
+                    28, 'No answer of the CurlMultiTransport loop in time')
+                if not request.cancelDone.wait(self.waitMargin):
+                    # the request may be still in flight
+                    raise timeoutError
+                if request.result is None and request.error is None:
+                    request.error = timeoutError
+            if request.error is None:
+                return request.result
+            if isinstance(request.error, grab.error.GrabTimeoutError) \
+                    and attempt < len(timeouts):
+                continue
+            raise request.error
+
+    def _handle(self, key):
+        handles = self._idle.get(key, None)
+        if handles:
+            curl = handles.pop()
+            curl.reset()
+            return curl
+        return pycurl.Curl()
+
+    def _release(self, request):
+        curl = request.curl
+        request.curl = None
+        handles = self._idle.setdefault(request.key, [])
+        if len(handles) < self.maxIdleHandles:
+            handles.append(curl)
+        else:
+            curl.close()
+
+    def _setup(self, request):
+        curl = self._handle(request.key)
+        request.curl = curl
+        request.body = cStringIO.StringIO()
+        request.headers = {}
+        curl.setopt(pycurl.URL, request.url)
+        curl.setopt(pycurl.WRITEFUNCTION, request.body.write)
+        curl.setopt(pycurl.HEADERFUNCTION, request.writeHeader)
+        curl.setopt(pycurl.FOLLOWLOCATION, 1)
+        curl.setopt(pycurl.MAXREDIRS, self.maxRedirects)
+        curl.setopt(pycurl.CONNECTTIMEOUT, int(request.connectTimeout))
+        curl.setopt(pycurl.TIMEOUT, int(request.timeout))
+        curl.setopt(pycurl.NOSIGNAL, 1)
+        curl.setopt(pycurl.SSL_VERIFYPEER, 0)
+        curl.setopt(pycurl.SSL_VERIFYHOST, 0)
+        curl.setopt(pycurl.ENCODING, '')
+        curl.setopt(pycurl.USERAGENT, self.userAgent)
+        kwargs = request.kwargs
+        headers = kwargs.get('headers', None)
+        if headers is None:
+            headers = {}
+        curl.setopt(pycurl.HTTPHEADER, [name + ': ' + headers[name]
+                                        for name in headers])
+        proxy = kwargs.get('proxy', None)
+        if proxy is not None:
+            curl.setopt(pycurl.PROXY, proxy)
+            proxyType = kwargs.get('proxy_type', 'http')
+            proxyType = self._proxyTypes.get(proxyType, 'PROXYTYPE_HTTP')
+            curl.setopt(pycurl.PROXYTYPE, getattr(pycurl, proxyType))
+            userPwd = kwargs.get('proxy_userpwd', None)
+            if userPwd is not None:
+                curl.setopt(pycurl.PROXYUSERPWD, userPwd)
+        curl.request = request
+        return curl
+
+    def _complete(self, curl, errno=None, errmsg=None):
+        request = curl.request
+        curl.request = None
+        self._multi.remove_handle(curl)
+        self._active.discard(curl)
+        if errno is None:
+            response = WebResponse(curl.getinfo(pycurl.RESPONSE_CODE)
+                                   , request.body.getvalue()
+                                   , curl.getinfo(pycurl.EFFECTIVE_URL)
+                                   , request.headers)
+            request.result = WebDocument(response)
+        else:
+            request.error = CurlMultiTransport._grabError(errno, errmsg)
+        request.body = None
+        self._release(request)
+        request.done.set()
+
+    @staticmethod
+    def _grabError(errno, errmsg):
+        if errno == 28:
+            errorClass = grab.error.GrabTimeoutError
+        elif errno in (5, 6, 7):
+            errorClass = grab.error.GrabConnectionError
+        else:
+            errorClass = grab.error.GrabNetworkError
+        error = errorClass(errno, errmsg)
+        error.strerror = errmsg
+        return error
+
+    def _cancel(self, request):
+        """
+        Drops the request failed by the watchdog: its transfer is stopped
+        and the handle closed, or it is taken out of the delayed ones.
+        """
+        curl = request.curl
+        if curl is not None and curl in self._active:
+            curl.request = None
+            self._active.discard(curl)
+            try:
+                self._multi.remove_handle(curl)
+            except pycurl.error:
+                pass
+            curl.close()
+            request.curl = None
+            request.body = None
+        else:
+            delayed = [entry for entry in self._delayed
+                       if entry[2] is not request]
+            if len(delayed) < len(self._delayed):
+                heapq.heapify(delayed)
+                # _addRequests holds the list
+                self._delayed[:] = delayed
+        request.cancelDone.set()
+
+    def _add(self, request):
+        try:
+            curl = self._setup(request)
+            self._multi.add_handle(curl)
+            self._active.add(curl)
+        except Exception as e:
+            request.error = e
+            request.done.set()
+
+    def _addRequests(self, block):
+        delayed = self._delayed
+        timeout = 1
+        if len(delayed) > 0:
+            timeout = max(delayed[0][0] - time.time(), 0)
+        while True:
+            try:
+                request = self._queue.get(block, timeout)
+            except Queue.Empty:
+                break
+            block = False
+            if request.cancelled:
+                self._cancel(request)
+            elif request.startTime is not None \
+                    and request.startTime > time.time():
+                heapq.heappush(delayed, (request.startTime
+                                         , next(self._counter), request))
+            else:
+                self._add(request)
+        now = time.time()
+        while len(delayed) > 0 and delayed[0][0] <= now:
+            self._add(heapq.heappop(delayed)[2])
+
+    @staticmethod
+    def _fail(request, error):
+        request.error = error
+        request.done.set()
+        request.cancelDone.set()
+
+    def _failAll(self, error):
+        """
+        Fails the requests in flight and in the queue with error. Their
+        handles are closed, not reused.
+        """
+        for curl in self._active:
+            request = curl.request
+            curl.request = None
+            try:
+                self._multi.remove_handle(curl)
+            except pycurl.error:
+                pass
+            curl.close()
+            if request is not None:
+                request.curl = None
+                request.body = None
+                CurlMultiTransport._fail(request, error)
+        self._active = set()
+        for _, _, request in self._delayed:
+            CurlMultiTransport._fail(request, error)
+        self._delayed = []
+        while True:
+            try:
+                request = self._queue.get(False)
+            except Queue.Empty:
+                break
+            CurlMultiTransport._fail(request, error)
+
+    def _loop(self):
+        while True:
+            try:
+                self._run()
+            except Exception as e:
+                self._failAll(WebInternalError(
+                    'CurlMultiTransport loop failed', originalException=e))
+
+    def _run(self):
+        multi = self._multi
+        activeHandles = 0
+        while True:
+            self._addRequests(block=(activeHandles == 0))
+            while True:
+                ret, activeHandles = multi.perform()
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+            while True:
+                queued, succeeded, failed = multi.info_read()
+                for curl in succeeded:
+                    self._complete(curl)
+                for curl, errno, errmsg in failed:
+                    self._complete(curl, errno, errmsg)
+                if queued == 0:
+                    break
+            if activeHandles > 0:
+                multi.select(self.selectTimeout)
+
+
+class HostScheduler(object):
+    """
+    Gives out request slots per host (per host and proxy if
+    Web.delayByProxy). The slots of one host are separated by a random
+    delay from Web.randomDelayPeriod or Web.hostDelayPeriods[netloc], up
+    to Web.hostBurst requests may go without delay. reserve books the slot
+    and returns its time, the transport waits for it. The slots and the
+    backoffs that are over are dropped every prunePeriod seconds.
+    """
+
+    prunePeriod = 60
+
+    def __init__(self):
+        self._slotTimes = {}
+        self._backoffTimes = {}
+        self._pruneTime = time.time() + self.prunePeriod
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _delayPeriod(netloc):
+        hostDelayPeriods = Web.hostDelayPeriods
+        if hostDelayPeriods is not None and netloc in hostDelayPeriods:
+            return hostDelayPeriods[netloc]
+        return Web.randomDelayPeriod
+
+    @staticmethod
+    def _tolerance(delayPeriod):
+        burst = Web.hostBurst
+        if burst is None or burst < 1:
+            burst = 1
+        delaySecFrom, delaySecTo = delayPeriod
+        return (burst - 1) * (delaySecFrom + delaySecTo) / 2.0
+
+    @staticmethod
+    def key(url, proxy=None):
+        netloc = urlparse.urlsplit(url).netloc.lower()
+        if Web.delayByProxy and proxy is not None:
+            return netloc, proxy.address + ':' + proxy.port
+        return netloc, None
+
+    def _prune(self, now):
+        """
+        Called under the lock. A slot or a backoff in the past is the same
+        as none.
+        """
+        if now < self._pruneTime:
+            return
+        self._pruneTime = now + self.prunePeriod
+        for times in (self._slotTimes, self._backoffTimes):
+            for key in [key for key in times if times[key] <= now]:
+                del times[key]
+
+    def readyTime(self, url, proxy=None):
+        """
+        The time of the next slot of url through proxy, not booked.
+        """
+        key = HostScheduler.key(url, proxy)
+        readyTime = self._backoffTimes.get(key[0], 0)
+        delayPeriod = HostScheduler._delayPeriod(key[0])
+        if delayPeriod is not None:
+            slotTime = self._slotTimes.get(key, 0) \
+                - HostScheduler._tolerance(delayPeriod)
+            readyTime = max(readyTime, slotTime)
+        return readyTime
+
+    def reserve(self, url, proxy=None):
+        key = HostScheduler.key(url, proxy)
+        delayPeriod = HostScheduler._delayPeriod(key[0])
+        with self._lock:
+            now = time.time()
+            self._prune(now)
+            backoffTime = self._backoffTimes.get(key[0], 0)
+            if delayPeriod is None:
+                return max(backoffTime, now)
+            interval = random.uniform(*delayPeriod)
+            tolerance = HostScheduler._tolerance(delayPeriod)
+            slotTime = max(self._slotTimes.get(key, now), now)
+            requestTime = max(now, slotTime - tolerance, backoffTime)
+            self._slotTimes[key] = max(slotTime, requestTime) + interval
+        return requestTime
+
+    def backoff(self, url, seconds):
+        netloc = urlparse.urlsplit(url).netloc.lower()
+        with self._lock:
+            now = time.time()
+            self._prune(now)
+            backoffTime = now + seconds
+            if backoffTime > self._backoffTimes.get(netloc, 0):
+                self._backoffTimes[netloc] = backoffTime
+
+
+class RetryScheduler(object):
+    """
+    Retry state of urls and hosts. retry registers the failed attempt and
+    books the host out for the backoff time (exponential with jitter) in
+    the HostScheduler, so only the requests to this host wait. It returns
+    False when the retry budget of the url (Web.maxUrlRetries until a
+    success, or Web.serverErrorWait, the longest backoff, after its last
+    retry) or of the host (Web.maxHostRetries without a success) is
+    spent. The expired url entries are dropped every
+    HostScheduler.prunePeriod seconds.
+    """
+
+    def __init__(self):
+        # url: (retries, time of the last retry)
+        self._urlRetries = {}
+        self._hostRetries = {}
+        self._retries = 0
+        self._retriedUrls = 0
+        self._refusedRetries = 0
+        self._pruneTime = time.time() + HostScheduler.prunePeriod
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        if now < self._pruneTime:
+            return
+        self._pruneTime = now + HostScheduler.prunePeriod
+        expireTime = now - Web.serverErrorWait
+        urlRetries = self._urlRetries
+        for url in [url for url in urlRetries
+                    if urlRetries[url][1] < expireTime]:
+            del urlRetries[url]
+
+    def retry(self, url):
+        netloc = urlparse.urlsplit(url).netloc.lower()
+        with self._lock:
+            now = time.time()
+            self._prune(now)
+            urlRetries, retryTime = self._urlRetries.get(url, (0, now))
+            if retryTime < now - Web.serverErrorWait:
+                urlRetries = 0
+            hostRetries = self._hostRetries.get(netloc, 0)
+            if (Web.maxUrlRetries is not None
+                    and urlRetries >= Web.maxUrlRetries) \
+                    or (Web.maxHostRetries is not None
+                        and hostRetries >= Web.maxHostRetries):
+                self._refusedRetries += 1
+                return False
+            if urlRetries == 0:
+                self._retriedUrls += 1
+            self._urlRetries[url] = (urlRetries + 1, now)
+            self._hostRetries[netloc] = hostRetries + 1
+            self._retries += 1
+        delay = Web.retryBackoffBase * 2 ** hostRetries
+        delay = min(delay, Web.serverErrorWait)
+        delay = random.uniform(delay / 2.0, delay)
+        Web._scheduler.backoff(url, delay)
+        return True
+
+    def success(self, url):
+        netloc = urlparse.urlsplit(url).netloc.lower()
+        with self._lock:
+            self._hostRetries.pop(netloc, None)
+            self._urlRetries.pop(url, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'retries': self._retries,
+                'refusedRetries': self._refusedRetries,
+                'retriedUrls': self._retriedUrls,
+                'hostRetries': self._hostRetries.copy(),
+            }
+
+
+class Web(object):
+
+    _proxies = None
+    _failedProxies = set()
+    _lock = threading.RLock()
+    proxyFile = None
+    hammerTimeouts = None
+    randomDelayPeriod = None
+    considerTimeoutProxyError = True
+    maxFailedProxyRequests = 5
+    logDir = None
+    proxyStatDir = None
+    _proxyStatFileName = None
+    hostDelayPeriods = None
+    delayByProxy = False
+    proxyReadyCandidates = 8
+    hostBurst = 1
+    _scheduler = HostScheduler()
+    retryBackoffBase = 5
+    maxUrlRetries = None
+    maxHostRetries = None
+    _retryScheduler = RetryScheduler()
+    maxProxyAttempts = None
+    maxFailureDetails = 10
+    attempts = 5
+    errorLogDir = None
+    _errorLogFilename = None
+    serverErrorWait = 120
+    minimumProxies = 10
+    proxyRejectRatio = 0.5
+    proxyEwmaAlpha = 0.2
+    proxyDefaultLatency = 1.0
+    proxyRetryPeriod = 300
+    maxProxyRetryPeriod = 6 * 3600
+    _retryProxies = []
+    proxyScoreFile = None
+    proxyScoreFlushPeriod = 60
+    _proxyScores = {}
+    _proxyScoreFlushTime = None
+    allow404 = False
+    log404dir = None
+    _log404fileName = None
+    transports = {
+        'grab': GrabTransport,
+        'curlMulti': CurlMultiTransport,
+    }
+    # grab sleeps the calling thread for the host delays and the backoffs,
+    # curlMulti waits for them in its event loop, see Transport
+    transportName = 'grab'
+    _transport = None
+    # the class of Web.transportName that _transport was created for
+    _transportClass = None
 
     @staticmethod
     def _nonePageControlFunc(page, url, proxy):
@@ -1678,96 +3433,141 @@ class Web(object):
     pageControlFunc = _nonePageControlFunc
 
     @staticmethod
-    def getGrabPage(url, oldAttemptsPages=None):
+    def getGrabPage(url, oldAttemptsPages=None, headers=None):
+        """
+        headers are the additional request headers. When they make the
+        request conditional (If-None-Match, If-Modified-Since) the page with
+        the code 304 is returned.
+        """
         exceptProxy = set()
         if oldAttemptsPages is not None and len(oldAttemptsPages) > 0:
             for oldPage in oldAttemptsPages:
                 if oldPage.proxy is not None:
                     exceptProxy.add(oldPage.proxy)
         if Web._proxyMode():
-            if Web._proxies is None:
-                Web._loadProxies()
-            page = Web._getGrabPageProxy(url, exceptProxy)
+            with Web._lock:
+                if Web._proxies is None:
+                    Web._loadProxies()
+            page = Web._getGrabPageProxy(url, exceptProxy, headers=headers)
         else:
-            page = Web._getGrabPageDirect(url)
+            page = Web._getGrabPageDirect(url, headers)
+        Web._retryScheduler.success(url)
         if page.httpCode == 404:
             Web._writeLog404(url)
         return page
 
     @staticmethod
-    def _getGrabPageProxy(url, exceptProxy=None, waitCnt=0, httpCodeCheck=None):
+    def _getGrabPageProxy(url, exceptProxy=None, waitCnt=0, httpCodeCheck=None
+                          , headers=None):
         if httpCodeCheck is None:
             httpCodeCheck = HttpCodeCheck()
         if exceptProxy is None:
             exceptProxy = set()
-        proxy = Web._nextProxy(exceptProxy)
-        kwargs = {}
-        kwargs['proxy'] = proxy.address + ':' + proxy.port
-        kwargs['proxy_type'] = proxy.type
-        if proxy.user is not None:
-            password = proxy.password
-            if password is None:
-                password = ''
-            kwargs['proxy_userpwd'] = proxy.user + ':' + password
-        try:
-            page = Web._loadGrabPage(url, proxy, **kwargs)
-            if page.pageConfirmed:
-                # proxy.regSuccessRequest(url)
-                page.regProxyGoodPage()
-        except (WebError, grab.error.GrabNetworkError) as e:
-            if isinstance(e, WebError):
-                codeCheck = httpCodeCheck(e.httpCode)
-                page = e.page
-                if codeCheck is not None and page is not None:
-                    if (codeCheck == 404 and Web.allow404):
-                        if page.pageConfirmed:
-                            # proxy.regSuccessRequest(url)
-                            page.regProxyGoodPage()
-                        return page
-                if e.httpCode in (503, 507, 509):
-                    if waitCnt > 0:
-                        time.sleep(Web.serverErrorWait)
-                    waitCnt += 1
-            exceptProxy.add(proxy)
+        failures = []
+        page = Web._proxyFailover(url, exceptProxy, waitCnt
+                                  , httpCodeCheck, failures, headers)
+        Web._regFailedProxies(url, failures, page)
+        return page
+
+    @staticmethod
+    def _proxyFailover(url, exceptProxy, waitCnt, httpCodeCheck, failures
+                       , headers=None):
+        exceptionList = collections.deque(maxlen=Web.maxFailureDetails)
+        while True:
+            if Web.maxProxyAttempts is not None \
+                    and len(failures) >= Web.maxProxyAttempts:
+                e1 = ProxyAttemptsExceeded(attempts=len(failures))
+                e1.exceptionList = list(exceptionList)
+                raise e1
+            if len(failures) > 0:
+                with Web._lock:
+                    proxyCount = len(Web._proxies)
+                if proxyCount == 0:
+                    # the pool was emptied by the failures of other calls
+                    e1 = ProxyError('All proxy servers is failed')
+                    e1.exceptionList = list(exceptionList)
+                    raise e1
             try:
-                page = Web._getGrabPageProxy(url, exceptProxy
-                                             , waitCnt, httpCodeCheck)
-                regFailed = True
-                if isinstance(e, WebError):
-                    if e.httpCode == page.httpCode == 404 and Web.allow404:
-                        regFailed = False
-                if regFailed:
-                    proxy.regFailedRequest(url, e)
-                else:
-                    page.regProxyGoodPage()
+                proxy = Web._nextProxy(exceptProxy, url)
             except AllProxyAlreadyUsed as e1:
-                exceptionList = getattr(e1, 'exceptionList', None)
-                if exceptionList is None:
-                    e1.exceptionList = []
-                e1.exceptionList.append(e)
+                e1.exceptionList = list(exceptionList)
                 raise e1
-        return page
+            kwargs = {}
+            kwargs['proxy'] = proxy.address + ':' + proxy.port
+            kwargs['proxy_type'] = proxy.type
+            if proxy.user is not None:
+                password = proxy.password
+                if password is None:
+                    password = ''
+                kwargs['proxy_userpwd'] = proxy.user + ':' + password
+            if headers is not None:
+                kwargs['headers'] = headers
+            try:
+                page = Web._loadGrabPage(url, proxy, **kwargs)
+                if page.pageConfirmed:
+                    # proxy.regSuccessRequest(url)
+                    page.regProxyGoodPage()
+            except (WebError, grab.error.GrabNetworkError) as e:
+                if isinstance(e, WebError):
+                    codeCheck = httpCodeCheck(e.httpCode)
+                    page = e.page
+                    if codeCheck is not None and page is not None:
+                        if (codeCheck == 404 and Web.allow404):
+                            if page.pageConfirmed:
+                                # proxy.regSuccessRequest(url)
+                                page.regProxyGoodPage()
+                            return page
+                    if e.httpCode in (503, 507, 509):
+                        if waitCnt > 0:
+                            if not Web._retryScheduler.retry(url):
+                                raise
+                        waitCnt += 1
+                    # Only the code is needed after this point
+                    if e.page is not None:
+                        e.page = None
+                    if e.httpBody is not None:
+                        e.httpBody = None
+                # excluded for this call only, the pool is shared by the
+                # threads
+                exceptProxy.add(proxy)
+                failures.append((proxy, e))
+                exceptionList.appendleft(e)
+                continue
+            return page
 
     @staticmethod
-    def _getGrabPageDirect(url):
+    def _regFailedProxies(url, failures, page):
+        for proxy, e in reversed(failures):
+            regFailed = True
+            if isinstance(e, WebError):
+                if e.httpCode == page.httpCode == 404 and Web.allow404:
+                    regFailed = False
+            if regFailed:
+                proxy.regFailedRequest(url, e)
+            else:
+                page.regProxyGoodPage()
+
+    @staticmethod
+    def _getGrabPageDirect(url, headers=None):
+        kwargs = {}
+        if headers is not None:
+            kwargs['headers'] = headers
         attempts = Web.attempts
         if attempts is None:
             attempts = 1
         i = 0
         while i < attempts:
             try:
-                return Web._loadGrabPage(url)
+                return Web._loadGrabPage(url, **kwargs)
             except grab.error.GrabNetworkError as e:
                 i += 1
-                if i < attempts:
-                    time.sleep(Web.serverErrorWait)
+                if i < attempts and Web._retryScheduler.retry(url):
                     continue
                 raise
             except WebServerError as e:
                 if e.httpCode in (503, 507, 509):
                     i += 1
-                    if i < attempts:
-                        time.sleep(Web.serverErrorWait)
+                    if i < attempts and Web._retryScheduler.retry(url):
                         continue
                 raise
             except WebClientError as e:
@@ -1776,26 +3576,88 @@ class Web(object):
                 raise
 
     @staticmethod
-    def _nextProxy(exceptProxy=None):
+    def _nextProxy(exceptProxy=None, url=None):
+        """
+        With url and Web.delayByProxy the proxy is chosen among the next
+        proxyReadyCandidates of the pool by the slot time of url.
+        """
         if exceptProxy is None:
             exceptProxy = set()
         if Web._proxies is None:
             raise ProxyError('set of proxy servers is not initialized')
-        if len(Web._proxies) == 0:
-            if len(Web._failedProxies) == 0:
+        with Web._lock:
+            Web._retryFailedProxies()
+            proxyCount = len(Web._proxies)
+            failedCount = len(Web._failedProxies)
+            proxy = None
+            if proxyCount > 0:
+                proxy = Web._proxies.next(exceptProxy)
+        if proxyCount == 0:
+            if failedCount == 0:
                 raise ProxyError('set of proxy servers is empty')
             else:
                 raise ProxyError('All proxy servers is failed')
-        proxies = Web._proxies - exceptProxy
-        if len(proxies) == 0:
+        if proxy is None:
             raise AllProxyAlreadyUsed()
-        return reduce((lambda x, y: x if x.requests <= y.requests else y)
-                      , proxies)
+        if url is not None and Web.delayByProxy:
+            proxy = Web._readyProxy(url, proxy, exceptProxy)
+        return proxy
+
+    @staticmethod
+    def _readyProxy(url, proxy, exceptProxy):
+        """
+        The first proxy in the order of the pool whose slot for url is
+        ready, else the one that is ready first.
+        """
+        now = time.time()
+        readyTime = Web._scheduler.readyTime(url, proxy)
+        if readyTime <= now:
+            return proxy
+        bestProxy, bestTime = proxy, readyTime
+        skipped = set(exceptProxy)
+        i = 1
+        while i < Web.proxyReadyCandidates:
+            skipped.add(proxy)
+            with Web._lock:
+                proxy = Web._proxies.next(skipped)
+            if proxy is None:
+                break
+            readyTime = Web._scheduler.readyTime(url, proxy)
+            if readyTime <= now:
+                return proxy
+            if readyTime < bestTime:
+                bestProxy, bestTime = proxy, readyTime
+            i += 1
+        return bestProxy
+
+    @staticmethod
+    def _retryFailedProxies():
+        now = time.time()
+        retryProxies = Web._retryProxies
+        while len(retryProxies) > 0 and retryProxies[0][0] <= now:
+            _, proxy = heapq.heappop(retryProxies)
+            if proxy.state != ProxyState.open or proxy.retryTime > now:
+                continue
+            proxy.halfOpen()
+            Web._failedProxies.discard(proxy)
+            Web._proxies.add(proxy)
+
+    @staticmethod
+    def _proxyChanged(proxy):
+        with Web._lock:
+            if Web._proxies is not None:
+                Web._proxies.update(proxy)
+            flushTime = Web._proxyScoreFlushTime
+            if flushTime is not None and flushTime <= time.time():
+                Web.saveProxyScores()
 
     @staticmethod
     def _setProxyFailed(proxy):
-        Web._failedProxies.add(proxy)
-        Web._proxies.remove(proxy)
+        with Web._lock:
+            Web._failedProxies.add(proxy)
+            Web._proxies.discard(proxy)
+            if proxy.retryTime is not None:
+                heapq.heappush(Web._retryProxies, (proxy.retryTime, proxy))
 
     @staticmethod
     def _writeLogError(url, proxy, exception):
@@ -1808,7 +3670,6 @@ class Web(object):
             mkdirs(Web.errorLogDir)
             fileName = Web.errorLogDir + fileName
             Web._errorLogFilename = fileName
-        logFile = open(fileName, 'a')
         if proxy is not None:
             proxy = proxy.address + ':' + proxy.port
         else:
@@ -1825,8 +3686,7 @@ class Web(object):
         string += '\n'
         if type(string) is unicode:
             string = string.encode(ParsBase._encoding)
-        logFile.write(string)
-        logFile.close()
+        LogSink.write(fileName, string)
 
     @staticmethod
     def _writeLogProxyEvent(proxy, event, url):
@@ -1839,12 +3699,10 @@ class Web(object):
             mkdirs(Web.proxyStatDir)
             fileName = Web.proxyStatDir + fileName
             Web._proxyStatFileName = fileName
-        statFile = open(fileName, 'a')
         string = '<' + event + '>\t' + proxy + '\t' + '"' + url + '"' + '\n'
         if type(string) is unicode:
             string = string.encode(ParsBase._encoding)
-        statFile.write(string)
-        statFile.close()
+        LogSink.write(fileName, string)
 
     @staticmethod
     def _writeLog404(url):
@@ -1857,11 +3715,13 @@ class Web(object):
             mkdirs(Web.log404dir)
             fileName = Web.log404dir + fileName
             Web._log404fileName = fileName
-        logFile = open(fileName, 'a')
         if type(url) is unicode:
             url = url.encode(ParsBase._encoding)
-        logFile.write(url+'\n')
-        logFile.close()
+        LogSink.write(fileName, url + '\n')
+
+    @staticmethod
+    def retryStats():
+        return Web._retryScheduler.stats()
 
     @staticmethod
     def _proxyMode():
@@ -1895,73 +3755,201 @@ class Web(object):
             proxy = Proxy(proxyAddress, proxyPort, proxyType
                           , proxyUser, proxyPassword)
             proxies.add(proxy)
-        Web._proxies = proxies
+        Web._proxies = ProxyPool(Web._loadProxyScores(proxies))
         if wrongTypeFile is not None:
             wrongTypeFile.close()
         proxyFile.close()
 
     @staticmethod
-    def _lastRequestTime(setTime=None):
-        if setTime is None:
-            return Web._lastReqTime
-        else:
-            Web._lastReqTime = setTime
-            return setTime
+    def _readProxyScores(fileName):
+        scores = {}
+        try:
+            scoreFile = open(fileName, 'r')
+        except IOError as e:
+            if e.errno == 2:
+                return scores
+            else:
+                raise
+        for line in scoreFile:
+            name = line.split('\t', 1)[0]
+            scores[name] = line
+        scoreFile.close()
+        return scores
+
+    @staticmethod
+    def _loadProxyScores(proxies):
+        if Web.proxyScoreFile is None:
+            return proxies
+        Web._proxyScores = Web._readProxyScores(Web.proxyScoreFile)
+        aliveProxies = []
+        for proxy in proxies:
+            scoreString = Web._proxyScores.get(proxy.address + ':' + proxy.port
+                                               , None)
+            if scoreString is not None:
+                proxy.loadScore(scoreString)
+            if proxy.state == ProxyState.open:
+                Web._failedProxies.add(proxy)
+                heapq.heappush(Web._retryProxies, (proxy.retryTime, proxy))
+            else:
+                aliveProxies.append(proxy)
+        Web._proxyScoreFlushTime = time.time() + Web.proxyScoreFlushPeriod
+        atexit.register(Web.saveProxyScores)
+        return aliveProxies
+
+    @staticmethod
+    def saveProxyScores(fileName=None, proxies=None):
+        if fileName is None:
+            fileName = Web.proxyScoreFile
+        if fileName is None:
+            return
+        with Web._lock:
+            if proxies is None:
+                proxies = list(Web._failedProxies)
+                if Web._proxies is not None:
+                    proxies += list(Web._proxies)
+            Web._updateProxyScores(Web._proxyScores, proxies)
+            Web._writeProxyScores(fileName, Web._proxyScores)
+            Web._proxyScoreFlushTime = time.time() + Web.proxyScoreFlushPeriod
+
+    @staticmethod
+    def _updateProxyScores(scores, proxies):
+        for proxy in proxies:
+            scores[proxy.address + ':' + proxy.port] = \
+                proxy.scoreString() + '\n'
+
+    @staticmethod
+    def _writeProxyScores(fileName, scores):
+        dirs = os.path.dirname(fileName)
+        if dirs != '':
+            mkdirs(dirs)
+        tmpFileName = fileName + '.' + str(os.getpid()) + '.tmp'
+        scoreFile = open(tmpFileName, 'w')
+        for name in sorted(scores):
+            scoreFile.write(scores[name])
+        scoreFile.close()
+        os.rename(tmpFileName, fileName)
+
+    @staticmethod
+    def buildProxyScores(statFileNames, fileName=None):
+        """
+        Builds the proxy score file from .proxystat logs, the files are
+        replayed in the order of their names (the date of the session).
+        The scores of the replayed proxies replace theirs in the existing
+        file, the other proxies of the file are kept.
+        """
+        if fileName is None:
+            fileName = Web.proxyScoreFile
+        if fileName is None:
+            raise WebInternalError('no proxy score file')
+        proxies = {}
+        pattern = RegexCache.compile(r'^<(\w+)>\t([\w.]+):(\d+)\t')
+        for statFileName in sorted(statFileNames):
+            statFile = open(statFileName, 'r')
+            for line in statFile:
+                event = pattern.findall(line)
+                if len(event) == 0:
+                    continue
+                event, address, port = event[0]
+                proxy = proxies.get((address, port), None)
+                if proxy is None:
+                    proxy = Proxy(address, port, None)
+                    proxies[(address, port)] = proxy
+                proxy.replayEvent(event)
+            statFile.close()
+        now = time.time()
+        for proxy in proxies.values():
+            if proxy.stateFailedRequests <= Web.maxFailedProxyRequests:
+                continue
+            if proxy.successRequests == 0 \
+                    or 1.0 - proxy.errorRate < Web.proxyRejectRatio:
+                proxy.state = ProxyState.open
+                proxy.failed = True
+                proxy.trips = 1
+                proxy.retryTime = now + Web.proxyRetryPeriod
+        with Web._lock:
+            scores = Web._readProxyScores(fileName)
+            Web._updateProxyScores(scores, proxies.values())
+            Web._writeProxyScores(fileName, scores)
+        return len(proxies)
 
     @staticmethod
     def _proxyCount():
         return len(Web._proxies)
 
     @staticmethod
-    def _grabPageHttpCodeCheck(page, proxy):
+    def _grabPageHttpCodeCheck(page, proxy, allow304=False):
         response = getattr(page, 'response', None)
         code = None
-        body = None
         if response is not None:
             code = getattr(response, 'code', None)
-            body = getattr(response, 'body', None)
-        if 100 <= code < 200:
-            raise WebClientError(httpCode=code, httpBody=body, page=page)
-        elif 200 <= code < 300:
-            if code == 206:
-                raise WebClientError(httpCode=code, httpBody=body, page=page)
-            return
+        errorClass = WebClientError
+        if 200 <= code < 300:
+            if code != 206:
+                return
         elif 300 <= code < 400:
-            raise WebClientError(httpCode=code, httpBody=body, page=page)
-        elif 400 <= code < 500:
-            raise WebClientError(httpCode=code, httpBody=body, page=page)
+            if code == 304 and allow304:
+                return
         elif 500 <= code < 600:
+            errorClass = WebServerError
             if code == 504 and proxy is not None:
-                raise ProxyServerError(httpCode=code, httpBody=body, page=page)
-            raise WebServerError(httpCode=code, httpBody=body, page=page)
-        else:
-            raise WebClientError(httpCode=code, httpBody=body, page=page)
+                errorClass = ProxyServerError
+        # the body is read only for the error, a mapped body is a file read
+        body = getattr(response, 'body', None)
+        raise errorClass(httpCode=code, httpBody=body, page=page)
+
+    @staticmethod
+    def _getTransport():
+        """
+        The transport of Web.transportName. A transport that can not be
+        created (CurlMultiTransport without pycurl) is replaced by
+        GrabTransport with a message on stderr.
+        """
+        transportClass = Web.transports[Web.transportName]
+        with Web._lock:
+            if Web._transport is None \
+                    or Web._transportClass is not transportClass:
+                try:
+                    Web._transport = transportClass()
+                except WebInternalError as e:
+                    if transportClass is GrabTransport:
+                        raise
+                    print('Web: ' + Web.transportName + ' transport: '
+                          + str(e) + ', GrabTransport is used'
+                          , file=sys.stderr)
+                    Web._transport = GrabTransport()
+                Web._transportClass = transportClass
+            return Web._transport
 
     @staticmethod
     def _loadGrabPage(url, currentProxy=None, **kwargs):
         # _breaker(5)
         kwargs = kwargs.copy()
-        page = Grab()
+        transport = Web._getTransport()
         if Web.hammerTimeouts is not None:
             kwargs['hammer_mode'] = True
             kwargs['hammer_timeouts'] = Web.hammerTimeouts
-        if len(kwargs) > 0:
-            page.setup(**kwargs)
-        if Web.randomDelayPeriod is not None:
-            delaySecFrom, delaySecTo = Web.randomDelayPeriod
-            sleepSeconds = random.uniform(delaySecFrom, delaySecTo)
-            timeFromLastRequest = time.time() - Web._lastRequestTime()
-            sleepSeconds -= timeFromLastRequest
-            if sleepSeconds > 0:
-                time.sleep(sleepSeconds)
+        headers = kwargs.get('headers', None)
+        allow304 = headers is not None and ('If-None-Match' in headers
+                                            or 'If-Modified-Since' in headers)
+        startTime = Web._scheduler.reserve(url, currentProxy)
+        if startTime <= time.time():
+            startTime = None
         try:
             try:
                 requestTime = time.time()
-                page.go(url)
+                if startTime is not None:
+                    requestTime = startTime
+                try:
+                    page = transport.go(url, startTime=startTime, **kwargs)
+                finally:
+                    if currentProxy is not None:
+                        currentProxy.regLatency(max(time.time() - requestTime
+                                                    , 0))
                 page = WebPage(page, proxy=currentProxy, url=url)
-                Web._grabPageHttpCodeCheck(page, currentProxy)
-                Web.pageControlFunc(page, url, currentProxy)
-                Web._lastRequestTime(requestTime)
+                Web._grabPageHttpCodeCheck(page, currentProxy, allow304)
+                if page.httpCode != 304:
+                    # 304 has no body to control
+                    Web.pageControlFunc(page, url, currentProxy)
             except grab.error.GrabConnectionError as e:
                 if currentProxy is None:
                     raise
@@ -1980,65 +3968,795 @@ class Web(object):
         return page
 
 
-class PageCache(object):
+class _PageFlight(object):
 
-    _cache = {}
+    def __init__(self, withoutCache):
+        self.withoutCache = withoutCache
+        self.done = threading.Event()
+        self.page = None
+        self.error = None
+
+
+class CacheIndex(object):
+    """
+    The url -> page file and meta index of PageCache. It is a sqlite
+    database in the cache dir, queried on demand and shared between
+    processes. Every thread has its own connection. The old url_file.map is
+    imported at the first connection and renamed to url_file.map.imported.
+    The failures table is the negative cache of PageCache. accessTime is
+    the time of the last read or write of the page, the reads are written
+    in batches of accessFlushSize, by PageCache.flush and at exit.
+    """
+
+    fileName = 'index.sqlite'
+    timeout = 60
+    accessFlushSize = 1000
+    _accessTimes = {}
+    _accessFlushRegistered = False
+    _local = threading.local()
+    _connections = []
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _connection():
+        local = CacheIndex._local
+        path = PageCache._path(CacheIndex.fileName)
+        connection = getattr(local, 'connection', None)
+        if connection is not None and local.path == path \
+                and local.pid == os.getpid():
+            return connection
+        mkdirs(PageCache.cacheDir)
+        # closed by closeAll at exit, from the main thread
+        connection = sqlite3.connect(path, timeout=CacheIndex.timeout
+                                     , isolation_level=None
+                                     , check_same_thread=False)
+        with CacheIndex._lock:
+            if len(CacheIndex._connections) == 0:
+                atexit.register(CacheIndex.closeAll)
+            CacheIndex._connections.append((os.getpid(), connection))
+        connection.execute('PRAGMA busy_timeout = {0}'.format(
+            int(CacheIndex.timeout * 1000)))
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        # the other processes can create the schema at the same time
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('CREATE TABLE IF NOT EXISTS pages'
+                               ' (url TEXT PRIMARY KEY'
+                               ', fileName TEXT NOT NULL, meta TEXT'
+                               ', loadTime REAL, accessTime REAL)')
+            columns = connection.execute('PRAGMA table_info(pages)'
+                                         ).fetchall()
+            columns = [column[1] for column in columns]
+            if 'meta' not in columns:
+                connection.execute('ALTER TABLE pages ADD COLUMN meta TEXT')
+            if 'loadTime' not in columns:
+                connection.execute('ALTER TABLE pages'
+                                   ' ADD COLUMN loadTime REAL')
+            if 'accessTime' not in columns:
+                connection.execute('ALTER TABLE pages'
+                                   ' ADD COLUMN accessTime REAL')
+                connection.execute('UPDATE pages SET accessTime = loadTime')
+            connection.execute('CREATE INDEX IF NOT EXISTS pagesFileName'
+                               ' ON pages (fileName)')
+            connection.execute('CREATE INDEX IF NOT EXISTS pagesLoadTime'
+                               ' ON pages (loadTime)')
+            connection.execute('CREATE INDEX IF NOT EXISTS pagesAccessTime'
+                               ' ON pages (accessTime)')
+            connection.execute('CREATE TABLE IF NOT EXISTS failures'
+                               ' (url TEXT PRIMARY KEY, code INTEGER'
+                               ', failures INTEGER NOT NULL'
+                               ', failTime REAL NOT NULL)')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        local.connection = connection
+        local.path = path
+        local.pid = os.getpid()
+        CacheIndex._importFileMap(connection)
+        return connection
+
+    @staticmethod
+    def close():
+        """
+        Closes the connection of the current thread.
+        """
+        connection = getattr(CacheIndex._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            CacheIndex._local.connection = None
+            with CacheIndex._lock:
+                item = (os.getpid(), connection)
+                if item in CacheIndex._connections:
+                    CacheIndex._connections.remove(item)
+
+    @staticmethod
+    def closeAll():
+        """
+        Closes the connections of all threads of this process. The
+        connections left to the interpreter teardown crash it.
+        """
+        with CacheIndex._lock:
+            connections = CacheIndex._connections
+            CacheIndex._connections = []
+        for pid, connection in connections:
+            if pid != os.getpid():
+                # inherited by fork, the parent closes it
+                continue
+            try:
+                connection.close()
+            except sqlite3.Error:
+                pass
+
+    @staticmethod
+    def _importFileMap(connection):
+        """
+        The later lines of the map win, the rows already in the index are
+        kept, so the import by several processes is harmless.
+        """
+        path = PageCache._path(PageCache._fileMapName)
+        if not os.path.exists(path):
+            return
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            try:
+                mapFile = open(path, 'r')
+            except IOError as e:
+                if e.errno == errno.ENOENT:
+                    # imported by another process
+                    connection.execute('ROLLBACK')
+                    return
+                raise
+            mapStrings = mapFile.readlines()
+            mapFile.close()
+            for mapString in reversed(mapStrings):
+                split = mapString.strip().split('\t')
+                if len(split) != 2:
+                    # the line broken by a crash
+                    continue
+                url = normalizeUrl(split[0])
+                if type(url) is str:
+                    url = url.decode(ParsBase._encoding)
+                fileName = split[1].decode(ParsBase._encoding)
+                connection.execute('INSERT OR IGNORE INTO pages'
+                                   ' (url, fileName) VALUES (?, ?)'
+                                   , (url, fileName))
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        try:
+            os.rename(path, path + '.imported')
+        except OSError:
+            pass
+
+    @staticmethod
+    def get(url):
+        """
+        Returns (fileName, meta) of the url or None.
+        """
+        row = CacheIndex._connection().execute(
+            'SELECT fileName, meta FROM pages WHERE url = ?', (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0].encode(ParsBase._encoding), row[1]
+
+    @staticmethod
+    def put(url, fileName, meta=None, loadTime=None):
+        if type(url) is str:
+            url = url.decode(ParsBase._encoding)
+        if type(fileName) is str:
+            fileName = fileName.decode(ParsBase._encoding)
+        CacheIndex._connection().execute(
+            'INSERT OR REPLACE INTO pages'
+            ' (url, fileName, meta, loadTime, accessTime)'
+            ' VALUES (?, ?, ?, ?, ?)'
+            , (url, fileName, meta, loadTime, time.time()))
+
+    @staticmethod
+    def remove(url):
+        CacheIndex._connection().execute('DELETE FROM pages WHERE url = ?'
+                                         , (url,))
+
+    @staticmethod
+    def touch(url):
+        """
+        Registers the read of the page of the url.
+        """
+        if type(url) is str:
+            url = url.decode(ParsBase._encoding)
+        with CacheIndex._lock:
+            CacheIndex._accessTimes[url] = time.time()
+            if not CacheIndex._accessFlushRegistered:
+                CacheIndex._accessFlushRegistered = True
+                atexit.register(CacheIndex.flushAccess)
+            if len(CacheIndex._accessTimes) < CacheIndex.accessFlushSize:
+                return
+        CacheIndex.flushAccess()
+
+    @staticmethod
+    def flushAccess():
+        with CacheIndex._lock:
+            accessTimes = CacheIndex._accessTimes
+            CacheIndex._accessTimes = {}
+        if len(accessTimes) == 0 or PageCache.cacheDir is None:
+            return
+        connection = CacheIndex._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                'UPDATE pages SET accessTime = ? WHERE url = ?'
+                , [(accessTimes[url], url) for url in accessTimes])
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    @staticmethod
+    def setLoadTime(url, loadTime):
+        if type(url) is str:
+            url = url.decode(ParsBase._encoding)
+        CacheIndex._connection().execute(
+            'UPDATE pages SET loadTime = ? WHERE url = ?', (loadTime, url))
+
+    @staticmethod
+    def putMeta(url, meta, loadTime=None):
+        if type(url) is str:
+            url = url.decode(ParsBase._encoding)
+        CacheIndex._connection().execute(
+            'UPDATE pages SET meta = ?, loadTime = ?, accessTime = ?'
+            ' WHERE url = ?', (meta, loadTime, time.time(), url))
+
+    @staticmethod
+    def removeFileName(fileName):
+        """
+        Removes the rows of all urls with the file.
+        """
+        if type(fileName) is str:
+            fileName = fileName.decode(ParsBase._encoding)
+        cursor = CacheIndex._connection().execute(
+            'DELETE FROM pages WHERE fileName = ?', (fileName,))
+        return cursor.rowcount
+
+    @staticmethod
+    def legacyFileNames():
+        """
+        The file names of the pages of the old layout (N.pickle).
+        """
+        rows = CacheIndex._connection().execute(
+            'SELECT fileName FROM pages WHERE meta IS NULL').fetchall()
+        return [row[0].encode(ParsBase._encoding) for row in rows]
+
+    @staticmethod
+    def isReferenced(fileName):
+        if type(fileName) is str:
+            fileName = fileName.decode(ParsBase._encoding)
+        row = CacheIndex._connection().execute(
+            'SELECT 1 FROM pages WHERE fileName = ? LIMIT 1', (fileName,)
+            ).fetchone()
+        return row is not None
+
+    @staticmethod
+    def fileNames(prefix):
+        """
+        The set of the file names starting with the prefix, the index on
+        fileName is used.
+        """
+        if type(prefix) is str:
+            prefix = prefix.decode(ParsBase._encoding)
+        rows = CacheIndex._connection().execute(
+            'SELECT DISTINCT fileName FROM pages'
+            ' WHERE fileName >= ? AND fileName < ?'
+            , (prefix, prefix + u'\uffff')).fetchall()
+        return set([row[0].encode(ParsBase._encoding) for row in rows])
+
+    @staticmethod
+    def oldest(batchSize=1000):
+        """
+        (url, fileName, loadTime) of the oldest pages, the pages of unknown
+        age are the first.
+        """
+        rows = CacheIndex._connection().execute(
+            'SELECT url, fileName, loadTime FROM pages'
+            ' ORDER BY loadTime LIMIT ?', (batchSize,)).fetchall()
+        return [(url, fileName.encode(ParsBase._encoding), loadTime)
+                for url, fileName, loadTime in rows]
+
+    @staticmethod
+    def leastRecentlyUsed(batchSize=1000):
+        """
+        (url, fileName, accessTime) of the pages read or written the
+        longest time ago, the pages of unknown access time are the first.
+        """
+        rows = CacheIndex._connection().execute(
+            'SELECT url, fileName, accessTime FROM pages'
+            ' ORDER BY accessTime LIMIT ?', (batchSize,)).fetchall()
+        return [(url, fileName.encode(ParsBase._encoding), accessTime)
+                for url, fileName, accessTime in rows]
+
+    @staticmethod
+    def ageCounts(bounds):
+        """
+        The page counts by the age bounds in seconds, the last count is of
+        the pages older than all bounds and the pages of unknown age.
+        """
+        connection = CacheIndex._connection()
+        now = time.time()
+        counts = []
+        younger = 0
+        for bound in bounds:
+            count = connection.execute('SELECT count(*) FROM pages'
+                                       ' WHERE loadTime >= ?'
+                                       , (now - bound,)).fetchone()[0]
+            counts.append(count - younger)
+            younger = count
+        counts.append(CacheIndex.count() - younger)
+        return counts
+
+    @staticmethod
+    def compact():
+        connection = CacheIndex._connection()
+        connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        connection.execute('VACUUM')
+
+    @staticmethod
+    def items(batchSize=1000):
+        """
+        Iterates over (url, fileName, meta) of the index by batches, the
+        index is not loaded entirely and can be changed during the iteration.
+        """
+        connection = CacheIndex._connection()
+        rowid = 0
+        while True:
+            rows = connection.execute('SELECT rowid, url, fileName, meta'
+                                      ' FROM pages WHERE rowid > ?'
+                                      ' ORDER BY rowid LIMIT ?'
+                                      , (rowid, batchSize)).fetchall()
+            if len(rows) == 0:
+                return
+            for rowid, url, fileName, meta in rows:
+                yield url, fileName.encode(ParsBase._encoding), meta
+
+    @staticmethod
+    def count():
+        return CacheIndex._connection().execute(
+            'SELECT count(*) FROM pages').fetchone()[0]
+
+    @staticmethod
+    def getFailure(url):
+        """
+        Returns (code, failures, failTime) of the url or None.
+        """
+        return CacheIndex._connection().execute(
+            'SELECT code, failures, failTime FROM failures WHERE url = ?'
+            , (url,)).fetchone()
+
+    @staticmethod
+    def putFailure(url, code, failures, failTime):
+        if type(url) is str:
+            url = url.decode(ParsBase._encoding)
+        CacheIndex._connection().execute(
+            'INSERT OR REPLACE INTO failures (url, code, failures, failTime)'
+            ' VALUES (?, ?, ?, ?)', (url, code, failures, failTime))
+
+    @staticmethod
+    def removeFailure(url):
+        CacheIndex._connection().execute('DELETE FROM failures WHERE url = ?'
+                                         , (url,))
+
+
+class PageWriter(object):
+    """
+    Write-behind of PageCache: the pages are written to disk by the
+    background thread. The writes of the same url are coalesced, only the
+    last page is written. The pages waiting for the write are found by
+    pending(). flush() waits until everything is written, it is called at
+    the end of Processor. close() at exit flushes and stops the thread.
+    The failed writes are reported on stderr, the first error since the last
+    flush is raised by flush().
+    """
+
+    maxPending = 1000
+    _pending = collections.OrderedDict()
+    _writing = {}
+    _thread = None
+    _stop = False
+    _error = None
+    _closeRegistered = False
+    _condition = threading.Condition()
+
+    @staticmethod
+    def _start():
+        PageWriter._stop = False
+        PageWriter._thread = threading.Thread(target=PageWriter._loop
+                                              , name='PageWriter')
+        PageWriter._thread.daemon = True
+        PageWriter._thread.start()
+        if not PageWriter._closeRegistered:
+            PageWriter._closeRegistered = True
+            atexit.register(PageWriter.close)
+
+    @staticmethod
+    def put(url, page, fileName, oldFileName=None, body=True):
+        """
+        body=False writes only the meta of the page into the index.
+        """
+        condition = PageWriter._condition
+        with condition:
+            if PageWriter._thread is None:
+                PageWriter._start()
+            while len(PageWriter._pending) >= PageWriter.maxPending \
+                    and url not in PageWriter._pending:
+                # the timeout keeps KeyboardInterrupt working
+                condition.wait(1)
+            entry = PageWriter._pending.pop(url, None)
+            if entry is not None:
+                # the file on disk is still the old one
+                oldFileName = entry[2]
+                if entry[3] and not body:
+                    fileName = entry[1]
+                    body = True
+            PageWriter._pending[url] = (page, fileName, oldFileName, body)
+            condition.notify_all()
+
+    @staticmethod
+    def pending(url):
+        """
+        (page, fileName) waiting for the write or None.
+        """
+        with PageWriter._condition:
+            entry = PageWriter._pending.get(url, None)
+            if entry is None:
+                entry = PageWriter._writing.get(url, None)
+        if entry is None:
+            return None
+        return entry[0], entry[1]
+
+    @staticmethod
+    def flush(raiseError=True):
+        """
+        raiseError=False only drops the error of the failed writes, it is
+        already reported.
+        """
+        condition = PageWriter._condition
+        with condition:
+            while len(PageWriter._pending) > 0 or len(PageWriter._writing) > 0:
+                condition.wait(1)
+            error = PageWriter._error
+            PageWriter._error = None
+        if error is not None and raiseError:
+            raise error
+
+    @staticmethod
+    def close():
+        PageWriter.flush(raiseError=False)
+        condition = PageWriter._condition
+        with condition:
+            thread = PageWriter._thread
+            if thread is None:
+                return
+            PageWriter._stop = True
+            PageWriter._thread = None
+            condition.notify_all()
+        # The daemon thread left running at the interpreter shutdown can
+        # hang it
+        thread.join()
+
+    @staticmethod
+    def _loop():
+        condition = PageWriter._condition
+        while True:
+            with condition:
+                while len(PageWriter._pending) == 0:
+                    if PageWriter._stop:
+                        CacheIndex.close()
+                        return
+                    condition.wait()
+                url, entry = PageWriter._pending.popitem(last=False)
+                PageWriter._writing[url] = entry
+            page, fileName, oldFileName, body = entry
+            try:
+                if body:
+                    PageCache._storePageNow(url, page, fileName, oldFileName)
+                else:
+                    CacheIndex.putMeta(url, PageCache._pageMeta(page)
+                                       , page.loadTime)
+            except Exception as e:
+                print('PageWriter: ' + className(e) + ': ' + str(e)
+                      , file=sys.stderr)
+                with condition:
+                    if PageWriter._error is None:
+                        PageWriter._error = e
+            with condition:
+                del PageWriter._writing[url]
+                condition.notify_all()
+
+
+class PageCache(object):
+    """
+    The pages are kept in memory (memoryCache) and on disk (cacheDir). The
+    memory tier is LRU, when memoryCacheBodyBytes is set the least recently
+    used pages are evicted beyond it and read from disk at the next use.
+    It is a budget of the body bytes: the parsed tree of a page, built on
+    the first query and several times the body, is not counted.
+
+    The bodies of mapMinBytes and longer are stored uncompressed (.raw) and
+    read as MappedBody, they are mapped on demand instead of being read
+    into memory.
+
+    The negative cache keeps the urls answered with negativeCodes or failed
+    negativeFailures times in a row. They are not requested again for
+    negativeTtl seconds: the cached page is used (the 404 page with
+    Web.allow404) or NegativeCacheError is raised.
+    """
+
+    _cache = collections.OrderedDict()
+    _cacheBodyBytes = 0
+    _hits = 0
+    _misses = 0
+    _evictions = 0
+    _revalidations = 0
+    _notModified = 0
+    _savedBytes = 0
+    _negative = {}
+    _negativeHits = 0
+    _prefetched = {}
+    _flights = {}
+    _lock = threading.RLock()
     cacheDir = None
-    _fileMapLoaded = False
     _fileMapName = 'url_file.map'
-    _maxFileNumber = None
+    _bodyExtension = '.body'
+    _rawExtension = '.raw'
+    _tmpExtension = '.tmp'
+    compressLevel = 6
+    mapMinBytes = 256 * 1024
     memoryCache = True
+    memoryCacheBodyBytes = None
+    writeBehind = True
+    maxAge = None
+    hostMaxAges = None
+    negativeTtl = None
+    negativeCodes = (404, 410)
+    negativeFailures = 3
     onlyFromCache = False
 
     @staticmethod
-    def getPage(url, withoutCache=False, oldAttemptsPages=None):
+    def getPage(url, withoutCache=False, oldAttemptsPages=None, maxAge=None):
+        """
+        maxAge is the freshness of the page on disk in seconds, instead of
+        PageCache.hostMaxAges[netloc] and PageCache.maxAge. The stale page is
+        revalidated with If-None-Match/If-Modified-Since.
+        """
         if oldAttemptsPages is not None and len(oldAttemptsPages) > 0:
             withoutCache=True
         url = normalizeUrl(url)
         # TODO move to normalizeUrl
         if type(url) is str:
             url = url.decode(ParsBase._encoding)
+        if not withoutCache:
+            page = PageCache._memoryGet(url)
+            if page is not None:
+                return page
+        while True:
+            with PageCache._lock:
+                flight = PageCache._flights.get(url, None)
+                if flight is None:
+                    flight = _PageFlight(withoutCache)
+                    PageCache._flights[url] = flight
+                    break
+            # The same url is already loading in another thread. A reload
+            # (withoutCache) can not use the result of an ordinary load.
+            flight.done.wait()
+            if flight.withoutCache or not withoutCache:
+                if flight.error is not None:
+                    raise flight.error
+                return flight.page
+        try:
+            flight.page = PageCache._getPage(url, withoutCache
+                                             , oldAttemptsPages, maxAge)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with PageCache._lock:
+                del PageCache._flights[url]
+            flight.done.set()
+        return flight.page
+
+    @staticmethod
+    def _getPage(url, withoutCache=False, oldAttemptsPages=None, maxAge=None):
+        if not withoutCache:
+            with PageCache._lock:
+                page = PageCache._prefetched.pop(url, None)
+            if page is not None:
+                return page
         container = PageCache._cache.get(url, None)
-        if container is None:
-            container = Container()
-            page, fileName = PageCache._loadPage(url, withoutCache
-                                                 , oldAttemptsPages)
-            if PageCache.memoryCache:
-                container.page = page
-            else:
-                container.page = None
-            container.fileName = fileName
+        if container is not None and container.page is not None \
+                and not withoutCache:
+            return container.page
+        page, fileName = PageCache._loadPage(url, withoutCache
+                                             , oldAttemptsPages, maxAge)
+        if PageCache.memoryCache:
+            PageCache._memoryPut(url, page, fileName)
+        return page
+
+    @staticmethod
+    def _memoryGet(url):
+        with PageCache._lock:
+            container = PageCache._cache.pop(url, None)
+            if container is None:
+                PageCache._misses += 1
+                return None
+            # move to the most recently used end
             PageCache._cache[url] = container
-        else:
-            if container.page is None or withoutCache:
-                page, fileName = PageCache._loadPage(url, withoutCache
-                                                     , oldAttemptsPages)
-                if PageCache.memoryCache:
-                    container.page = page
-                else:
-                    container.page = None
-                container.fileName = fileName
-            else:
-                page = container.page
+            PageCache._hits += 1
+        return container.page
+
+    @staticmethod
+    def _memoryPut(url, page, fileName):
+        container = Container()
+        container.page = page
+        container.fileName = fileName
+        container.size = PageCache._bodySize(page) if page is not None else 0
+        with PageCache._lock:
+            PageCache._memoryPop(url)
+            PageCache._cache[url] = container
+            PageCache._cacheBodyBytes += container.size
+            maxBytes = PageCache.memoryCacheBodyBytes
+            if maxBytes is None:
+                return
+            cache = PageCache._cache
+            while PageCache._cacheBodyBytes > maxBytes and len(cache) > 0:
+                _, evicted = cache.popitem(last=False)
+                PageCache._cacheBodyBytes -= evicted.size
+                PageCache._evictions += 1
+
+    @staticmethod
+    def _memoryPop(url):
+        with PageCache._lock:
+            container = PageCache._cache.pop(url, None)
+            if container is not None:
+                PageCache._cacheBodyBytes -= container.size
+
+    @staticmethod
+    def stats():
+        with PageCache._lock:
+            return {
+                'hits': PageCache._hits,
+                'misses': PageCache._misses,
+                'evictions': PageCache._evictions,
+                'pages': len(PageCache._cache),
+                'bodyBytes': PageCache._cacheBodyBytes,
+                'revalidations': PageCache._revalidations,
+                'notModified': PageCache._notModified,
+                'savedBytes': PageCache._savedBytes,
+                'negativeHits': PageCache._negativeHits,
+                'negativeUrls': len(PageCache._negative),
+            }
+
+    @staticmethod
+    def _prefetchKey(url):
+        url = normalizeUrl(url)
+        if type(url) is str:
+            url = url.decode(ParsBase._encoding)
+        return url
+
+    @staticmethod
+    def prefetchPage(url, maxAge=None):
+        page = PageCache.getPage(url, maxAge=maxAge)
+        # the page has to survive the eviction until the parser takes it
+        if not PageCache.memoryCache \
+                or PageCache.memoryCacheBodyBytes is not None:
+            url = PageCache._prefetchKey(url)
+            with PageCache._lock:
+                PageCache._prefetched[url] = page
         return page
 
     @staticmethod
-    def _webLoad(url, oldAttemptsPages):
+    def dropPrefetched(url):
+        """
+        Forgets the prefetched page of url that the parser did not take.
+        """
+        url = PageCache._prefetchKey(url)
+        with PageCache._lock:
+            PageCache._prefetched.pop(url, None)
+
+    @staticmethod
+    def _webLoad(url, oldAttemptsPages, headers=None):
         if PageCache.onlyFromCache:
             if type(url) is not str:
                 if type(url) is not unicode:
                     url = unicode(url, ParsBase._encoding)
                 url = url.encode(ParsBase._encoding)
             raise PageCacheWarning(url+' not in cache')
-        page = Web.getGrabPage(url, oldAttemptsPages)
+        if PageCache.negativeTtl is None:
+            return Web.getGrabPage(url, oldAttemptsPages, headers)
+        failure = PageCache._failure(url)
+        if PageCache._isNegative(failure):
+            with PageCache._lock:
+                PageCache._negativeHits += 1
+            code, failures, failTime = failure
+            raise NegativeCacheError(httpCode=code, failures=failures
+                                     , failTime=failTime, url=url)
+        try:
+            page = Web.getGrabPage(url, oldAttemptsPages, headers)
+        except ProxyError:
+            # the failure of the proxies, not of the url
+            raise
+        except (WebError, grab.error.GrabNetworkError) as e:
+            PageCache._regFailure(url, failure
+                                  , getattr(e, 'httpCode', None))
+            raise
+        if page.httpCode in PageCache.negativeCodes:
+            PageCache._regFailure(url, failure, page.httpCode)
+        elif failure is not None:
+            PageCache._regSuccess(url)
         return page
 
     @staticmethod
-    def _webLoadSaveFile(url, oldAttemptsPages):
-        page = PageCache._webLoad(url, oldAttemptsPages)
-        fileName = PageCache._writePage(page)
-        PageCache._saveFileMap(url, fileName)
-        return page, fileName
+    def _failure(url):
+        """
+        (code, failures, failTime) of the last failures of the url in a row
+        or None.
+        """
+        with PageCache._lock:
+            failure = PageCache._negative.get(url, None)
+        if failure is None and PageCache.cacheDir is not None:
+            failure = CacheIndex.getFailure(url)
+            if failure is not None:
+                with PageCache._lock:
+                    PageCache._negative[url] = failure
+        return failure
+
+    @staticmethod
+    def _isNegative(failure):
+        if failure is None or PageCache.negativeTtl is None:
+            return False
+        code, failures, failTime = failure
+        if code not in PageCache.negativeCodes \
+                and failures < PageCache.negativeFailures:
+            return False
+        return time.time() - failTime < PageCache.negativeTtl
+
+    @staticmethod
+    def _regFailure(url, failure, code):
+        failures = 1
+        if failure is not None:
+            failures += failure[1]
+        failure = (code, failures, time.time())
+        with PageCache._lock:
+            PageCache._negative[url] = failure
+        if PageCache.cacheDir is not None:
+            CacheIndex.putFailure(url, *failure)
+
+    @staticmethod
+    def _regSuccess(url):
+        with PageCache._lock:
+            PageCache._negative.pop(url, None)
+        if PageCache.cacheDir is not None:
+            CacheIndex.removeFailure(url)
+
+    @staticmethod
+    def _negativePage(url, container, page=None):
+        """
+        The cached page of the negative url, it is used instead of the
+        reload and the revalidation.
+        """
+        if container is None or PageCache.negativeTtl is None:
+            return None
+        if not PageCache._isNegative(PageCache._failure(url)):
+            return None
+        if page is None:
+            page = container.page
+        if page is None and container.fileName is not None:
+            page = PageCache._readPage(container.fileName, container.meta
+                                       , url)
+        if page is not None:
+            with PageCache._lock:
+                PageCache._negativeHits += 1
+        return page
 
     @staticmethod
     def _path(fileName):
@@ -2049,46 +4767,194 @@ class PageCache(object):
         return path
 
     @staticmethod
-    def _findMaxFileNumber():
-        if not PageCache._fileMapLoaded:
-            PageCache._loadFileMap()
-        cache = PageCache._cache
-        maxNumber = 0
-        for url in cache:
-            container = cache[url]
-            if container is not None:
-                fileName = container.fileName
-                if fileName is not None:
-                    fileNumber = int(fileName[:-7])  # remove extension .pickle
-                    if maxNumber < fileNumber:
-                        maxNumber = fileNumber
-        return maxNumber
-
-    @staticmethod
-    def _createFileName():
-        if not PageCache._fileMapLoaded:
-            PageCache._loadFileMap()
-        maxFileNumber = PageCache._maxFileNumber
-        if maxFileNumber is None:
-            maxFileNumber = PageCache._findMaxFileNumber()
-        maxFileNumber += 1
-        fileName = str(maxFileNumber) + '.pickle'
-        PageCache._maxFileNumber = maxFileNumber
-        return fileName
+    def _container(url):
+        """
+        The container of the page in memory or the container with the page
+        file name and meta from the index.
+        """
+        container = PageCache._cache.get(url, None)
+        if container is not None or PageCache.cacheDir is None:
+            return container
+        pending = PageWriter.pending(url)
+        if pending is not None:
+            container = Container()
+            container.page, container.fileName = pending
+            container.meta = None
+            return container
+        row = CacheIndex.get(url)
+        if row is None:
+            return None
+        container = Container()
+        container.page = None
+        container.fileName, container.meta = row
+        return container
+
+    @staticmethod
+    def _pageMeta(page):
+        """
+        Everything of the page except the body: status, final url, headers,
+        pageConfirmed and uuid. It is kept in the index as json.
+        """
+        def latin1(value):
+            if type(value) is str:
+                value = value.decode('latin-1')
+            return value
+        response = page.response
+        headers = {}
+        url = None
+        code = None
+        if response is not None:
+            code = response.code
+            url = latin1(response.url)
+            for name, value in getattr(response, 'headers', {}).items():
+                headers[latin1(name).lower()] = latin1(value)
+        meta = {
+            'code': code,
+            'url': url,
+            'headers': headers,
+            'pageConfirmed': page.__dict__.get('pageConfirmed', None),
+            'uuid': page.uuid.hex,
+            'requestUrl': latin1(page.url),
+            'loadTime': page.loadTime,
+        }
+        return json.dumps(meta, separators=(',', ':'))
+
+    @staticmethod
+    def _pageFromMeta(meta, body):
+        def latin1(value):
+            if type(value) is unicode:
+                value = value.encode('latin-1')
+            return value
+        meta = json.loads(meta)
+        headers = {}
+        for name in meta['headers']:
+            headers[latin1(name)] = latin1(meta['headers'][name])
+        response = WebResponse(meta['code'], body, latin1(meta['url'])
+                               , headers)
+        page = WebPage(WebDocument(response), url=latin1(meta['requestUrl']))
+        if meta['pageConfirmed'] is not None:
+            page.pageConfirmed = meta['pageConfirmed']
+        page.uuid = uuid.UUID(meta['uuid'])
+        page.loadTime = meta.get('loadTime', None)
+        return page
+
+    @staticmethod
+    def _bodyBuffer(page):
+        """
+        The body of the page for hashing and writing, the mapped body is
+        not read into memory. It is released by MappedBody.closeBuffer.
+        """
+        mappedBody = getattr(page.response, 'mappedBody', None)
+        if mappedBody is not None:
+            return mappedBody.buffer()
+        body = page.httpBody
+        if body is None:
+            body = ''
+        return body
+
+    @staticmethod
+    def _bodySize(page):
+        """
+        The size of the page in the memory budget: the body bytes only.
+        """
+        mappedBody = getattr(page.response, 'mappedBody', None)
+        if mappedBody is not None:
+            return len(mappedBody)
+        body = page.httpBody
+        if body is None:
+            return 0
+        return len(body)
+
+    @staticmethod
+    def _bodyFileName(body):
+        digest = hashlib.sha1(body).hexdigest()
+        extension = PageCache._bodyExtension
+        if PageCache.mapMinBytes is not None \
+                and len(body) >= PageCache.mapMinBytes:
+            extension = PageCache._rawExtension
+        return digest[0:2] + '/' + digest[2:4] + '/' + digest + extension
 
     @staticmethod
     def _writePage(page, fileName=None):
-        if fileName is None:
-            fileName = PageCache._createFileName()
-        path = PageCache._path(fileName)
-        pageFile = open(path, 'wb')
-        pagePickler = pickle.Pickler(pageFile, pickle.HIGHEST_PROTOCOL)
-        pagePickler.dump(page)
-        pageFile.close()
+        """
+        Writes the body of the page into the file named by its hash, the
+        same bodies are stored once. Returns the file name and the meta.
+        """
+        body = None
+        try:
+            if fileName is None:
+                body = PageCache._bodyBuffer(page)
+                fileName = PageCache._bodyFileName(body)
+            path = PageCache._path(fileName)
+            if not os.path.exists(path):
+                if body is None:
+                    body = PageCache._bodyBuffer(page)
+                PageCache._writeBody(path, fileName, body)
+        finally:
+            MappedBody.closeBuffer(body)
+        return fileName, PageCache._pageMeta(page)
+
+    @staticmethod
+    def _writeBody(path, fileName, body):
+        if not fileName.endswith(PageCache._rawExtension):
+            body = zlib.compress(body, PageCache.compressLevel)
+        dirPath, _ = os.path.split(path)
+        mkdirs(dirPath)
+        # the readers of other processes see the whole file or nothing
+        tmpPath = '{0}.{1}{2}'.format(path, uuid.uuid4().hex
+                                      , PageCache._tmpExtension)
+        try:
+            bodyFile = open(tmpPath, 'wb')
+            try:
+                bodyFile.write(body)
+            finally:
+                bodyFile.close()
+            os.rename(tmpPath, path)
+        except Exception:
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _storePage(url, page, oldFileName=None):
+        """
+        Stores the page on disk now or by PageWriter (writeBehind), returns
+        the file name.
+        """
+        body = PageCache._bodyBuffer(page)
+        try:
+            fileName = PageCache._bodyFileName(body)
+        finally:
+            MappedBody.closeBuffer(body)
+        if PageCache.writeBehind:
+            PageWriter.put(url, page, fileName, oldFileName)
+            return fileName
+        return PageCache._storePageNow(url, page, fileName, oldFileName)
+
+    @staticmethod
+    def _storePageNow(url, page, fileName=None, oldFileName=None):
+        fileName, meta = PageCache._writePage(page, fileName)
+        CacheIndex.put(url, fileName, meta, page.loadTime)
+        if oldFileName is not None and oldFileName != fileName \
+                and '/' not in oldFileName:
+            # the numbered file of the old layout belongs only to this url
+            try:
+                os.remove(PageCache._path(oldFileName))
+            except OSError:
+                pass
         return fileName
 
     @staticmethod
-    def _readPage(fileName):
+    def _readPage(fileName, meta=None, url=None):
+        """
+        Reads the page by the file name and the meta from the index. The
+        pages of the old layout (N.pickle) have no meta. The read of the url
+        is registered in the index, the index row of the url with a broken
+        file is removed. The body files are shared by the urls with the same
+        body, so the file is removed only when no other row refers to it.
+        """
         path = PageCache._path(fileName)
         try:
             pageFile = open(path, 'rb')
@@ -2098,81 +4964,91 @@ class PageCache(object):
             else:
                 raise
         try:
-            pageUnpickler = pickle.Unpickler(pageFile)
-            page = pageUnpickler.load()
+            if meta is not None and fileName.endswith(
+                    PageCache._rawExtension):
+                page = PageCache._pageFromMeta(meta, MappedBody(path))
+            elif meta is not None:
+                body = zlib.decompress(pageFile.read())
+                page = PageCache._pageFromMeta(meta, body)
+            else:
+                pageUnpickler = pickle.Unpickler(pageFile)
+                page = pageUnpickler.load()
         except Exception:
+            # The file is broken (crash while writing it, disk error), the
+            # page is loaded and written again.
+            pageFile.close()
+            if url is not None:
+                CacheIndex.remove(url)
+            if not CacheIndex.isReferenced(fileName):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
             return None
         pageFile.close()
+        if url is not None:
+            CacheIndex.touch(url)
         return page
 
     @staticmethod
-    def _loadFileMap():
-        path = PageCache._path(PageCache._fileMapName)
-        try:
-            mapFile = open(path, 'r')
-        except IOError as e:
-            if e.errno == 2:
-                return
-            else:
-                raise
-        for mapString in mapFile:
-            split = mapString.strip().split('\t')
-            url = split[0]
-            url = normalizeUrl(url)
-            fileName = split[1]
-            container = Container()
-            container.page = None
-            container.fileName = fileName
-            if type(url) is str:
-                url = url.decode(ParsBase._encoding)
-            PageCache._cache[url] = container
-
-    @staticmethod
-    def _saveFileMap(url, fileName):
-        if type(url) is unicode:
-            url = url.encode(ParsBase._encoding)
-        if type(fileName) is unicode:
-            fileName = fileName.encode(ParsBase._encoding)
-        path = PageCache._path(PageCache._fileMapName)
-        mapFile = open(path, 'a')
-        mapString = '{0}\t{1}\n'.format(url, fileName)
-        mapFile.write(mapString)
-        mapFile.close()
+    def convertCache():
+        """
+        Moves the pages of the old layout (N.pickle files) into the hash
+        named body files.
+        """
+        converted = 0
+        for url, fileName, meta in CacheIndex.items():
+            if meta is not None:
+                continue
+            page = PageCache._readPage(fileName, url=url)
+            if page is None:
+                continue
+            fileName = PageCache._storePage(url, page, fileName)
+            container = PageCache._cache.get(url, None)
+            if container is not None:
+                container.fileName = fileName
+            converted += 1
+        PageCache.flush()
+        return converted
 
     @staticmethod
-    def _fileLoad(url, withoutCache=False, oldAttemptsPages=None):
-        if not PageCache._fileMapLoaded:
-            PageCache._loadFileMap()
-            PageCache._fileMapLoaded = True
-        container = PageCache._cache.get(url, None)
+    def _fileLoad(url, withoutCache=False, oldAttemptsPages=None, maxAge=None):
+        container = PageCache._container(url)
+        oldFileName = None
+        if container is not None:
+            oldFileName = container.fileName
         if withoutCache:
-            if container is None:
-                page, fileName = PageCache._webLoadSaveFile(url
-                                                            , oldAttemptsPages)
-            elif container.fileName is None:
-                page, fileName = PageCache._webLoadSaveFile(url, oldAttemptsPages)
-            else:
-                fileName = container.fileName
-                page = PageCache._webLoad(url, oldAttemptsPages)
-                fileName = PageCache._writePage(page, fileName)
-        elif container is None:
-            page, fileName = PageCache._webLoadSaveFile(url, oldAttemptsPages)
-        elif container.page is None and container.fileName is None:
-            page, fileName = PageCache._webLoadSaveFile(url, oldAttemptsPages)
-        elif container.page is None:
-            fileName = container.fileName
-            page = PageCache._readPage(fileName)
+            page = PageCache._negativePage(url, container)
+            if page is not None:
+                if oldFileName is None:
+                    oldFileName = PageCache._storePage(url, page)
+                return page, oldFileName
+        if not withoutCache and container is not None:
+            if container.page is not None:
+                page = container.page
+                if oldFileName is None:
+                    oldFileName = PageCache._storePage(url, page)
+                return page, oldFileName
+            page = PageCache._readPage(oldFileName, container.meta, url)
             if page is None:
-                page = PageCache._webLoad(url, oldAttemptsPages)
-                fileName = PageCache._writePage(page, fileName)
-        elif container.fileName is None:
-            page = container.page
-            fileName = PageCache._writePage(page)
-            PageCache._saveFileMap(url, fileName)
-        else:
-            page = container.page
-            fileName = container.fileName
-        return page, fileName
+                # the page can be moved by another process after the index
+                # was read
+                row = CacheIndex.get(url)
+                if row is not None and row[0] != oldFileName:
+                    oldFileName, container.meta = row
+                    page = PageCache._readPage(oldFileName, container.meta
+                                               , url)
+            if page is not None and PageCache._isStale(url, page, maxAge) \
+                    and PageCache._negativePage(url, container, page) is None:
+                return PageCache._revalidate(url, page, oldFileName
+                                             , oldAttemptsPages)
+            if page is not None:
+                if container.meta is None:
+                    # migrate the page from the old layout
+                    return page, PageCache._storePage(url, page, oldFileName)
+                return page, oldFileName
+        page = PageCache._webLoad(url, oldAttemptsPages)
+        return page, PageCache._storePage(url, page, oldFileName)
 
     # @staticmethod
     # def _mkdir(dirPath):
@@ -2184,15 +5060,59 @@ class PageCache(object):
             # os.makedirs(path)
 
     @staticmethod
-    def _loadPage(url, withoutCache=False, oldAttemptsPages=None):
+    def _isStale(url, page, maxAge):
+        if PageCache.onlyFromCache:
+            return False
+        if maxAge is None:
+            hostMaxAges = PageCache.hostMaxAges
+            netloc = urlparse.urlsplit(url).netloc.lower()
+            if hostMaxAges is not None and netloc in hostMaxAges:
+                maxAge = hostMaxAges[netloc]
+            else:
+                maxAge = PageCache.maxAge
+        if maxAge is None:
+            return False
+        loadTime = page.loadTime
+        return loadTime is None or time.time() - loadTime > maxAge
+
+    @staticmethod
+    def _revalidate(url, page, fileName, oldAttemptsPages):
+        headers = {}
+        etag = page.header('etag')
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        lastModified = page.header('last-modified')
+        if lastModified is not None:
+            headers['If-Modified-Since'] = lastModified
+        if len(headers) == 0:
+            newPage = PageCache._webLoad(url, oldAttemptsPages)
+            return newPage, PageCache._storePage(url, newPage, fileName)
+        newPage = PageCache._webLoad(url, oldAttemptsPages, headers)
+        with PageCache._lock:
+            PageCache._revalidations += 1
+        if newPage.httpCode != 304:
+            return newPage, PageCache._storePage(url, newPage, fileName)
+        with PageCache._lock:
+            PageCache._notModified += 1
+            PageCache._savedBytes += PageCache._bodySize(page)
+        page.loadTime = time.time()
+        return page, PageCache._storePage(url, page, fileName)
+
+    @staticmethod
+    def _loadPage(url, withoutCache=False, oldAttemptsPages=None, maxAge=None):
         if PageCache.cacheDir is None:
             fileName = None
-            page = PageCache._webLoad(url, oldAttemptsPages)
+            page = None
+            if withoutCache:
+                page = PageCache._negativePage(url
+                                               , PageCache._cache.get(url))
+            if page is None:
+                page = PageCache._webLoad(url, oldAttemptsPages)
         else:
             # PageCache._mkdir(PageCache.cacheDir)
             mkdirs(PageCache.cacheDir)
             page, fileName = PageCache._fileLoad(url, withoutCache
-                                                 , oldAttemptsPages)
+                                                 , oldAttemptsPages, maxAge)
         return page, fileName
 
     @staticmethod
@@ -2211,15 +5131,18 @@ class PageCache(object):
         url = normalizeUrl(url)
         if type(url) is str:
             url = url.decode(ParsBase._encoding)
-        container = PageCache._cache.get(url, None)
+        page = PageCache._memoryGet(url)
+        if page is not None:
+            return page
+        container = PageCache._container(url)
         if container is None:
             return None
-        page = None
         page = container.page
         if page is None and container.fileName is not None:
-            page = PageCache._readPage(container.fileName)
+            page = PageCache._readPage(container.fileName, container.meta
+                                       , url)
             if PageCache.memoryCache and page is not None:
-                container.page = page
+                PageCache._memoryPut(url, page, container.fileName)
         return page
 
     @staticmethod
@@ -2235,40 +5158,55 @@ class PageCache(object):
             return
         if container.page is None:
             return
-        fileName = PageCache._writePage(container.page, container.fileName)
-        if fileName != container.fileName:
-            PageCache._saveFileMap(url, fileName)
-            container.fileName = fileName
+        container.fileName = PageCache._storePage(url, container.page
+                                                  , container.fileName)
 
     @staticmethod
-    def writePageInCache(url, page):
+    def confirmPage(url, page):
+        """
+        Sets pageConfirmed of the page, only its meta in the index is
+        rewritten.
+        """
+        page.pageConfirmed = True
+        if PageCache.cacheDir is None:
+            return
         url = normalizeUrl(url)
         if type(url) is str:
             url = url.decode(ParsBase._encoding)
+        if PageCache.writeBehind:
+            PageWriter.put(url, page, None, body=False)
+        else:
+            CacheIndex.putMeta(url, PageCache._pageMeta(page), page.loadTime)
+
+    @staticmethod
+    def flush(raiseError=True):
+        """
+        Waits until the pages of the write-behind are written and writes
+        the page reads to the index. The first failed write is raised.
+        """
         if PageCache.cacheDir is not None:
-            if not PageCache._fileMapLoaded:
-                PageCache._loadFileMap()
-                PageCache._fileMapLoaded = True
-        container = PageCache._cache.get(url, None)
+            CacheIndex.flushAccess()
+        PageWriter.flush(raiseError)
+
+    @staticmethod
+    def writePageInCache(url, page):
+        url = normalizeUrl(url)
+        if type(url) is str:
+            url = url.decode(ParsBase._encoding)
+        container = PageCache._container(url)
         if container is None:
             container = Container()
             container.fileName = None
             container.page = None
         if PageCache.cacheDir is not None:
-            fileName = PageCache._writePage(page, container.fileName)
-            if fileName != container.fileName:
-                PageCache._saveFileMap(url, fileName)
-                container.fileName = fileName
+            container.fileName = PageCache._storePage(url, page
+                                                      , container.fileName)
         else:
             container.fileName = None
         if PageCache.memoryCache:
-            container.page = page
-        else:
-            container.page = None
-        if container.page is not None or container.fileName is not None:
-            PageCache._cache[url] = container
+            PageCache._memoryPut(url, page, container.fileName)
         else:
-            _ = PageCache._cache.pop(url)
+            PageCache._memoryPop(url)
 
 
 class PageBase(ParsBase):
@@ -2312,20 +5250,51 @@ class PageBase(ParsBase):
     def __init__(self, *args, **kwargs):
         self._page = None
         needControl = kwargs.pop('needControl', True)
+        maxAge = kwargs.pop('maxAge', None)
         ParsBase.__init__(self, *args, **kwargs)
         self._needControl = needControl
+        self._maxAge = maxAge
+
+    def _parentUrl(self):
+        if self.parent is None:
+            return ''
+        return self.parent._url
+
+    def _absoluteUrl(self, href, baseUrl=None):
+        """
+        The href joined with the url of the parent (baseUrl when it is
+        given), so the page cache gets the absolute url. It is the url a Url
+        node with the href resolves to, see ParsBase._resolvedUrlParts.
+        """
+        href = normalizeUrl(href)
+        if baseUrl is None:
+            baseUrl = self._parentUrl()
+        if baseUrl == '':
+            return href
+        return urlparse.urljoin(baseUrl, href)
+
+    def _prefetchArgs(self):
+        # the parent url is resolved and kept by the constructing thread
+        return (self._parentUrl(),)
+
+    def _prefetch(self, queryResult, baseUrl=None):
+        url = self._absoluteUrl(queryResult, baseUrl)
+        PageCache.prefetchPage(url, self._maxAge)
+        return url
 
     def _processing(self, oldAttemptsInstances=None):
-        self._url = normalizeUrl(self._elem)
+        self._url = self._absoluteUrl(self._elem)
         if oldAttemptsInstances is None or oldAttemptsInstances == []:
-            page = PageCache.getPage(self._url, withoutCache=False)
+            page = PageCache.getPage(self._url, withoutCache=False
+                                     , maxAge=self._maxAge)
         else:
             oldAttemptsPages = []
             for oldInstance in oldAttemptsInstances:
                 if oldInstance._page is not None:
                     oldAttemptsPages.append(oldInstance._page)
             page = PageCache.getPage(self._url, withoutCache=False
-                                     , oldAttemptsPages=oldAttemptsPages)
+                                     , oldAttemptsPages=oldAttemptsPages
+                                     , maxAge=self._maxAge)
         if self._needControl:
             if page.pageConfirmed:
                 self._needControl = False
@@ -2368,9 +5337,7 @@ class PageBase(ParsBase):
                 PageCache.writePageInCache(self._url, self._page)
             elif cachePage.uuid == self._page.uuid:
                 if not cachePage.pageConfirmed:
-                    cachePage.pageConfirmed = True
-                    # PageCache.rewritePageInDisk(self._url)
-                    PageCache.writePageInCache(self._url, cachePage)
+                    PageCache.confirmPage(self._url, cachePage)
             else:
                 PageCache.writePageInCache(self._url, self._page)
             self._regEventPagesProxy(oldAttemptsInstances)
@@ -2400,6 +5367,7 @@ class File(PageBase):
 
     def __init__(self, *args, **kwargs):
         self._file = None
+        self._mappedBody = None
         PageBase.__init__(self, *args, **kwargs)
         self._homeDir = kwargs.get('homeDir', u'./')
         self._homeDir = unicode(self._homeDir, ParsBase._encoding)
@@ -2439,9 +5407,14 @@ class File(PageBase):
 
     def _processing(self, oldAttemptsInstances=None):
         PageBase._processing(self, oldAttemptsInstances)
-        if self._page.page.response.code != 404:
-            self._elem = self._page.page.response.body
+        response = self._page.page.response
+        if response.code != 404:
+            # _elem is the body string, _mappedBody the MappedBody of the
+            # page read from the cache or None
+            self._mappedBody = getattr(response, 'mappedBody', None)
+            self._elem = response.body
         else:
+            self._mappedBody = None
             self._elem = None
         self._localPath = self._createFilePath()
 
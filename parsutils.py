@@ -35,11 +35,30 @@ class Config(object):
         ps.WebPage.pageConfirmedDefault = self.pageConfirmedDefault
         ps.ParsBase._saveInstanceDefault = self.saveInstanceDefault
         ps.PageCache.memoryCache = self.memoryCache
+        ps.PageCache.memoryCacheBodyBytes = self.memoryCacheBodyBytes
+        ps.PageCache.writeBehind = self.writeBehind
+        ps.PageCache.maxAge = self.maxAge
+        ps.PageCache.hostMaxAges = self.hostMaxAges
+        ps.PageCache.negativeTtl = self.negativeTtl
         ps.Web.allow404 = self.allow404
         ps.XlsxSheet.disableFormulaDefault = self.disableFormulaExcel
         ps.Web.proxyFile = self.proxyFile
         ps.PageCache.onlyFromCache = self.onlyFromCache
         ps.ParsBase._NoneObjectUnicode = unicode(self.noneElemView)
+        ps.ParsBase._concurrencyDefault = self.concurrency
+        # grab (the default) sleeps the calling thread for the host delays
+        # and the retry backoffs, curlMulti waits for them in its loop
+        ps.Web.transportName = self.transport
+        ps.Web.hostDelayPeriods = self.hostDelayPeriods
+        ps.Web.delayByProxy = self.delayByProxy
+        ps.Web.hostBurst = self.hostBurst
+        ps.Web.proxyRetryPeriod = self.proxyRetryPeriod
+        ps.Web.maxProxyRetryPeriod = self.maxProxyRetryPeriod
+        ps.Web.proxyScoreFile = self.proxyScoreFile
+        ps.Web.retryBackoffBase = self.retryBackoffBase
+        ps.Web.maxUrlRetries = self.maxUrlRetries
+        ps.Web.maxHostRetries = self.maxHostRetries
+        ps.Web.maxProxyAttempts = self.maxProxyAttempts
 
     def __getattr__(self, name):
         if name == 'cacheDir':
@@ -64,6 +83,16 @@ class Config(object):
             return ps.ParsBase._saveInstanceDefault
         elif name == 'memoryCache':
             return ps.PageCache.memoryCache
+        elif name == 'memoryCacheBodyBytes':
+            return ps.PageCache.memoryCacheBodyBytes
+        elif name == 'writeBehind':
+            return ps.PageCache.writeBehind
+        elif name == 'maxAge':
+            return ps.PageCache.maxAge
+        elif name == 'hostMaxAges':
+            return ps.PageCache.hostMaxAges
+        elif name == 'negativeTtl':
+            return ps.PageCache.negativeTtl
         elif name == 'allow404':
             return ps.Web.allow404
         elif name == 'disableFormulaExcel':
@@ -74,6 +103,30 @@ class Config(object):
             return ps.PageCache.onlyFromCache
         elif name == 'noneElemView':
             return ps.ParsBase._NoneObjectUnicode
+        elif name == 'concurrency':
+            return ps.ParsBase._concurrencyDefault
+        elif name == 'transport':
+            return ps.Web.transportName
+        elif name == 'hostDelayPeriods':
+            return ps.Web.hostDelayPeriods
+        elif name == 'delayByProxy':
+            return ps.Web.delayByProxy
+        elif name == 'hostBurst':
+            return ps.Web.hostBurst
+        elif name == 'proxyRetryPeriod':
+            return ps.Web.proxyRetryPeriod
+        elif name == 'maxProxyRetryPeriod':
+            return ps.Web.maxProxyRetryPeriod
+        elif name == 'proxyScoreFile':
+            return ps.Web.proxyScoreFile
+        elif name == 'retryBackoffBase':
+            return ps.Web.retryBackoffBase
+        elif name == 'maxUrlRetries':
+            return ps.Web.maxUrlRetries
+        elif name == 'maxHostRetries':
+            return ps.Web.maxHostRetries
+        elif name == 'maxProxyAttempts':
+            return ps.Web.maxProxyAttempts
         else:
             return None
 
@@ -86,6 +139,13 @@ class Config(object):
         elif name == 'randomDelayPeriod':
             if value is not None:
                 value = tuple(value)
+        elif name == 'hostDelayPeriods':
+            if value is not None:
+                value = dict([(key.lower(), tuple(value[key]))
+                              for key in value])
+        elif name == 'hostMaxAges':
+            if value is not None:
+                value = dict([(key.lower(), value[key]) for key in value])
         elif name in ('cacheDir', 'webLogDir', 'proxyStatDir'
                       , 'webErrorLogDir', 'log404dir', 'outDir'):
             value = ps.normalizePath(value, itDir=True)
@@ -0,0 +1,98 @@
+"""
+The proxy failover: the failed proxies are excluded for the call only,
+the shared pool is not changed while other threads take proxies from it.
+The pool emptied by other calls raises ProxyError as before.
+"""
+import os.path
+import sys
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+
+class StubLoader(object):
+    """
+    Fails the first `failures` requests with a proxy server error and
+    records the proxies and the pool size seen by every request.
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.proxies = []
+        self.poolSizes = []
+
+    def __call__(self, url, currentProxy=None, **kwargs):
+        self.proxies.append(currentProxy)
+        self.poolSizes.append(len(ps.Web._proxies))
+        page = ps.WebPage(None, proxy=currentProxy, url=url)
+        if len(self.proxies) <= self.failures:
+            raise ps.ProxyServerError(httpCode=504, page=page)
+        return page
+
+
+class FailoverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.web = dict((name, getattr(ps.Web, name)) for name in (
+            '_proxies', '_failedProxies', '_loadGrabPage', 'maxProxyAttempts'
+            , 'maxFailedProxyRequests'))
+        self.proxies = [ps.Proxy('10.0.0.{0}'.format(i), '80', 'http')
+                        for i in range(5)]
+        ps.Web._proxies = ps.ProxyPool(self.proxies)
+        # no proxy is tripped by the failures of the test
+        ps.Web.maxFailedProxyRequests = 100
+
+    def tearDown(self):
+        for name in self.web:
+            setattr(ps.Web, name, self.web[name])
+
+    def load(self, failures):
+        loader = StubLoader(failures)
+        ps.Web._loadGrabPage = staticmethod(loader)
+        return loader
+
+    def testFailedProxiesExcludedForTheCall(self):
+        loader = self.load(3)
+        exceptProxy = set()
+        page = ps.Web._getGrabPageProxy('http://a.com/', exceptProxy)
+        self.assertEqual(len(loader.proxies), 4)
+        self.assertEqual(len(set(loader.proxies)), 4)
+        self.assertIs(page.proxy, loader.proxies[-1])
+        self.assertEqual(exceptProxy, set(loader.proxies[:3]))
+        self.assertEqual(loader.poolSizes, [5] * 4)
+        self.assertEqual(set(ps.Web._proxies), set(self.proxies))
+
+    def testAllProxiesFailed(self):
+        loader = self.load(10)
+        self.assertRaises(ps.AllProxyAlreadyUsed, ps.Web._getGrabPageProxy
+                          , 'http://a.com/')
+        self.assertEqual(len(set(loader.proxies)), 5)
+        self.assertEqual(set(ps.Web._proxies), set(self.proxies))
+        # the next call starts with all proxies again
+        loader = self.load(0)
+        ps.Web._getGrabPageProxy('http://a.com/')
+        self.assertEqual(len(loader.proxies), 1)
+
+    def testPoolEmptiedByOtherCalls(self):
+        loader = self.load(10)
+
+        def emptyingLoader(url, currentProxy=None, **kwargs):
+            # the other threads tripped all proxies meanwhile
+            ps.Web._proxies = ps.ProxyPool()
+            ps.Web._failedProxies = set(self.proxies)
+            return loader(url, currentProxy, **kwargs)
+        ps.Web._loadGrabPage = staticmethod(emptyingLoader)
+        try:
+            ps.Web._getGrabPageProxy('http://a.com/')
+        except ps.AllProxyAlreadyUsed:
+            self.fail('AllProxyAlreadyUsed is raised')
+        except ps.ProxyError as e:
+            self.assertIn('All proxy servers is failed', str(e))
+            self.assertEqual(len(e.exceptionList), 1)
+        else:
+            self.fail('ProxyError is not raised')
+        self.assertEqual(len(loader.proxies), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+The File node of a page read from the cache as MappedBody: _elem is still
+the body string, the mapped body is _mappedBody, and the node is hashed and
+written as the string body.
+"""
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+URL = u'http://a.com/files/data.bin'
+BODY = 'data' * 64
+
+
+class MappedFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp() + '/'
+        self.pageCache = dict((name, getattr(ps.PageCache, name)) for name in (
+            'cacheDir', 'mapMinBytes', 'writeBehind'))
+        ps.PageCache.cacheDir = self.dir + 'cache/'
+        ps.PageCache.mapMinBytes = 16
+        ps.PageCache.writeBehind = False
+        ps.PageCache._cache.clear()
+        ps.PageCache._cacheBodyBytes = 0
+
+    def tearDown(self):
+        ps.PageCache.flush()
+        ps.CacheIndex.close()
+        ps.PageCache._cache.clear()
+        ps.PageCache._cacheBodyBytes = 0
+        for name in self.pageCache:
+            setattr(ps.PageCache, name, self.pageCache[name])
+        shutil.rmtree(self.dir)
+
+    def createFile(self):
+        return ps.File(ps.value(URL), homeDir=self.dir, dirForFile='files/')
+
+    def mappedFile(self):
+        response = ps.WebResponse(200, BODY, URL)
+        page = ps.WebPage(ps.WebDocument(response), url=URL)
+        page.loadTime = time.time()
+        ps.PageCache._storePageNow(URL, page)
+        node = self.createFile()
+        node._elem = URL
+        node._processing()
+        return node
+
+    def testStringElem(self):
+        node = self.mappedFile()
+        self.assertIsInstance(node._mappedBody, ps.MappedBody)
+        self.assertIs(type(node._elem), str)
+        self.assertEqual(node._elem, BODY)
+
+    def testHash(self):
+        node = self.mappedFile()
+        self.assertEqual(node._getHash(), ps.md5(BODY))
+        self.assertNotEqual(node._getTreeHash(), '')
+
+    def testWrite(self):
+        node = self.mappedFile()
+        node._write()
+        writtenFile = open(self.dir + 'files/files/data.bin', 'rb')
+        try:
+            self.assertEqual(writtenFile.read(), BODY)
+        finally:
+            writtenFile.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
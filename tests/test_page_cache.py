@@ -0,0 +1,200 @@
+"""
+The disk tier of PageCache: the pages written by _storePageNow are read
+back by _readPage with their meta, compressed and mapped, and the pickled
+pages of the old layout are still read. The reads order the pages for the
+eviction, the failed write-behind is raised by flush, the restarted
+writer registers its close at exit once.
+"""
+import os
+import os.path
+import pickle
+import shutil
+import StringIO
+import sys
+import tempfile
+import time
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+
+def createPage(url, body, code=200):
+    response = ps.WebResponse(code, body, url, {'etag': '"v1"'})
+    page = ps.WebPage(ps.WebDocument(response), url=url)
+    page.loadTime = time.time()
+    return page
+
+
+class PageCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp() + '/'
+        self.pageCache = dict((name, getattr(ps.PageCache, name)) for name in (
+            'cacheDir', 'mapMinBytes', 'writeBehind'))
+        ps.PageCache.cacheDir = self.cacheDir
+        ps.PageCache.writeBehind = False
+
+    def tearDown(self):
+        ps.CacheIndex.close()
+        for name in self.pageCache:
+            setattr(ps.PageCache, name, self.pageCache[name])
+        shutil.rmtree(self.cacheDir)
+
+    def store(self, url, body):
+        page = createPage(url, body)
+        fileName = ps.PageCache._storePageNow(url, page)
+        return page, fileName
+
+
+class RoundTripTest(PageCacheTestCase):
+
+    def readBack(self, url):
+        fileName, meta = ps.CacheIndex.get(url)
+        return ps.PageCache._readPage(fileName, meta)
+
+    def testCompressed(self):
+        url = u'http://a.com/1'
+        page, fileName = self.store(url, '<html>one</html>')
+        self.assertTrue(fileName.endswith(ps.PageCache._bodyExtension))
+        read = self.readBack(url)
+        self.assertEqual(read.httpBody, '<html>one</html>')
+        self.assertEqual(read.httpCode, 200)
+        self.assertEqual(read.uuid, page.uuid)
+        self.assertEqual(read.header('etag'), '"v1"')
+        self.assertEqual(read.loadTime, page.loadTime)
+
+    def testMapped(self):
+        ps.PageCache.mapMinBytes = 16
+        url = u'http://a.com/2'
+        body = '<html>' + 'x' * 100 + '</html>'
+        self.store(url, body)
+        read = self.readBack(url)
+        self.assertIsInstance(read.response.mappedBody, ps.MappedBody)
+        self.assertEqual(read.httpBody, body)
+
+    def testSameBodyStoredOnce(self):
+        _, first = self.store(u'http://a.com/1', '<html>same</html>')
+        _, second = self.store(u'http://a.com/2', '<html>same</html>')
+        self.assertEqual(first, second)
+        self.assertEqual(self.readBack(u'http://a.com/2').httpBody
+                         , '<html>same</html>')
+
+    def testPickledPage(self):
+        url = u'http://a.com/old'
+        page = createPage(url, '<html>old</html>')
+        pageFile = open(ps.PageCache._path('1.pickle'), 'wb')
+        pickle.Pickler(pageFile, pickle.HIGHEST_PROTOCOL).dump(page)
+        pageFile.close()
+        read = ps.PageCache._readPage('1.pickle')
+        self.assertEqual(read.httpBody, '<html>old</html>')
+
+
+class BrokenFileTest(PageCacheTestCase):
+
+    def testSharedBodyKeptUntilUnreferenced(self):
+        body = '<html>shared</html>'
+        _, fileName = self.store(u'http://a.com/1', body)
+        self.store(u'http://a.com/2', body)
+        path = ps.PageCache._path(fileName)
+        brokenFile = open(path, 'wb')
+        brokenFile.write('broken')
+        brokenFile.close()
+        meta = ps.CacheIndex.get(u'http://a.com/1')[1]
+        self.assertIsNone(ps.PageCache._readPage(fileName, meta
+                                                 , u'http://a.com/1'))
+        self.assertIsNone(ps.CacheIndex.get(u'http://a.com/1'))
+        self.assertTrue(os.path.exists(path))
+        meta = ps.CacheIndex.get(u'http://a.com/2')[1]
+        self.assertIsNone(ps.PageCache._readPage(fileName, meta
+                                                 , u'http://a.com/2'))
+        self.assertIsNone(ps.CacheIndex.get(u'http://a.com/2'))
+        self.assertFalse(os.path.exists(path))
+
+
+class AccessTimeTest(PageCacheTestCase):
+
+    def testReadPagesAreEvictedLast(self):
+        urls = [u'http://a.com/{0}'.format(i) for i in range(3)]
+        for url in urls:
+            self.store(url, '<html>{0}</html>'.format(url))
+        fileName, meta = ps.CacheIndex.get(urls[0])
+        self.assertIsNotNone(ps.PageCache._readPage(fileName, meta, urls[0]))
+        ps.PageCache.flush()
+        rows = ps.CacheIndex.leastRecentlyUsed()
+        self.assertEqual([url for url, _, _ in rows]
+                         , [urls[1], urls[2], urls[0]])
+        # the load order is not changed by the read
+        rows = ps.CacheIndex.oldest()
+        self.assertEqual([url for url, _, _ in rows], urls)
+
+
+class WriteBehindErrorTest(PageCacheTestCase):
+
+    def setUp(self):
+        PageCacheTestCase.setUp(self)
+        ps.PageCache.writeBehind = True
+        self.storePageNow = ps.PageCache.__dict__['_storePageNow']
+        self.stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+
+        def storePageNow(url, page, fileName=None, oldFileName=None):
+            raise IOError('disk full: ' + url)
+        ps.PageCache._storePageNow = staticmethod(storePageNow)
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        ps.PageCache._storePageNow = self.storePageNow
+        PageCacheTestCase.tearDown(self)
+
+    def testFirstErrorRaisedByFlush(self):
+        for i in range(2):
+            url = u'http://a.com/{0}'.format(i)
+            ps.PageCache.writePageInCache(url, createPage(url, 'x'))
+        with self.assertRaises(IOError) as context:
+            ps.PageCache.flush()
+        self.assertEqual(str(context.exception), 'disk full: http://a.com/0')
+        lines = sys.stderr.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('PageWriter: '))
+        self.assertTrue(lines[1].endswith('disk full: http://a.com/1'))
+        # the error is raised once
+        ps.PageCache.flush()
+
+    def testCloseRegisteredOnce(self):
+        registered = []
+        register = ps.atexit.register
+        ps.atexit.register = registered.append
+        try:
+            for i in range(3):
+                url = u'http://a.com/{0}'.format(i)
+                ps.PageCache.writePageInCache(url, createPage(url, 'x'))
+                ps.PageWriter.close()
+        finally:
+            ps.atexit.register = register
+        self.assertLessEqual(registered.count(ps.PageWriter.close), 1)
+
+
+class MemoryBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.memoryCacheBodyBytes = ps.PageCache.memoryCacheBodyBytes
+        ps.PageCache._cache.clear()
+        ps.PageCache._cacheBodyBytes = 0
+
+    def tearDown(self):
+        ps.PageCache.memoryCacheBodyBytes = self.memoryCacheBodyBytes
+        ps.PageCache._cache.clear()
+        ps.PageCache._cacheBodyBytes = 0
+
+    def testBodyBytesBudget(self):
+        ps.PageCache.memoryCacheBodyBytes = 250
+        for i in range(3):
+            url = u'http://a.com/{0}'.format(i)
+            ps.PageCache._memoryPut(url, createPage(url, 'x' * 100), None)
+        self.assertEqual(list(ps.PageCache._cache)
+                         , [u'http://a.com/1', u'http://a.com/2'])
+        self.assertEqual(ps.PageCache.stats()['bodyBytes'], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
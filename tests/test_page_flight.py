@@ -0,0 +1,200 @@
+"""
+PageCache.getPage without the web: the threads asking for the url that is
+loading wait for the one load and share its page or its error, a reload
+does not take the page of an ordinary load. The urls answered with 404 or
+failed negativeFailures times are not loaded again for negativeTtl.
+"""
+import os.path
+import sys
+import threading
+import time
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+URL = u'http://a.com/item'
+
+
+def createPage(url, code=200):
+    response = ps.WebResponse(code, '<html>{0}</html>'.format(code), url)
+    page = ps.WebPage(ps.WebDocument(response), url=url)
+    page.loadTime = time.time()
+    return page
+
+
+class WaitedEvent(object):
+    """
+    The done event of the flight that tells when a thread waits for it.
+    """
+
+    def __init__(self):
+        self.waited = threading.Event()
+        self.event = threading.Event()
+
+    def wait(self, timeout=None):
+        self.waited.set()
+        return self.event.wait(timeout)
+
+    def set(self):
+        self.event.set()
+
+
+class PageCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pageCache = dict((name, getattr(ps.PageCache, name)) for name in (
+            'cacheDir', 'memoryCache', 'negativeTtl', 'negativeFailures'))
+        ps.PageCache.cacheDir = None
+        self.getGrabPage = ps.Web.__dict__['getGrabPage']
+        self.loads = []
+        self.clear()
+
+        def getGrabPage(url, oldAttemptsPages=None, headers=None):
+            self.loads.append(url)
+            return self.load(url)
+        ps.Web.getGrabPage = staticmethod(getGrabPage)
+
+    def tearDown(self):
+        ps.Web.getGrabPage = self.getGrabPage
+        for name in self.pageCache:
+            setattr(ps.PageCache, name, self.pageCache[name])
+        self.clear()
+
+    def clear(self):
+        ps.PageCache._cache.clear()
+        ps.PageCache._cacheBodyBytes = 0
+        ps.PageCache._negative.clear()
+        ps.PageCache._flights.clear()
+
+    def load(self, url):
+        return createPage(url)
+
+
+class FlightTest(PageCacheTestCase):
+
+    def setUp(self):
+        PageCacheTestCase.setUp(self)
+        ps.PageCache.memoryCache = False
+        self.error = None
+        self.done = None
+
+    def load(self, url):
+        if len(self.loads) == 1:
+            # the other thread is started when the flight is registered and
+            # the load returns when it waits for the flight
+            self.done = ps.PageCache._flights[url].done = WaitedEvent()
+            self.loading.set()
+            self.done.waited.wait(10)
+            if self.error is not None:
+                raise self.error
+        return createPage(url)
+
+    def getPages(self, withoutCache=False):
+        """
+        The results of the thread that loads the page and of the thread
+        that asks for it while it is loading.
+        """
+        self.loading = threading.Event()
+        results = [None, None]
+
+        def getPage(index, withoutCache):
+            try:
+                results[index] = ps.PageCache.getPage(URL, withoutCache)
+            except Exception as e:
+                results[index] = e
+        loader = threading.Thread(target=getPage, args=(0, False))
+        loader.start()
+        self.assertTrue(self.loading.wait(10))
+        waiter = threading.Thread(target=getPage, args=(1, withoutCache))
+        waiter.start()
+        loader.join(10)
+        waiter.join(10)
+        self.assertTrue(self.done.waited.is_set())
+        return results
+
+    def testOneLoad(self):
+        loaded, waited = self.getPages()
+        self.assertEqual(self.loads, [URL])
+        self.assertIsInstance(loaded, ps.WebPage)
+        self.assertIs(waited, loaded)
+        self.assertEqual(ps.PageCache._flights, {})
+
+    def testErrorShared(self):
+        self.error = ps.WebError('connection refused')
+        loaded, waited = self.getPages()
+        self.assertEqual(self.loads, [URL])
+        self.assertIs(loaded, self.error)
+        self.assertIs(waited, self.error)
+        self.assertEqual(ps.PageCache._flights, {})
+
+    def testReloadNotShared(self):
+        loaded, reloaded = self.getPages(withoutCache=True)
+        self.assertEqual(self.loads, [URL, URL])
+        self.assertIsInstance(reloaded, ps.WebPage)
+        self.assertIsNot(reloaded, loaded)
+
+
+class NegativeCacheTest(PageCacheTestCase):
+
+    def setUp(self):
+        PageCacheTestCase.setUp(self)
+        ps.PageCache.negativeTtl = 60
+        ps.PageCache.negativeFailures = 3
+        self.code = 200
+
+    def load(self, url):
+        if self.code >= 500:
+            raise ps.WebError('server error', httpCode=self.code)
+        return createPage(url, self.code)
+
+    def expire(self):
+        code, failures, failTime = ps.PageCache._negative[URL]
+        ps.PageCache._negative[URL] = (code, failures, failTime - 61)
+
+    def testNotFoundPageKept(self):
+        ps.PageCache.memoryCache = True
+        self.code = 404
+        page = ps.PageCache.getPage(URL)
+        self.assertEqual(page.httpCode, 404)
+        self.assertIs(ps.PageCache.getPage(URL, withoutCache=True), page)
+        self.assertEqual(len(self.loads), 1)
+        self.expire()
+        self.assertIsNot(ps.PageCache.getPage(URL, withoutCache=True), page)
+        self.assertEqual(len(self.loads), 2)
+
+    def testNotFoundRaised(self):
+        ps.PageCache.memoryCache = False
+        self.code = 410
+        ps.PageCache.getPage(URL)
+        with self.assertRaises(ps.NegativeCacheError) as context:
+            ps.PageCache.getPage(URL)
+        self.assertEqual(context.exception.httpCode, 410)
+        self.assertEqual(len(self.loads), 1)
+
+    def testRepeatedFailures(self):
+        ps.PageCache.memoryCache = False
+        self.code = 503
+        for _ in range(3):
+            self.assertRaises(ps.WebError, ps.PageCache.getPage, URL)
+        with self.assertRaises(ps.NegativeCacheError) as context:
+            ps.PageCache.getPage(URL)
+        self.assertEqual(context.exception.failures, 3)
+        self.assertEqual(len(self.loads), 3)
+        self.expire()
+        self.code = 200
+        self.assertEqual(ps.PageCache.getPage(URL).httpCode, 200)
+        self.assertEqual(len(self.loads), 4)
+        self.assertNotIn(URL, ps.PageCache._negative)
+
+    def testFewerFailuresLoaded(self):
+        ps.PageCache.memoryCache = False
+        self.code = 503
+        for _ in range(2):
+            self.assertRaises(ps.WebError, ps.PageCache.getPage, URL)
+        self.code = 200
+        ps.PageCache.getPage(URL)
+        self.assertEqual(len(self.loads), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+parscache evict: the pages without a load time (imported from the old
+url_file.map) are aged by their file, the least recently read pages go
+first over the size budget.
+"""
+import argparse
+import os
+import os.path
+import shutil
+import StringIO
+import sys
+import tempfile
+import time
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+import parscache
+
+
+def createPage(url, body):
+    response = ps.WebResponse(200, body, url)
+    page = ps.WebPage(ps.WebDocument(response), url=url)
+    page.loadTime = time.time()
+    return page
+
+
+class EvictTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp() + '/'
+        self.pageCache = dict((name, getattr(ps.PageCache, name)) for name in (
+            'cacheDir', 'writeBehind'))
+        ps.PageCache.cacheDir = self.cacheDir
+        ps.PageCache.writeBehind = False
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        ps.CacheIndex.close()
+        for name in self.pageCache:
+            setattr(ps.PageCache, name, self.pageCache[name])
+        shutil.rmtree(self.cacheDir)
+
+    def store(self, url, body, age=None):
+        """
+        age: the page imported without a load time, its file is age
+        seconds old.
+        """
+        fileName = ps.PageCache._storePageNow(url, createPage(url, body))
+        if age is not None:
+            ps.CacheIndex._connection().execute(
+                'UPDATE pages SET loadTime = NULL WHERE url = ?', (url,))
+            fileTime = time.time() - age
+            os.utime(ps.PageCache._path(fileName), (fileTime, fileTime))
+
+    def evict(self, maxAge=None, maxBytes=None):
+        parscache.evict(argparse.Namespace(cacheDir=self.cacheDir
+                                           , processes=1, maxAge=maxAge
+                                           , maxBytes=maxBytes))
+        return sorted(url for url, _, _ in ps.CacheIndex.items())
+
+    def testImportedPagesAgedByFile(self):
+        self.store(u'http://a.com/new', '<html>new</html>', age=60)
+        self.store(u'http://a.com/old', '<html>old</html>', age=7200)
+        self.store(u'http://a.com/loaded', '<html>loaded</html>')
+        self.assertEqual(self.evict(maxAge=3600)
+                         , [u'http://a.com/loaded', u'http://a.com/new'])
+        # the age of the kept page is in the index now
+        loadTime = dict((url, loadTime) for url, _, loadTime
+                        in ps.CacheIndex.oldest())[u'http://a.com/new']
+        self.assertAlmostEqual(loadTime, time.time() - 60, delta=5)
+
+    def testLeastRecentlyRead(self):
+        for i in range(3):
+            self.store(u'http://a.com/{0}'.format(i), 'x{0}'.format(i) * 500)
+        fileName, meta = ps.CacheIndex.get(u'http://a.com/0')
+        ps.PageCache._readPage(fileName, meta, u'http://a.com/0')
+        ps.PageCache.flush()
+        _, size = parscache._diskUsage(self.cacheDir, 1)
+        self.assertEqual(self.evict(maxBytes=size - 1)
+                         , [u'http://a.com/0', u'http://a.com/2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
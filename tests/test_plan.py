@@ -0,0 +1,107 @@
+"""
+The compiled construction plan against the generic construction: the
+printed trees and the catcher calls of both paths are compared on a
+template with lists, a dict, a single node, a replaceObj and instance
+controls. The plans belong to the Processor call, the template is not
+changed by them.
+"""
+import os.path
+import StringIO
+import sys
+import unittest
+from lxml import etree
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+ROWS = 30
+
+
+def createTree():
+    rows = []
+    i = 0
+    while i < ROWS:
+        stock = '<td class="stock">in stock</td>' if i % 3 else ''
+        rows.append('<tr><td class="name"><a href="/item/{0}">Item {0}</a>'
+                    '</td><td class="price">{1} USD</td>{2}</tr>'.format(
+                        i, i * 7 % 1000, stock))
+        i += 1
+    body = '<html><body><h1>Listing</h1><table>{0}</table></body></html>'
+    return etree.fromstring(body.format(''.join(rows)), etree.HTMLParser())
+
+
+class Checked(ps.TreeXpath):
+
+    __slots__ = ()
+
+    def _processing(self, oldAttemptsInstances=None):
+        ps.TreeXpath._processing(self)
+
+
+def createTemplate(tree, calls):
+    def catcher(instance):
+        calls.append((instance._name, instance.name._elem))
+    row = ps.TreeXpath(ps.xpath('//tr'), catcher=catcher)
+    row.name = ps.Str(ps.xpath('./td[@class="name"]/a/text()'))
+    price = ps.Str(ps.xpath('./td[@class="price"]/text()'))
+    price.value = ps.Value(ps.reValue('USD'))
+    row.price = price
+    row.link = ps.Url(ps.href('./td[@class="name"]/a'))
+    # the rows without stock fail the control and are retried
+    checked = Checked(ps.xpath('.'), needControl=True, maxAttempts=2)
+    checked.stock = ps.Text(ps.xpath('./td[@class="stock"]'))
+    row.checked = checked
+    byName = ps.TreeXpath(ps.xpath('//tr'), catcher=catcher)
+    byName.name = ps.Str(ps.xpath('./td[@class="name"]/a/text()'))
+    byName.price = ps.Str(ps.xpath('./td[@class="price"]/text()'))
+    root = ps.TreeXpath(ps.value(tree))
+    root.rows = [row]
+    root.byName = {ps.Str(ps.xpath('./td[@class="name"]/a/text()')): byName}
+    root.title = ps.Str(ps.xpath('//h1/text()'))
+    root.first = ps.TreeXpath(
+        ps.xpath('//table'),
+        replaceObj=ps.Str(ps.xpath('.//tr[1]/td[@class="name"]/a/text()')))
+    return root
+
+
+def construct(compilePlan):
+    calls = []
+    processor = ps.Processor()
+    processor.compilePlan = compilePlan
+    processor.root = createTemplate(createTree(), calls)
+    processor(processor.root)
+    output = StringIO.StringIO()
+    processor.result.root.printTree(fileObject=output)
+    return output.getvalue(), calls
+
+
+class PlanTest(unittest.TestCase):
+
+    def testSameTreeAndCatcherCalls(self):
+        genericTree, genericCalls = construct(False)
+        planTree, planCalls = construct(True)
+        self.assertEqual(genericTree, planTree)
+        self.assertEqual(genericCalls, planCalls)
+        self.assertEqual(len(genericCalls), ROWS * 2)
+        self.assertIn('Item 7', genericTree)
+
+    def testSharedTemplate(self):
+        """
+        The calls with and without plans construct the same template one
+        after another, the plans are dropped with the call.
+        """
+        genericTree, _ = construct(False)
+        template = createTemplate(createTree(), [])
+        outputs = []
+        for compilePlan in (True, False, True):
+            processor = ps.Processor()
+            processor.compilePlan = compilePlan
+            processor.root = template
+            processor(processor.root)
+            self.assertIsNone(processor._plans)
+            output = StringIO.StringIO()
+            processor.result.root.printTree(fileObject=output)
+            outputs.append(output.getvalue())
+        self.assertEqual(outputs, [genericTree] * 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+"""
+The prefetching of list items: only node classes with a _prefetch use a
+pool, the lists of one Processor call share its pool, and the pages
+prefetched for items that were not constructed are dropped. The page urls
+are resolved by the constructing thread, the workers do not touch the
+tree.
+"""
+import os.path
+import sys
+import threading
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+
+class Fetched(ps.Str):
+    """
+    Registers the prefetched url as PageCache.prefetchPage does, without
+    the web.
+    """
+
+    __slots__ = ()
+
+    threads = set()
+
+    def _prefetch(self, queryResult):
+        Fetched.threads.add(threading.current_thread().name)
+        url = u'http://example.com/' + queryResult
+        with ps.PageCache._lock:
+            ps.PageCache._prefetched[ps.PageCache._prefetchKey(url)] = url
+        return url
+
+
+def valueList(count, prefix):
+    return ps.valueList([u'{0}{1}'.format(prefix, i) for i in range(count)])
+
+
+class Failure(Exception):
+    pass
+
+
+def construct(row):
+    processor = ps.Processor()
+    processor.root = ps.Str(ps.value(u'listing'))
+    processor.root.rows = [row]
+    processor(processor.root)
+    return processor
+
+
+class PrefetchTest(unittest.TestCase):
+
+    def setUp(self):
+        Fetched.threads = set()
+        ps.PageCache._prefetched.clear()
+
+    def tearDown(self):
+        ps.Processor.prefetchThreads = None
+        ps.PageCache._prefetched.clear()
+
+    def testNoPrefetcherWithoutPrefetch(self):
+        node = ps.Str(valueList(4, 'a'), concurrency=4)
+        self.assertIsNone(node._prefetcher([u'a', u'b', u'c']))
+        node = Fetched(valueList(4, 'a'), concurrency=4)
+        prefetcher = node._prefetcher([u'a', u'b', u'c'])
+        self.assertIsNotNone(prefetcher)
+        prefetcher.close()
+
+    def testListsShareTheProcessorPool(self):
+        ps.Processor.prefetchThreads = 2
+        row = Fetched(valueList(6, 'row'), concurrency=4)
+        row.items = [Fetched(valueList(6, 'item'), concurrency=4)]
+        processor = construct(row)
+        rows = processor.result.root.rows
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(len(rows[0].items), 6)
+        self.assertTrue(0 < len(Fetched.threads) <= 2)
+        self.assertIsNone(processor._pool)
+        self.assertEqual(ps.PageCache._prefetched, {})
+
+    def testUnclaimedPagesDroppedOnError(self):
+        def catcher(instance):
+            if instance._elem == u'row2':
+                raise Failure()
+        row = Fetched(valueList(20, 'row'), concurrency=4, catcher=catcher)
+        self.assertRaises(Failure, construct, row)
+        self.assertEqual(ps.PageCache._prefetched, {})
+
+    def testUnclaimedPagesDroppedOnMaxIteration(self):
+        row = Fetched(valueList(20, 'row'), concurrency=4, maxIteration=3)
+        processor = construct(row)
+        self.assertEqual(len(processor.result.root.rows), 3)
+        self.assertEqual(ps.PageCache._prefetched, {})
+
+
+class PageUrlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.prefetchPage = ps.PageCache.__dict__['prefetchPage']
+        self.resolvedUrlParts = ps.ParsBase.__dict__['_resolvedUrlParts']
+        self.prefetched = []
+        self.resolvingThreads = set()
+
+        def prefetchPage(url, maxAge=None):
+            self.prefetched.append(url)
+
+        def resolvedUrlParts(node):
+            self.resolvingThreads.add(threading.current_thread().name)
+            return self.resolvedUrlParts(node)
+        ps.PageCache.prefetchPage = staticmethod(prefetchPage)
+        ps.ParsBase._resolvedUrlParts = resolvedUrlParts
+
+    def tearDown(self):
+        ps.PageCache.prefetchPage = self.prefetchPage
+        ps.ParsBase._resolvedUrlParts = self.resolvedUrlParts
+
+    def testParentUrlResolvedByTheCaller(self):
+        parent = ps.Str(None)
+        parent._url = 'http://h.com/dir/list.html'
+        page = ps.Page(valueList(4, 'p'), concurrency=4)
+        page.parent = parent
+        prefetcher = page._prefetcher([u'a.html', u'../b.html'])
+        for _ in range(2):
+            prefetcher.wait()
+        prefetcher.close()
+        self.assertEqual(sorted(self.prefetched)
+                         , ['http://h.com/b.html', 'http://h.com/dir/a.html'])
+        self.assertEqual(self.resolvingThreads
+                         , set([threading.current_thread().name]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+The proxy score file: saved and built under a bare file name, and built
+into an existing file without losing the proxies it does not replay.
+"""
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+
+class ProxyScoresTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        self.proxyScores = ps.Web._proxyScores
+        ps.Web._proxyScores = {}
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+        ps.Web._proxyScores = self.proxyScores
+
+    def writeStat(self, fileName, events):
+        statFile = open(fileName, 'w')
+        for event, proxy in events:
+            statFile.write('<{0}>\t{1}\t"http://a.com/"\n'.format(event
+                                                                , proxy))
+        statFile.close()
+
+    def testSaveBareFileName(self):
+        proxy = ps.Proxy('10.0.0.1', '80', 'http')
+        ps.Web.saveProxyScores('scores.txt', [proxy])
+        self.assertEqual(list(ps.Web._readProxyScores('scores.txt'))
+                         , ['10.0.0.1:80'])
+
+    def testBuildMergesIntoTheFile(self):
+        kept = ps.Proxy('10.0.0.2', '80', 'http')
+        kept.requests = 7
+        replayed = ps.Proxy('10.0.0.1', '80', 'http')
+        replayed.requests = 100
+        ps.Web.saveProxyScores('scores.txt', [kept, replayed])
+        self.writeStat('1.proxystat', [('successRequest', '10.0.0.1:80')
+                                       , ('failedRequest', '10.0.0.1:80')
+                                       , ('successRequest', '10.0.0.3:80')])
+        count = ps.Web.buildProxyScores(['1.proxystat'], 'scores.txt')
+        self.assertEqual(count, 2)
+        scores = ps.Web._readProxyScores('scores.txt')
+        self.assertEqual(sorted(scores)
+                         , ['10.0.0.1:80', '10.0.0.2:80', '10.0.0.3:80'])
+        proxy = ps.Proxy('10.0.0.2', '80', 'http')
+        proxy.loadScore(scores['10.0.0.2:80'])
+        self.assertEqual(proxy.requests, 7)
+        proxy = ps.Proxy('10.0.0.1', '80', 'http')
+        proxy.loadScore(scores['10.0.0.1:80'])
+        self.assertEqual((proxy.requests, proxy.successRequests), (2, 1))
+        self.assertEqual(sorted(os.listdir('.'))
+                         , ['1.proxystat', 'scores.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+"""
+The request slots of HostScheduler, the retry budget of RetryScheduler
+and the delayed requests of CurlMultiTransport: nothing sleeps in the
+caller and the tables of the schedulers are pruned.
+"""
+import os.path
+import sys
+import time
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+
+class FakeProxy(object):
+
+    def __init__(self, port):
+        self.address = '10.0.0.1'
+        self.port = str(port)
+
+
+class FakePool(object):
+
+    def __init__(self, proxies):
+        self.proxies = proxies
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def next(self, exceptProxy=None):
+        for proxy in self.proxies:
+            if exceptProxy is None or proxy not in exceptProxy:
+                return proxy
+        return None
+
+
+class RecordingMulti(object):
+
+    def __init__(self):
+        self.handles = []
+
+    def add_handle(self, curl):
+        self.handles.append(curl)
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.web = dict((name, getattr(ps.Web, name)) for name in (
+            'randomDelayPeriod', 'delayByProxy', 'hostBurst', '_proxies'
+            , 'maxUrlRetries', 'serverErrorWait', '_scheduler'))
+        self.prunePeriod = ps.HostScheduler.prunePeriod
+
+    def tearDown(self):
+        for name in self.web:
+            setattr(ps.Web, name, self.web[name])
+        ps.HostScheduler.prunePeriod = self.prunePeriod
+
+
+class HostSchedulerTest(SchedulerTestCase):
+
+    def testReserveReturnsSlotTimes(self):
+        ps.Web.randomDelayPeriod = (10, 10)
+        scheduler = ps.HostScheduler()
+        startTime = time.time()
+        first = scheduler.reserve('http://a.com/1')
+        second = scheduler.reserve('http://a.com/2')
+        other = scheduler.reserve('http://b.com/1')
+        self.assertLess(time.time() - startTime, 1)
+        self.assertLessEqual(first, time.time())
+        self.assertAlmostEqual(second - first, 10, delta=0.5)
+        self.assertLessEqual(other, time.time())
+        self.assertAlmostEqual(scheduler.readyTime('http://a.com/3')
+                               , second + 10, delta=0.5)
+
+    def testBackoff(self):
+        scheduler = ps.HostScheduler()
+        scheduler.backoff('http://a.com/1', 30)
+        self.assertGreater(scheduler.reserve('http://a.com/2')
+                           , time.time() + 25)
+        self.assertLessEqual(scheduler.reserve('http://b.com/2'), time.time())
+
+    def testPrune(self):
+        ps.Web.randomDelayPeriod = (0.01, 0.01)
+        ps.HostScheduler.prunePeriod = 0
+        scheduler = ps.HostScheduler()
+        scheduler.reserve('http://a.com/1')
+        scheduler.backoff('http://b.com/1', 0.01)
+        time.sleep(0.05)
+        scheduler.reserve('http://c.com/1')
+        self.assertEqual(list(scheduler._slotTimes), [('c.com', None)])
+        self.assertEqual(scheduler._backoffTimes, {})
+
+    def testReadyProxy(self):
+        ps.Web.randomDelayPeriod = (10, 10)
+        ps.Web.delayByProxy = True
+        proxies = [FakeProxy(port) for port in range(3)]
+        ps.Web._proxies = FakePool(proxies)
+        ps.Web._scheduler = ps.HostScheduler()
+        url = 'http://a.com/1'
+        self.assertIs(ps.Web._nextProxy(set(), url), proxies[0])
+        ps.Web._scheduler.reserve(url, proxies[0])
+        self.assertIs(ps.Web._nextProxy(set(), url), proxies[1])
+        ps.Web._scheduler.reserve(url, proxies[1])
+        ps.Web._scheduler.reserve(url, proxies[2])
+        # none is ready: the one ready first
+        self.assertIs(ps.Web._nextProxy(set(), url), proxies[0])
+        self.assertIs(ps.Web._nextProxy(set([proxies[0]]), url), proxies[1])
+
+
+class RetrySchedulerTest(SchedulerTestCase):
+
+    def setUp(self):
+        SchedulerTestCase.setUp(self)
+        ps.Web._scheduler = ps.HostScheduler()
+        ps.Web.maxUrlRetries = 2
+
+    def testBudgetUntilSuccess(self):
+        retries = ps.RetryScheduler()
+        url = 'http://a.com/1'
+        self.assertTrue(retries.retry(url))
+        self.assertTrue(retries.retry(url))
+        self.assertFalse(retries.retry(url))
+        retries.success(url)
+        self.assertEqual(retries._urlRetries, {})
+        self.assertTrue(retries.retry(url))
+        self.assertEqual(retries.stats()['retriedUrls'], 2)
+
+    def testExpiry(self):
+        ps.Web.serverErrorWait = 0.01
+        ps.HostScheduler.prunePeriod = 0
+        retries = ps.RetryScheduler()
+        url = 'http://a.com/1'
+        self.assertTrue(retries.retry(url))
+        self.assertTrue(retries.retry(url))
+        time.sleep(0.05)
+        self.assertTrue(retries.retry('http://a.com/2'))
+        self.assertNotIn(url, retries._urlRetries)
+        self.assertTrue(retries.retry(url))
+
+
+@unittest.skipIf(ps.pycurl is None, 'pycurl is not installed')
+class DelayedRequestTest(unittest.TestCase):
+
+    def testRequestWaitsInTheLoop(self):
+        transport = ps.CurlMultiTransport()
+        transport._multi = RecordingMulti()
+        request = ps._CurlRequest('http://a.com/1', ('a.com', None), 1, 1
+                                  , {})
+        request.startTime = time.time() + 0.2
+        transport._queue.put(request)
+        transport._addRequests(block=False)
+        self.assertEqual(transport._multi.handles, [])
+        self.assertEqual(len(transport._delayed), 1)
+        startTime = time.time()
+        transport._addRequests(block=True)
+        self.assertGreaterEqual(time.time(), request.startTime)
+        self.assertLess(time.time() - startTime, 1)
+        self.assertEqual(transport._multi.handles, [request.curl])
+        self.assertEqual(transport._delayed, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
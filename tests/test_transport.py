@@ -0,0 +1,174 @@
+"""
+The transport of Web: the selection by Web.transportName, the fallback to
+GrabTransport without pycurl, and the CurlMultiTransport requests when the
+event loop fails or does not answer: the request is cancelled before it is
+retried.
+"""
+import os.path
+import StringIO
+import sys
+import time
+import unittest
+import grab
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+
+class FailingMulti(object):
+
+    def add_handle(self, curl):
+        pass
+
+    def remove_handle(self, curl):
+        pass
+
+    def perform(self):
+        raise RuntimeError('perform failed')
+
+
+class SilentMulti(FailingMulti):
+
+    def perform(self):
+        return 0, 1
+
+    def info_read(self):
+        return 0, [], []
+
+    def select(self, timeout):
+        time.sleep(timeout)
+
+
+class RecordingMulti(SilentMulti):
+    """
+    Records the handles added and removed, the requests never get an
+    answer.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def add_handle(self, curl):
+        self.events.append(('add', curl.request.url))
+
+    def remove_handle(self, curl):
+        self.events.append(('remove', None))
+
+
+class HangingMulti(RecordingMulti):
+
+    def perform(self):
+        time.sleep(60)
+
+
+class TransportSelectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transportName = ps.Web.transportName
+        self.pycurl = ps.pycurl
+        self.stderr = sys.stderr
+        ps.Web._transport = None
+        ps.Web._transportClass = None
+
+    def tearDown(self):
+        ps.Web.transportName = self.transportName
+        ps.pycurl = self.pycurl
+        sys.stderr = self.stderr
+        ps.Web._transport = None
+        ps.Web._transportClass = None
+
+    def testGrab(self):
+        ps.Web.transportName = 'grab'
+        transport = ps.Web._getTransport()
+        self.assertIsInstance(transport, ps.GrabTransport)
+        self.assertIs(ps.Web._getTransport(), transport)
+
+    @unittest.skipIf(ps.pycurl is None, 'pycurl is not installed')
+    def testCurlMulti(self):
+        ps.Web.transportName = 'curlMulti'
+        transport = ps.Web._getTransport()
+        self.assertIsInstance(transport, ps.CurlMultiTransport)
+        self.assertIs(ps.Web._getTransport(), transport)
+        ps.Web.transportName = 'grab'
+        self.assertIsInstance(ps.Web._getTransport(), ps.GrabTransport)
+
+    def testGrabWithoutPycurl(self):
+        ps.pycurl = None
+        sys.stderr = StringIO.StringIO()
+        ps.Web.transportName = 'curlMulti'
+        transport = ps.Web._getTransport()
+        self.assertIsInstance(transport, ps.GrabTransport)
+        self.assertIs(ps.Web._getTransport(), transport)
+        self.assertEqual(sys.stderr.getvalue().count('GrabTransport'), 1)
+
+    def testTransportGo(self):
+        self.assertRaises(NotImplementedError, ps.Transport().go
+                          , 'http://example.com/')
+
+
+@unittest.skipIf(ps.pycurl is None, 'pycurl is not installed')
+class CurlMultiLoopTest(unittest.TestCase):
+
+    def testLoopError(self):
+        transport = ps.CurlMultiTransport()
+        transport._multi = FailingMulti()
+        for _ in range(2):
+            try:
+                transport.go('http://example.com/')
+            except ps.WebInternalError as e:
+                self.assertIsInstance(e.originalException, RuntimeError)
+            else:
+                self.fail('WebInternalError is not raised')
+        self.assertEqual(transport._active, set())
+
+    def testNoAnswer(self):
+        transport = ps.CurlMultiTransport()
+        transport._multi = SilentMulti()
+        transport.connectTimeout = 0
+        transport.timeout = 0
+        transport.waitMargin = 0.2
+        transport.watchPeriod = 0.1
+        startTime = time.time()
+        self.assertRaises(grab.error.GrabTimeoutError, transport.go
+                          , 'http://example.com/')
+        self.assertLess(time.time() - startTime, 2)
+        self.assertEqual(transport._waiting, set())
+
+    def createSilent(self, multi):
+        transport = ps.CurlMultiTransport()
+        transport._multi = multi
+        transport.waitMargin = 0.2
+        transport.watchPeriod = 0.1
+        return transport
+
+    def testRetryAfterCancel(self):
+        multi = RecordingMulti()
+        transport = self.createSilent(multi)
+        self.assertRaises(grab.error.GrabTimeoutError, transport.go
+                          , 'http://example.com/', hammer_mode=True
+                          , hammer_timeouts=((0, 0), (0, 0)))
+        # the next attempt starts when the previous one is stopped
+        self.assertEqual(multi.events, [('add', 'http://example.com/')
+                                        , ('remove', None)] * 2)
+        self.assertEqual(transport._active, set())
+
+    def testNoRetryInFlight(self):
+        multi = HangingMulti()
+        transport = self.createSilent(multi)
+        self.assertRaises(grab.error.GrabTimeoutError, transport.go
+                          , 'http://example.com/', hammer_mode=True
+                          , hammer_timeouts=((0, 0), (0, 0)))
+        self.assertEqual(multi.events, [('add', 'http://example.com/')])
+
+    def testDelayedCancelled(self):
+        transport = ps.CurlMultiTransport()
+        request = ps._CurlRequest('http://example.com/', None, 0, 0, {})
+        other = ps._CurlRequest('http://example.com/other', None, 0, 0, {})
+        transport._delayed = [(time.time() + 60, 0, request)
+                              , (time.time() + 61, 1, other)]
+        transport._cancel(request)
+        self.assertEqual([entry[2] for entry in transport._delayed], [other])
+        self.assertTrue(request.cancelDone.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()
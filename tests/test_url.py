@@ -0,0 +1,110 @@
+"""
+The url resolution of nodes: a Url leaf and a page href under the same
+parent resolve to the same absolute url, and the kept urls follow the
+changes of the urls and the parents above them.
+"""
+import os.path
+import sys
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import parssite as ps
+
+BASE = 'http://h.com/dir/page.html?page=2'
+
+
+def chain(url, depth):
+    root = ps.Str(None)
+    root._url = url
+    node = root
+    for _ in range(depth):
+        child = ps.Str(None)
+        child.parent = node
+        node = child
+    return root, node
+
+
+def leaf(parent, href):
+    node = ps.Url(None)
+    node.parent = parent
+    node._url = href
+    return node
+
+
+class ResolutionTest(unittest.TestCase):
+
+    def testSameAsPageHref(self):
+        _, parent = chain(BASE, 3)
+        page = ps.Page(None)
+        page.parent = parent
+        for href, url in (('../up.html', 'http://h.com/up.html')
+                          , ('item.html', 'http://h.com/dir/item.html')
+                          , ('/abs', 'http://h.com/abs')
+                          , ('?page=3', 'http://h.com/dir/page.html?page=3')
+                          , ('#top', 'http://h.com/dir/page.html?page=2#top')
+                          , ('//g.com/x', 'http://g.com/x')
+                          , ('https://s.com/', 'https://s.com/')):
+            self.assertEqual(leaf(parent, href)._url, url)
+            self.assertEqual(page._absoluteUrl(href), url)
+
+    def testParts(self):
+        _, parent = chain(BASE, 1)
+        node = leaf(parent, '../up.html#a')
+        self.assertEqual((node._url_scheme, node._url_netloc, node._url_path
+                          , node._url_query, node._url_fragment)
+                         , ('http', 'h.com', '/up.html', '', 'a'))
+
+    def testLocalPart(self):
+        _, parent = chain(BASE, 1)
+        node = ps.Str(None)
+        node.parent = parent
+        node._url_query = 'page=5'
+        self.assertEqual(node._url, 'http://h.com/dir/page.html?page=5')
+
+    def testNoParentUrl(self):
+        _, parent = chain('', 2)
+        self.assertEqual(leaf(parent, '../up.html')._url, '../up.html')
+
+
+class ChangeTest(unittest.TestCase):
+
+    def testRootUrlChanged(self):
+        root, parent = chain(BASE, 4)
+        node = leaf(parent, 'item.html')
+        self.assertEqual(node._url, 'http://h.com/dir/item.html')
+        root._url = 'http://g.com/other/'
+        self.assertEqual(node._url, 'http://g.com/other/item.html')
+
+    def testParentChanged(self):
+        _, parent = chain(BASE, 2)
+        node = leaf(parent, 'item.html')
+        self.assertEqual(node._url, 'http://h.com/dir/item.html')
+        _, otherParent = chain('http://g.com/', 2)
+        parent.parent = otherParent
+        self.assertEqual(node._url, 'http://g.com/item.html')
+
+    def testUrlSetOnPassedParent(self):
+        _, parent = chain(BASE, 2)
+        node = leaf(parent, 'item.html')
+        self.assertEqual(node._url, 'http://h.com/dir/item.html')
+        parent.parent._url = 'other/'
+        self.assertEqual(node._url, 'http://h.com/dir/other/item.html')
+
+    def testUrlAboveRelativeParentSet(self):
+        root, parent = chain('', 1)
+        parent._url = '/dir/'
+        node = leaf(parent, 'item.html')
+        self.assertEqual(node._url, '/dir/item.html')
+        root._url = 'http://h.com/'
+        self.assertEqual(node._url, 'http://h.com/dir/item.html')
+
+    def testOtherTreesKept(self):
+        _, parent = chain(BASE, 2)
+        node = leaf(parent, 'item.html')
+        kept = node._resolvedUrlParts()
+        otherRoot, _ = chain('http://g.com/', 1)
+        otherRoot._url = 'http://g.com/changed/'
+        self.assertIs(node._resolvedUrlParts(), kept)
+
+
+if __name__ == '__main__':
+    unittest.main()